@@ -0,0 +1 @@
+"""Offline load tests for mcp-managed-rag and bot-managed-rag (``python -m bench --help``)."""
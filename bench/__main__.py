@@ -0,0 +1,164 @@
+"""Offline benchmark of the MCP server and the bot against local fake upstreams.
+
+Examples (from the repository root, in the bot environment)::
+
+    python -m bench server --requests 500 --concurrency 32
+    python -m bench bot --requests 200 --concurrency 16 --llm-answer-tokens 300
+    python -m bench webhook --requests 200 --concurrency 32 --workers 4
+    python -m bench server --transport streamable-http --server-workers 4 --shared-store redis
+    python -m bench compare bench/results/old.json bench/results/new.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from loguru import logger
+
+from . import report, scenarios
+from .fakes import FakeConfig, FakeUpstreams
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def _add_fake_options(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("fake upstreams")
+    for f in dataclasses.fields(FakeConfig):
+        option = "--" + f.name.replace("_", "-")
+        if f.name == "seed":
+            group.add_argument(option, type=int, default=None)
+        else:
+            group.add_argument(option, type=type(f.default), default=f.default, metavar=f.name.upper())
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    for name, help_text in (
+        ("server", "call request_to_rag on mcp-managed-rag/server.py"),
+        ("bot", "send Telegram messages through the bot's on_text handler"),
+        ("webhook", "POST Telegram updates to the bot running in webhook mode"),
+    ):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--requests", type=int, default=200, help="measured requests (default 200)")
+        p.add_argument("--concurrency", type=int, default=16, help="concurrent clients / chats (default 16)")
+        p.add_argument("--warmup", type=int, default=2, help="sequential requests before measuring")
+        p.add_argument(
+            "--unique-queries",
+            type=int,
+            default=0,
+            help="cycle through this many distinct questions to exercise the cache (0: all distinct)",
+        )
+        p.add_argument("--transport", choices=("sse", "streamable-http"), default="sse")
+        p.add_argument(
+            "--server-python",
+            default=sys.executable,
+            help="interpreter with the mcp-managed-rag dependencies (default: this one)",
+        )
+        p.add_argument(
+            "--server-workers",
+            type=int,
+            default=1,
+            help="MCP_WORKERS of the server; more than one needs --transport streamable-http",
+        )
+        p.add_argument(
+            "--shared-store",
+            choices=("none", "sqlite", "redis"),
+            help="MCP_SHARED_STORE of the server (redis is served by a local fake)",
+        )
+        p.add_argument("--output", type=Path, help="result file (default: bench/results/<scenario>-<time>.json)")
+        p.add_argument("--label", help="free-form note stored in the result file, e.g. a release tag")
+        if name == "server":
+            p.add_argument("--tool", default="request_to_rag")
+        if name == "webhook":
+            p.add_argument("--workers", type=int, default=2, help="BOT_WEBHOOK_WORKERS (default 2)")
+        _add_fake_options(p)
+
+    p = sub.add_parser("compare", help="compare two result files")
+    p.add_argument("baseline", type=Path)
+    p.add_argument("candidate", type=Path)
+    return parser
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    fake_config = FakeConfig(**{f.name: getattr(args, f.name) for f in dataclasses.fields(FakeConfig)})
+    started_at = datetime.now(timezone.utc)
+    output: Path = args.output or RESULTS_DIR / f"{args.scenario}-{started_at:%Y%m%d-%H%M%S}.json"
+    common = dict(
+        transport=args.transport,
+        python=args.server_python,
+        log_path=output.with_suffix(".server.log"),
+        requests=args.requests,
+        concurrency=args.concurrency,
+        warmup=args.warmup,
+        unique_queries=args.unique_queries,
+        server_workers=args.server_workers,
+        shared_store=args.shared_store,
+    )
+    async with FakeUpstreams(fake_config) as fakes:
+        if args.scenario == "server":
+            samples = await scenarios.run_server(fakes, tool=args.tool, **common)
+        elif args.scenario == "webhook":
+            samples = await scenarios.run_webhook(fakes, workers=args.workers, **common)
+        else:
+            samples = await scenarios.run_bot(fakes, **common)
+        upstreams = fakes.stats()
+
+    ok = len(samples.latencies)
+    result = {
+        "scenario": args.scenario,
+        "label": args.label,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": report.git_commit(),
+        "python": sys.version.split()[0],
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "unique_queries": args.unique_queries,
+            "transport": args.transport,
+            "server_workers": args.server_workers,
+            "shared_store": args.shared_store,
+            **({"tool": args.tool} if args.scenario == "server" else {}),
+            **({"workers": args.workers} if args.scenario == "webhook" else {}),
+            "fakes": dataclasses.asdict(fake_config),
+        },
+        "requests": args.requests,
+        "ok": ok,
+        "errors": len(samples.errors),
+        "error_rate": round(len(samples.errors) / args.requests, 4) if args.requests else 0.0,
+        "error_samples": samples.errors[:5],
+        "duration_sec": round(samples.duration, 3),
+        "throughput_per_sec": round(ok / samples.duration, 3) if samples.duration else 0.0,
+        "latency_ms": report.summarize(samples.latencies),
+        "ttft_ms": report.summarize(samples.ttfts) if args.scenario != "server" else None,
+        "upstreams": upstreams,
+    }
+    report.write_results(output, result)
+    logger.info(f"Results written to {output}")
+    return result
+
+
+def main() -> None:
+    parser = _parser()
+    args = parser.parse_args()
+    if getattr(args, "server_workers", 1) > 1 and args.transport != "streamable-http":
+        parser.error("--server-workers > 1 needs --transport streamable-http")
+    if args.scenario == "compare":
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        candidate = json.loads(args.candidate.read_text(encoding="utf-8"))
+        print(report.compare(baseline, candidate))
+        return
+    result = asyncio.run(_run(args))
+    print(report.format_summary(result))
+
+
+if __name__ == "__main__":
+    main()
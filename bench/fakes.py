@@ -0,0 +1,448 @@
+"""Local stand-ins for every upstream the two services talk to.
+
+One aiohttp application serves all of them on a single port:
+
+- ``/iam/token`` — Evolution IAM (``AUTH_URL`` of the MCP server)
+- ``/rag/{kb_id}/api/v1/retrieve`` — Managed RAG retrieve
+- ``/gigachat/oauth``, ``/gigachat/api/v1/models`` and
+  ``/gigachat/api/v1/chat/completions`` — GigaChat with streaming and function calls
+- ``/telegram/bot{token}/{method}`` — the Telegram Bot API
+
+``FakeRedis`` is a separate minimal Redis for the shared store of a
+multi-worker MCP server.
+
+Latency, payload size and error rate are configurable, so a run can reproduce
+a slow knowledge base or a flaky upstream without touching real services.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+_WORDS = (
+    "база знаний документ сервис доступ проект версия запрос ответ настройка "
+    "ключ токен кластер модель инструмент поиск контекст пользователь оплата "
+    "лимит квота регион сеть диск резервное копирование мониторинг журнал"
+).split()
+
+# Last token of every fake LLM answer
+ANSWER_END = "∎"
+
+
+@dataclass
+class FakeConfig:
+    iam_latency_ms: float = 20.0
+    iam_token_ttl_sec: float = 3600.0
+    rag_latency_ms: float = 150.0
+    rag_jitter_ms: float = 50.0
+    rag_error_rate: float = 0.0
+    rag_documents: int = 6
+    rag_document_chars: int = 1200
+    llm_tool_call_ms: float = 400.0
+    llm_first_token_ms: float = 300.0
+    llm_token_delay_ms: float = 20.0
+    llm_answer_tokens: int = 200
+    telegram_latency_ms: float = 30.0
+    telegram_retry_after_rate: float = 0.0
+    seed: int | None = None
+
+
+@dataclass
+class TelegramEvent:
+    at: float
+    method: str
+    message_id: int
+    text: str
+
+
+class FakeUpstreams:
+    """Fake IAM, Managed RAG, GigaChat and Telegram servers in one aiohttp app.
+
+    Every handled request is counted in ``requests`` (and failures in
+    ``errors``) by route, and every message the bot sends or edits is recorded
+    per chat with a ``time.monotonic()`` timestamp.
+    """
+
+    def __init__(self, config: FakeConfig, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.config = config
+        self._host = host
+        self._port = port
+        self._rng = random.Random(config.seed)
+        self._runner: web.AppRunner | None = None
+        self._message_ids = 0
+        self.requests: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+        self.chat_events: dict[int, list[TelegramEvent]] = defaultdict(list)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self._host}:{self._port}"
+
+    @property
+    def iam_url(self) -> str:
+        return f"{self.base_url}/iam/token"
+
+    @property
+    def rag_url_template(self) -> str:
+        return f"{self.base_url}/rag/{{kb_id}}/api/v1/retrieve"
+
+    @property
+    def gigachat_base_url(self) -> str:
+        return f"{self.base_url}/gigachat/api/v1"
+
+    @property
+    def gigachat_auth_url(self) -> str:
+        return f"{self.base_url}/gigachat/oauth"
+
+    @property
+    def telegram_api_url(self) -> str:
+        return f"{self.base_url}/telegram"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/iam/token", self._iam_token)
+        app.router.add_post("/rag/{kb_id}/api/v1/retrieve", self._rag_retrieve)
+        app.router.add_post("/gigachat/oauth", self._gigachat_oauth)
+        app.router.add_get("/gigachat/api/v1/models", self._gigachat_models)
+        app.router.add_post("/gigachat/api/v1/chat/completions", self._gigachat_completions)
+        app.router.add_post("/telegram/bot{token}/{method}", self._telegram_method)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        # Port 0 means "any free port": read back the one we got
+        self._port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> FakeUpstreams:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.stop()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+    async def wait_for_answer(self, chat_id: int, since: float, timeout: float) -> list[TelegramEvent]:
+        """Events of ``chat_id`` after ``since`` once the bot shows a complete answer or an error.
+
+        For bots running in another process, where the scheduler cannot be joined.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            events = [e for e in self.chat_events.get(chat_id, ()) if e.at >= since]
+            if events and (ANSWER_END in events[-1].text or events[-1].text.startswith(("❌", "🚦"))):
+                return events
+            await asyncio.sleep(0.01)
+        raise TimeoutError(f"no complete answer in chat {chat_id} after {timeout:.0f}s")
+
+    async def _sleep_ms(self, mean: float, jitter: float = 0.0) -> None:
+        delay = self._rng.gauss(mean, jitter) if jitter else mean
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    # IAM
+
+    async def _iam_token(self, request: web.Request) -> web.Response:
+        self.requests["iam"] += 1
+        await self._sleep_ms(self.config.iam_latency_ms)
+        return web.json_response(
+            {"access_token": f"fake-iam-{uuid.uuid4().hex}", "expires_in": self.config.iam_token_ttl_sec}
+        )
+
+    # Managed RAG
+
+    async def _rag_retrieve(self, request: web.Request) -> web.Response:
+        self.requests["rag"] += 1
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            self.errors["rag"] += 1
+            return web.json_response({"detail": "unauthorized"}, status=401)
+        body = await request.json()
+        await self._sleep_ms(self.config.rag_latency_ms, self.config.rag_jitter_ms)
+        if self._rng.random() < self.config.rag_error_rate:
+            self.errors["rag"] += 1
+            return web.json_response({"detail": "fake upstream error"}, status=503)
+        query = str(body.get("query", ""))
+        limit = min(int(body.get("retrieve_limit") or self.config.rag_documents), self.config.rag_documents)
+        return web.json_response({"results": [self._document(query, i) for i in range(limit)]})
+
+    def _document(self, query: str, rank: int) -> dict[str, object]:
+        # Deterministic per query, and different per rank so the context packer keeps them all
+        rng = random.Random(f"{query}:{rank}")
+        words: list[str] = [query]
+        size = len(query)
+        while size < self.config.rag_document_chars:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return {
+            "content": " ".join(words)[: self.config.rag_document_chars],
+            "score": round(1.0 - rank * 0.05, 3),
+            "metadata": {"source": f"bench/doc-{rank}.md", "title": f"Документ {rank}"},
+        }
+
+    # GigaChat
+
+    async def _gigachat_oauth(self, request: web.Request) -> web.Response:
+        self.requests["gigachat_oauth"] += 1
+        expires_at = int((time.time() + 1800) * 1000)
+        return web.json_response({"access_token": "fake-gigachat", "expires_at": expires_at})
+
+    async def _gigachat_models(self, request: web.Request) -> web.Response:
+        self.requests["gigachat_models"] += 1
+        model = {"id": "GigaChat", "object": "model", "owned_by": "salutedevices"}
+        return web.json_response({"object": "list", "data": [model]})
+
+    async def _gigachat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests["gigachat"] += 1
+        body = await request.json()
+        messages = body.get("messages") or []
+        functions = [f.get("name") for f in body.get("functions") or []]
+        last = messages[-1] if messages else {}
+        # First turn of a ReAct run: call the RAG tool; after the tool result: answer
+        if functions and last.get("role") == "user":
+            name = "request_to_rag" if "request_to_rag" in functions else functions[0]
+            await self._sleep_ms(self.config.llm_tool_call_ms)
+            delta = {
+                "role": "assistant",
+                "content": "",
+                "function_call": {"name": name, "arguments": {"query": str(last.get("content", ""))}},
+                "functions_state_id": str(uuid.uuid4()),
+            }
+            chunks = [(delta, "function_call")]
+        else:
+            await self._sleep_ms(self.config.llm_first_token_ms)
+            chunks = [
+                ({"role": "assistant", "content": self._rng.choice(_WORDS) + " "}, None)
+                for _ in range(self.config.llm_answer_tokens)
+            ]
+            # The marker tells an observer of the Telegram side that the answer is complete
+            chunks.append(({"role": "assistant", "content": ANSWER_END}, "stop"))
+
+        model = body.get("model") or "GigaChat"
+        if not body.get("stream"):
+            content = "".join(d.get("content", "") for d, _ in chunks)
+            message = {**chunks[0][0], "content": content}
+            return web.json_response(
+                {
+                    "choices": [{"message": message, "index": 0, "finish_reason": chunks[-1][1]}],
+                    "created": int(time.time()),
+                    "model": model,
+                    "object": "chat.completion",
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(chunks), "total_tokens": len(chunks)},
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i, (delta, finish_reason) in enumerate(chunks):
+            if i:
+                await self._sleep_ms(self.config.llm_token_delay_ms)
+            choice: dict[str, object] = {"delta": delta, "index": 0}
+            if finish_reason:
+                choice["finish_reason"] = finish_reason
+            event = {"choices": [choice], "created": int(time.time()), "model": model, "object": "chat.completion"}
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # Telegram Bot API
+
+    async def _telegram_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.requests[f"telegram.{method}"] += 1
+        params = dict(await request.post())
+        await self._sleep_ms(self.config.telegram_latency_ms)
+        if method == "getMe":
+            return _ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method not in ("sendMessage", "editMessageText"):
+            return _ok(True)
+
+        if method == "editMessageText" and self._rng.random() < self.config.telegram_retry_after_rate:
+            self.errors[f"telegram.{method}"] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }
+            )
+
+        chat_id = int(str(params["chat_id"]))
+        text = str(params.get("text", ""))
+        if method == "sendMessage":
+            self._message_ids += 1
+            message_id = self._message_ids
+        else:
+            message_id = int(str(params["message_id"]))
+        self.chat_events[chat_id].append(TelegramEvent(time.monotonic(), method, message_id, text))
+        return _ok(
+            {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+        )
+
+
+class FakeRedis:
+    """In-memory server for the subset of RESP the MCP server's ``RedisStore`` uses.
+
+    Supports PING, GET, SET with EX/PX/NX, DEL and WATCH/MULTI/EXEC
+    transactions over RESP2, and answers OK to the connection setup commands
+    CLIENT and SELECT. Commands are counted in ``commands``.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._host = host
+        self._port = port
+        self._server: asyncio.base_events.Server | None = None
+        self._data: dict[bytes, tuple[bytes, float | None]] = {}
+        # Bumped on every change of a key, expiry included; WATCH compares them
+        self._versions: Counter[bytes] = Counter()
+        self.commands: Counter[str] = Counter()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self._host}:{self._port}/0"
+
+    async def __aenter__(self) -> FakeRedis:
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = _RedisConnection()
+        try:
+            while True:
+                command = await _read_command(reader)
+                if command is None:
+                    break
+                writer.write(self._execute(command, connection))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _lookup(self, key: bytes) -> bytes | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            self._versions[key] += 1
+            return None
+        return entry[0]
+
+    def _execute(self, command: list[bytes], connection: _RedisConnection) -> bytes:
+        name = command[0].decode().upper()
+        self.commands[name] += 1
+        args = command[1:]
+        if connection.queued is not None and name not in ("EXEC", "DISCARD", "MULTI", "WATCH"):
+            connection.queued.append(command)
+            return b"+QUEUED\r\n"
+        if name == "WATCH":
+            for key in args:
+                self._lookup(key)
+                connection.watched[key] = self._versions[key]
+            return b"+OK\r\n"
+        if name == "UNWATCH":
+            connection.watched.clear()
+            return b"+OK\r\n"
+        if name == "MULTI":
+            connection.queued = []
+            return b"+OK\r\n"
+        if name == "DISCARD":
+            connection.queued = None
+            connection.watched.clear()
+            return b"+OK\r\n"
+        if name == "EXEC":
+            queued, connection.queued = connection.queued or [], None
+            for key in connection.watched:
+                self._lookup(key)
+            changed = any(self._versions[key] != version for key, version in connection.watched.items())
+            connection.watched.clear()
+            if changed:
+                return b"*-1\r\n"
+            replies = [self._execute(c, connection) for c in queued]
+            return b"*%d\r\n" % len(replies) + b"".join(replies)
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("CLIENT", "SELECT"):
+            return b"+OK\r\n"
+        if name == "GET":
+            value = self._lookup(args[0])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == "SET":
+            key, value, expires_at, nx = args[0], args[1], None, False
+            options = [a.decode().upper() for a in args[2:]]
+            for i, option in enumerate(options):
+                if option == "NX":
+                    nx = True
+                elif option in ("EX", "PX"):
+                    ttl = float(options[i + 1]) / (1 if option == "EX" else 1000)
+                    expires_at = time.monotonic() + ttl
+            if nx and self._lookup(key) is not None:
+                return b"$-1\r\n"
+            self._data[key] = (value, expires_at)
+            self._versions[key] += 1
+            return b"+OK\r\n"
+        if name == "DEL":
+            deleted = 0
+            for key in args:
+                if self._lookup(key) is not None:
+                    del self._data[key]
+                    self._versions[key] += 1
+                    deleted += 1
+            return b":%d\r\n" % deleted
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+
+@dataclass
+class _RedisConnection:
+    """Transaction state of one FakeRedis client connection."""
+
+    watched: dict[bytes, int] = field(default_factory=dict)
+    # Commands queued since MULTI, None outside a transaction
+    queued: list[list[bytes]] | None = None
+
+
+async def _read_command(reader: asyncio.StreamReader) -> list[bytes] | None:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from redis-cli over telnet
+        return line.split()
+    command = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        command.append((await reader.readexactly(size + 2))[:-2])
+    return command
+
+
+def _ok(result: object) -> web.Response:
+    return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,105 @@
+"""Latency summaries and machine-readable result files."""
+
+from __future__ import annotations
+
+import json
+import math
+import subprocess
+from pathlib import Path
+from typing import Any
+
+# Metrics shown by ``compare``: (path in the result file, True if higher is better)
+_COMPARED = (
+    (("throughput_per_sec",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("ttft_ms", "p50"), False),
+    (("ttft_ms", "p95"), False),
+    (("ttft_ms", "p99"), False),
+    (("error_rate",), False),
+)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """``q``-th percentile (0..100) with linear interpolation between ranks."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low, high = math.floor(pos), math.ceil(pos)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(values_sec: list[float]) -> dict[str, float | int | None]:
+    """Count, mean and tail percentiles of durations given in seconds, reported in ms."""
+    if not values_sec:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    ms = [v * 1000 for v in values_sec]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 2),
+        "p50": round(percentile(ms, 50), 2),
+        "p95": round(percentile(ms, 95), 2),
+        "p99": round(percentile(ms, 99), 2),
+        "max": round(max(ms), 2),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def write_results(path: Path, result: dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+def format_summary(result: dict[str, Any]) -> str:
+    lines = [
+        f"scenario={result['scenario']} commit={result.get('git_commit')} "
+        f"requests={result['requests']} ok={result['ok']} errors={result['errors']}",
+        f"throughput: {result['throughput_per_sec']:.2f} msg/s over {result['duration_sec']:.2f}s",
+    ]
+    for key in ("latency_ms", "ttft_ms"):
+        stats = result.get(key)
+        if stats and stats["count"]:
+            lines.append(
+                f"{key}: p50={stats['p50']} p95={stats['p95']} p99={stats['p99']} "
+                f"mean={stats['mean']} max={stats['max']}"
+            )
+    return "\n".join(lines)
+
+
+def _lookup(result: dict[str, Any], path: tuple[str, ...]) -> float | None:
+    value: Any = result
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(baseline: dict[str, Any], candidate: dict[str, Any]) -> str:
+    """Side-by-side table of two result files; ``!`` marks a regression over 5%."""
+    lines = [f"{'metric':<20} {'baseline':>12} {'candidate':>12} {'change':>9}"]
+    for path, higher_is_better in _COMPARED:
+        old, new = _lookup(baseline, path), _lookup(candidate, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change < -5 if higher_is_better else change > 5
+        lines.append(
+            f"{'.'.join(path):<20} {old:>12.2f} {new:>12.2f} {change:>+8.1f}%" + (" !" if worse else "")
+        )
+    return "\n".join(lines)
@@ -0,0 +1,377 @@
+"""Load scenarios: the MCP server alone, the bot ``on_text`` path in process, and the bot in webhook mode."""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import socket
+import sys
+import time
+import tempfile
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import aiohttp
+from loguru import logger
+
+from .fakes import FakeRedis, FakeUpstreams
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVER_SCRIPT = ROOT / "mcp-managed-rag" / "server.py"
+BOT_PACKAGE_DIR = ROOT / "bot-managed-rag"
+
+# The bot is imported from its source tree, the same way main.py runs it
+if str(BOT_PACKAGE_DIR) not in sys.path:
+    sys.path.insert(0, str(BOT_PACKAGE_DIR))
+
+BOT_PLACEHOLDER = "⏳ Думаю"
+
+
+@dataclass
+class Samples:
+    """Raw measurements of one run; ``report.summarize`` turns them into percentiles."""
+
+    latencies: list[float] = field(default_factory=list)
+    ttfts: list[float] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    duration: float = 0.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _mcp_url(port: int, transport: str) -> str:
+    path = "/sse" if transport == "sse" else "/mcp"
+    return f"http://127.0.0.1:{port}{path}"
+
+
+@asynccontextmanager
+async def mcp_server(
+    fakes: FakeUpstreams,
+    transport: str,
+    python: str,
+    log_path: Path,
+    workers: int = 1,
+    shared_store: str | None = None,
+    startup_timeout: float = 30.0,
+) -> AsyncIterator[str]:
+    """Run ``mcp-managed-rag/server.py`` against the fakes; yields its MCP URL.
+
+    Tuning variables (``RETRIEVE_LIMIT``, ``RAG_CACHE_*``, ``RAG_HTTP_*``...) are
+    inherited from the environment, so they can be swept between runs. With
+    ``workers`` > 1 the server runs that many processes sharing ``shared_store``
+    (``sqlite`` in a temporary file, or ``redis`` served by ``FakeRedis`` unless
+    ``MCP_SHARED_STORE_URL`` points elsewhere).
+    """
+    port = _free_port()
+    env = {
+        **os.environ,
+        "MCP_HOST": "127.0.0.1",
+        "MCP_PORT": str(port),
+        "MCP_TRANSPORT": transport,
+        "EVOLUTION_AUTH_URL": fakes.iam_url,
+        "MANAGED_RAG_RETRIEVE_URL_TEMPLATE": fakes.rag_url_template,
+        "EVOLUTION_SERVICE_ACCOUNT_KEY_ID": "bench",
+        "EVOLUTION_SERVICE_ACCOUNT_KEY_SECRET": "bench",
+        "EVOLUTION_PROJECT_ID": os.getenv("EVOLUTION_PROJECT_ID", "bench-project"),
+        "KNOWLEDGE_BASE_ID": os.getenv("KNOWLEDGE_BASE_ID", "bench-kb"),
+        "KNOWLEDGE_BASE_VERSION_ID": os.getenv("KNOWLEDGE_BASE_VERSION_ID", "bench-version"),
+    }
+    # Persisted cache from a previous run would turn every request into a hit
+    env.pop("RAG_CACHE_PERSIST_PATH", None)
+    cmd = [python, str(SERVER_SCRIPT)]
+    async with AsyncExitStack() as stack:
+        if workers > 1:
+            env.update(MCP_WORKERS=str(workers), MCP_STATELESS_HTTP="true")
+        if shared_store:
+            env["MCP_SHARED_STORE"] = shared_store
+        if shared_store == "sqlite" or (workers > 1 and not shared_store):
+            store_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-store-"))
+            env["MCP_SHARED_STORE_PATH"] = str(Path(store_dir) / "store.sqlite")
+        if shared_store == "redis" and "MCP_SHARED_STORE_URL" not in os.environ:
+            redis = await stack.enter_async_context(FakeRedis())
+            env["MCP_SHARED_STORE_URL"] = redis.url
+        await stack.enter_async_context(
+            _process(cmd, SERVER_SCRIPT.parent, env, log_path, f"http://127.0.0.1:{port}/metrics", startup_timeout)
+        )
+        logger.info(f"MCP server is up on port {port} with {workers} worker(s) (log: {log_path})")
+        yield _mcp_url(port, transport)
+
+
+@asynccontextmanager
+async def _process(
+    cmd: list[str],
+    cwd: Path,
+    env: dict[str, str],
+    log_path: Path,
+    ready_url: str,
+    startup_timeout: float,
+) -> AsyncIterator[asyncio.subprocess.Process]:
+    """Run ``cmd`` until the block exits; ready once ``ready_url`` answers 200. Stopped with SIGTERM."""
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open("wb") as log:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, cwd=str(cwd), env=env, stdout=log, stderr=asyncio.subprocess.STDOUT
+        )
+        try:
+            await _wait_ready(ready_url, proc, startup_timeout)
+            yield proc
+        finally:
+            if proc.returncode is None:
+                proc.terminate()
+                try:
+                    await asyncio.wait_for(proc.wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+
+
+async def _wait_ready(url: str, proc: asyncio.subprocess.Process, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if proc.returncode is not None:
+                raise RuntimeError(f"{url} process exited with code {proc.returncode} during startup")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready in {timeout:.0f}s")
+
+
+async def _closed_loop(
+    requests: int,
+    concurrency: int,
+    one: Callable[[int, int], Awaitable[None]],
+) -> float:
+    """Run ``one(worker, i)`` for i in range(requests) on ``concurrency`` workers; returns wall time."""
+    counter = itertools.count()
+
+    async def worker(worker_id: int) -> None:
+        while (i := next(counter)) < requests:
+            await one(worker_id, i)
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return time.monotonic() - started
+
+
+def _query(i: int, unique_queries: int) -> str:
+    n = i % unique_queries if unique_queries > 0 else i
+    return f"Как настроить доступ к сервису, вопрос {n}?"
+
+
+async def run_server(
+    fakes: FakeUpstreams,
+    *,
+    transport: str,
+    python: str,
+    log_path: Path,
+    tool: str,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    unique_queries: int,
+    server_workers: int = 1,
+    shared_store: str | None = None,
+) -> Samples:
+    """Call an MCP tool of the server directly, one pooled session per worker."""
+    from app.mcp_client import McpSessionPool
+
+    samples = Samples()
+    async with mcp_server(fakes, transport, python, log_path, server_workers, shared_store) as url:
+        async with McpSessionPool(url, transport=transport, size=concurrency) as pool:
+
+            async def call(i: int) -> None:
+                await pool.call_tool_text(tool, {"query": _query(i, unique_queries)}, request_id=f"bench-{i}")
+
+            for i in range(warmup):
+                await call(-1 - i)
+
+            async def one(worker_id: int, i: int) -> None:
+                started = time.monotonic()
+                try:
+                    await call(i)
+                except Exception as e:
+                    samples.errors.append(repr(e))
+                    return
+                samples.latencies.append(time.monotonic() - started)
+
+            samples.duration = await _closed_loop(requests, concurrency, one)
+    return samples
+
+
+def _bot_env(fakes: FakeUpstreams, mcp_url: str, transport: str) -> dict[str, str]:
+    return {
+        "TELEGRAM_BOT_TOKEN": "123456:bench",
+        "TELEGRAM_API_URL": fakes.telegram_api_url,
+        "MCP_SERVER_URL": mcp_url,
+        "MCP_TRANSPORT": transport,
+        "MCP_RAG_TOOL_NAME": "request_to_rag",
+        "GIGACHAT_CREDENTIALS": "YmVuY2g6YmVuY2g=",
+        "GIGACHAT_BASE_URL": fakes.gigachat_base_url,
+        "GIGACHAT_AUTH_URL": fakes.gigachat_auth_url,
+        "GIGACHAT_VERIFY_SSL": "false",
+        "METRICS_PORT": "0",
+    }
+
+
+def _update(i: int, chat_id: int, text: str) -> Any:
+    from datetime import datetime
+
+    from aiogram.types import Chat, Message, Update, User
+
+    user = User(id=chat_id, is_bot=False, first_name=f"bench-{chat_id}")
+    message = Message(
+        message_id=i + 1,
+        date=datetime.now(),
+        chat=Chat(id=chat_id, type="private"),
+        from_user=user,
+        text=text,
+    )
+    return Update(update_id=i + 1, message=message)
+
+
+async def run_bot(
+    fakes: FakeUpstreams,
+    *,
+    transport: str,
+    python: str,
+    log_path: Path,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    unique_queries: int,
+    server_workers: int = 1,
+    shared_store: str | None = None,
+) -> Samples:
+    """Feed Telegram updates to the real dispatcher; every worker is its own chat.
+
+    Latency runs from handing the update to the dispatcher until the answer's
+    last message edit; time to first token until the first edit that shows
+    answer text instead of the placeholder.
+    """
+    samples = Samples()
+    async with mcp_server(fakes, transport, python, log_path, server_workers, shared_store) as url:
+        os.environ.update(_bot_env(fakes, url, transport))
+        from app.bot import build_bot, warm_up
+        from app.config import Settings
+
+        runtime = build_bot(Settings.load())
+        try:
+            await warm_up(runtime)
+            async with runtime.mcp_pool:
+
+                async def send(chat_id: int, i: int) -> tuple[float, float | None, str]:
+                    started = time.monotonic()
+                    await runtime.dp.feed_update(runtime.bot, _update(i, chat_id, _query(i, unique_queries)))
+                    await runtime.scheduler.join(chat_id)
+                    events = [e for e in fakes.chat_events.pop(chat_id, []) if e.at >= started]
+                    if not events:
+                        raise RuntimeError("the bot sent nothing")
+                    first_answer = next((e.at for e in events if e.text != BOT_PLACEHOLDER), None)
+                    ttft = first_answer - started if first_answer is not None else None
+                    return events[-1].at - started, ttft, events[-1].text
+
+                for i in range(warmup):
+                    await send(10**9 + i, -1 - i)
+
+                async def one(worker_id: int, i: int) -> None:
+                    try:
+                        latency, ttft, final_text = await send(worker_id + 1, i)
+                    except Exception as e:
+                        samples.errors.append(repr(e))
+                        return
+                    if final_text.startswith(("❌", "🚦")):
+                        samples.errors.append(final_text[:200])
+                        return
+                    samples.latencies.append(latency)
+                    if ttft is not None:
+                        samples.ttfts.append(ttft)
+
+                samples.duration = await _closed_loop(requests, concurrency, one)
+        finally:
+            await runtime.bot.session.close()
+    return samples
+
+
+async def run_webhook(
+    fakes: FakeUpstreams,
+    *,
+    transport: str,
+    python: str,
+    log_path: Path,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    unique_queries: int,
+    server_workers: int = 1,
+    shared_store: str | None = None,
+    workers: int,
+    answer_timeout: float = 120.0,
+) -> Samples:
+    """POST updates to the bot running in webhook mode (``main.py``, ``workers`` processes).
+
+    The bot lives in other processes, so an answer counts as complete once the
+    fake Telegram API sees the fake LLM's end marker (or an error message).
+    """
+    samples = Samples()
+    async with mcp_server(fakes, transport, python, log_path, server_workers, shared_store) as url:
+        port = _free_port()
+        webhook_url = f"http://127.0.0.1:{port}/telegram/webhook"
+        env = {
+            **os.environ,
+            **_bot_env(fakes, url, transport),
+            "BOT_MODE": "webhook",
+            "BOT_WEBHOOK_HOST": "127.0.0.1",
+            "BOT_WEBHOOK_PORT": str(port),
+            "BOT_WEBHOOK_URL": webhook_url,
+            "BOT_WEBHOOK_SECRET": "bench-secret",
+            "BOT_WEBHOOK_WORKERS": str(workers),
+        }
+        bot_cmd = [sys.executable, str(BOT_PACKAGE_DIR / "main.py")]
+        bot_log = log_path.with_name(log_path.name.replace(".server.", ".bot."))
+        async with _process(bot_cmd, BOT_PACKAGE_DIR, env, bot_log, f"http://127.0.0.1:{port}/healthz", 120.0):
+            logger.info(f"Bot is up in webhook mode with {workers} workers (log: {bot_log})")
+            async with aiohttp.ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": "bench-secret"}) as http:
+
+                async def send(chat_id: int, i: int) -> tuple[float, float | None, str]:
+                    update = _update(i, chat_id, _query(i, unique_queries))
+                    started = time.monotonic()
+                    body = update.model_dump_json(exclude_none=True)
+                    async with http.post(webhook_url, data=body, headers={"Content-Type": "application/json"}) as response:
+                        if response.status != 200:
+                            raise RuntimeError(f"webhook answered {response.status}")
+                    events = await fakes.wait_for_answer(chat_id, started, answer_timeout)
+                    fakes.chat_events.pop(chat_id, None)
+                    first_answer = next((e.at for e in events if e.text != BOT_PLACEHOLDER), None)
+                    ttft = first_answer - started if first_answer is not None else None
+                    return events[-1].at - started, ttft, events[-1].text
+
+                for i in range(warmup):
+                    await send(10**9 + i, -1 - i)
+
+                async def one(worker_id: int, i: int) -> None:
+                    try:
+                        latency, ttft, final_text = await send(worker_id + 1, i)
+                    except Exception as e:
+                        samples.errors.append(repr(e))
+                        return
+                    if final_text.startswith(("❌", "🚦")):
+                        samples.errors.append(final_text[:200])
+                        return
+                    samples.latencies.append(latency)
+                    if ttft is not None:
+                        samples.ttfts.append(ttft)
+
+                samples.duration = await _closed_loop(requests, concurrency, one)
+    return samples
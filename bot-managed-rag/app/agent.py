@@ -1,15 +1,22 @@
 from __future__ import annotations
 
-from typing import Any
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
 from pathlib import Path
 from loguru import logger
 
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from langgraph.prebuilt import create_react_agent
 from langchain_gigachat import GigaChat
 
-from .mcp_client import McpClient
+from .history import ConversationStore
+from .mcp_client import McpClient, McpSessionPool
+from .metrics import AGENT_RUN_SECONDS, TOOL_CALL_SECONDS
 
 
 def load_system_prompt() -> str:
@@ -25,38 +32,322 @@ def load_system_prompt() -> str:
         return default
 
 
+@dataclass
+class AgentRunState:
+    """Per-message state handed to the shared agent through the run config."""
+
+    mcp: McpClient | McpSessionPool
+    request_id: str | None = None
+    tool_invoked: bool = False
+    # Sources of the documents the agent was given, for the answer footer
+    sources: list[str] = field(default_factory=list)
+    # Messages the graph added during the run and whether it ran to the end
+    new_messages: list[BaseMessage] = field(default_factory=list)
+    completed: bool = False
+
+    def add_sources(self, sources: list[str]) -> None:
+        self.sources.extend(s for s in sources if s not in self.sources)
+
+
+_RUN_STATE_KEY = "agent_run_state"
+
+# react: the model decides when to call request_to_rag (one extra LLM turn).
+# retrieve_first: retrieval on the raw user text starts as soon as the message
+# arrives and its result is handed to the model as an already made tool call.
+PIPELINE_MODES = ("react", "retrieve_first")
+
+
+class RagRetriever:
+    """Fetches knowledge base context for one query from the MCP server.
+
+    With ``documents_tool_name`` the server returns structured records, which
+    are rendered for the model here and whose sources are returned alongside.
+    Otherwise the pre-rendered text of ``tool_name`` is used as is.
+    """
+
+    def __init__(
+        self,
+        tool_name: str,
+        documents_tool_name: str | None = None,
+        fields: list[str] | None = None,
+        min_score: float | None = None,
+    ) -> None:
+        self.tool_name = tool_name
+        self._documents_tool_name = documents_tool_name
+        self._fields = fields
+        self._min_score = min_score
+
+    async def fetch(
+        self, query: str, mcp: McpClient | McpSessionPool, request_id: str | None
+    ) -> tuple[str, list[str]]:
+        """Context text for the model and the sources it cites."""
+        if not self._documents_tool_name:
+            with TOOL_CALL_SECONDS.labels(tool=self.tool_name).time():
+                text = await mcp.call_tool_text(name=self.tool_name, arguments={"query": query}, request_id=request_id)
+            return text, []
+        arguments: dict[str, Any] = {"query": query}
+        if self._fields:
+            arguments["fields"] = self._fields
+        if self._min_score is not None:
+            arguments["min_score"] = self._min_score
+        with TOOL_CALL_SECONDS.labels(tool=self._documents_tool_name).time():
+            documents = await mcp.call_tool_documents(
+                name=self._documents_tool_name, arguments=arguments, request_id=request_id
+            )
+        return documents.to_context(), documents.sources()
+
+
+def _format_sources(sources: list[str]) -> str:
+    return "\n\nИсточники:\n" + "\n".join(f"• {source}" for source in sources)
+
+
+def _run_state(config: RunnableConfig) -> AgentRunState:
+    state = (config.get("configurable") or {}).get(_RUN_STATE_KEY)
+    if state is None:
+        raise RuntimeError("Agent run state is missing from the run config")
+    return state
+
+
+class AgentRuntime:
+    """A compiled ReAct agent shared by all messages of the process.
+
+    The graph, the GigaChat client (with its OAuth token and HTTP pool) and the
+    system prompt are created once. Everything that belongs to a single message
+    travels through the run config, so concurrent runs do not interfere. With a
+    ``history`` store earlier turns of the chat are sent along with the question
+    and every completed run is recorded there.
+    """
+
+    def __init__(
+        self,
+        agent: Any,
+        retriever: RagRetriever,
+        pipeline: str = "react",
+        show_sources: bool = False,
+        history: ConversationStore | None = None,
+        llm: GigaChat | None = None,
+    ) -> None:
+        if pipeline not in PIPELINE_MODES:
+            raise ValueError(f"Unsupported agent pipeline {pipeline!r}; expected one of {PIPELINE_MODES}")
+        self.agent = agent
+        self._retriever = retriever
+        self._rag_tool_name = retriever.tool_name
+        self.pipeline = pipeline
+        self._show_sources = show_sources
+        self.history = history
+        self._llm = llm
+
+    async def warm_up(self) -> None:
+        """Fetch the GigaChat access token so the first answer does not wait for OAuth."""
+        if self._llm is not None:
+            # The cheapest authorized call; the chat model keeps its SDK client, and with it the token
+            await self._llm.aget_models()
+
+    def forget(self, chat_id: int) -> None:
+        """Drop the conversation history of ``chat_id``."""
+        if self.history is not None:
+            self.history.clear(chat_id)
+
+    def history_fingerprint(self, chat_id: int) -> str:
+        """Digest of the earlier turns sent with the next question of ``chat_id``; empty if there are none."""
+        return self.history.fingerprint(chat_id) if self.history is not None else ""
+
+    def record_answer(self, chat_id: int, user_text: str, answer: str) -> None:
+        """Add an answer given without running the agent to the chat's history."""
+        if self.history is not None:
+            turn = [HumanMessage(content=user_text), AIMessage(content=answer)]
+            self.history.append(chat_id, user_text, answer, turn)
+
+    def start_retrieval(
+        self,
+        user_text: str,
+        mcp: McpClient | McpSessionPool,
+        request_id: str | None = None,
+    ) -> asyncio.Task[tuple[str, list[str]]] | None:
+        """Start retrieval on the raw user text in the retrieve_first pipeline.
+
+        ``astream_answer`` calls it when no task is passed; start it earlier
+        only to overlap retrieval with other work just before the answer, since
+        the task holds an MCP session until it finishes. Returns None in the
+        react pipeline. Cancel the task if the answer is never generated.
+        """
+        if self.pipeline != "retrieve_first":
+            return None
+        return asyncio.create_task(self._retriever.fetch(user_text, mcp, request_id))
+
+    async def astream_answer(
+        self,
+        user_text: str,
+        mcp: McpClient | McpSessionPool,
+        request_id: str | None = None,
+        retrieval: asyncio.Task[tuple[str, list[str]]] | None = None,
+        chat_id: int | None = None,
+    ) -> AsyncIterator[str]:
+        """Stream answer tokens produced by the agent while it reasons and answers.
+
+        In the retrieve_first pipeline the retrieved context is injected before
+        the first model turn (``retrieval`` is started here if not given); if
+        retrieval fails, the run falls back to the plain ReAct loop. Yields
+        incremental text chunks for UI streaming; with ``show_sources`` the last
+        chunk lists the sources of the retrieved documents. ``chat_id`` selects
+        the conversation history; runs that are cancelled or fail are not
+        recorded in it.
+        """
+        logger.info(f"Agent started for user text: {user_text!r} (request_id={request_id})")
+        state = AgentRunState(mcp=mcp, request_id=request_id)
+        started = time.monotonic()
+        try:
+            if retrieval is None:
+                retrieval = self.start_retrieval(user_text, mcp, request_id)
+            history = self.history if chat_id is not None else None
+            # Earlier turns of the chat followed by the question
+            prompt = history.messages(chat_id, user_text) if history is not None else [HumanMessage(content=user_text)]
+            messages = await self._initial_messages(user_text, state, retrieval, prompt)
+            async for chunk in self._astream_chunks(messages, state):
+                yield chunk
+            if history is not None and state.completed and state.new_messages:
+                # The question is stored as typed, without the summary the store may have prepended
+                turn = [HumanMessage(content=user_text), *messages[len(prompt):], *state.new_messages]
+                answer = turn[-1].content if isinstance(turn[-1], AIMessage) else ""
+                history.append(chat_id, user_text, answer if isinstance(answer, str) else "", turn, state.sources)
+            if self._show_sources and state.sources:
+                yield _format_sources(state.sources)
+        finally:
+            if retrieval is not None and not retrieval.done():
+                retrieval.cancel()
+            AGENT_RUN_SECONDS.observe(time.monotonic() - started)
+        if not state.tool_invoked:
+            logger.warning(f"MCP tool '{self._rag_tool_name}' was NOT invoked for user text: {user_text!r}")
+
+    async def _initial_messages(
+        self,
+        user_text: str,
+        state: AgentRunState,
+        retrieval: asyncio.Task[tuple[str, list[str]]] | None,
+        prompt: list[BaseMessage],
+    ) -> list[BaseMessage]:
+        messages = list(prompt)
+        if retrieval is None:
+            return messages
+        try:
+            context, sources = await retrieval
+        except Exception as e:
+            logger.warning(f"Retrieve-first lookup failed, falling back to ReAct (request_id={state.request_id}): {e}")
+            return messages
+        state.tool_invoked = True
+        state.add_sources(sources)
+        # Shaped as the model's own tool call, so the graph continues from the
+        # tool result and may still call the tools again for follow-ups
+        call_id = uuid.uuid4().hex
+        messages.append(
+            AIMessage(content="", tool_calls=[{"name": "request_to_rag", "args": {"query": user_text}, "id": call_id}])
+        )
+        messages.append(ToolMessage(content=context, name="request_to_rag", tool_call_id=call_id))
+        return messages
+
+    async def _astream_chunks(self, messages: list[BaseMessage], state: AgentRunState) -> AsyncIterator[str]:
+        # We stream events and capture model token stream after tool execution
+        root_run_id = None
+        async for event in self.agent.astream_events(
+            {"messages": messages},
+            config={"configurable": {_RUN_STATE_KEY: state}},
+            version="v1",
+        ):
+            etype = event.get("event")
+            if root_run_id is None:
+                root_run_id = event.get("run_id")
+            if event.get("run_id") == root_run_id:
+                if etype == "on_chain_stream":
+                    # One chunk per finished graph node: {node: {"messages": [...]}}
+                    for update in (event.get("data", {}).get("chunk") or {}).values():
+                        if isinstance(update, dict):
+                            state.new_messages.extend(update.get("messages") or ())
+                elif etype == "on_chain_end":
+                    state.completed = True
+            if etype == "on_chat_model_stream":
+                data = event.get("data", {})
+                chunk = data.get("chunk")
+                # chunk may be an AIMessageChunk or similar; try to extract text
+                if chunk is not None:
+                    content = getattr(chunk, "content", None)
+                    if isinstance(content, str) and content:
+                        yield content
+                    elif isinstance(content, list):
+                        # When content is a list of parts
+                        parts = []
+                        for p in content:
+                            text = getattr(p, "text", None)
+                            if text:
+                                parts.append(text)
+                        if parts:
+                            yield "".join(parts)
+
+
 def build_agent(
-    mcp: McpClient,
     rag_tool_name: str,
+    rag_batch_tool_name: str | None,
     model_name: str,
     temperature: float,
     scope: str,
     credentials: str | None,
     verify_ssl: bool = True,
-):
+    pipeline: str = "react",
+    documents_tool_name: str | None = None,
+    document_fields: list[str] | None = None,
+    min_score: float | None = None,
+    show_sources: bool = False,
+    history: ConversationStore | None = None,
+) -> AgentRuntime:
     """Create a LangGraph ReAct agent that can call the MCP RAG tool via URL.
 
     The agent uses GigaChat as the LLM and exposes a single tool which proxies
-    to the remote MCP server tool that implements RAG.
+    to the remote MCP server tool that implements RAG, plus an optional batch
+    tool that runs several queries in one MCP round trip. ``pipeline`` selects
+    one of ``PIPELINE_MODES``. With ``documents_tool_name`` single queries use
+    the server's structured tool (``document_fields``, ``min_score``) and the
+    context is rendered locally; ``show_sources`` appends the sources to the
+    answer. ``history`` keeps earlier turns of every chat. Call it once at startup and reuse the returned runtime for every
+    message.
     """
-
-    tool_invoked = False
+    retriever = RagRetriever(rag_tool_name, documents_tool_name, fields=document_fields, min_score=min_score)
 
     # Define a LangChain tool that delegates to MCP
     @tool("request_to_rag", return_direct=False)
-    async def request_to_rag(query: str) -> str:
+    async def request_to_rag(query: str, config: RunnableConfig) -> str:
         """Инструмент обращается к API Базы Знаний и получает релевантные документы по запросу пользователя. На выходе выдает релевантные документы, которые нужно использовать для ответа на вопрос пользователя."""
-        nonlocal tool_invoked
-        tool_invoked = True
+        state = _run_state(config)
+        state.tool_invoked = True
         logger.info(f"MCP tool '{rag_tool_name}' invoked with query: {query!r}")
         try:
-            result = await mcp.call_tool_text(name=rag_tool_name, arguments={"query": query})
+            result, sources = await retriever.fetch(query, state.mcp, state.request_id)
+            state.add_sources(sources)
             logger.info(f"MCP tool '{rag_tool_name}' response: {result[:25]!r}")
             return result
         except Exception as e:
             logger.exception(f"MCP tool '{rag_tool_name}' failed for query {query!r}: {e}")
             raise
 
+    @tool("request_to_rag_batch", return_direct=False)
+    async def request_to_rag_batch(queries: list[str], config: RunnableConfig) -> str:
+        """Инструмент выполняет несколько поисковых запросов к Базе Знаний за один вызов и возвращает объединенные релевантные документы без дублей. Используй его вместо нескольких последовательных вызовов request_to_rag, когда вопрос нужно рассмотреть с разных сторон."""
+        state = _run_state(config)
+        state.tool_invoked = True
+        logger.info(f"MCP tool '{rag_batch_tool_name}' invoked with queries: {queries!r}")
+        try:
+            with TOOL_CALL_SECONDS.labels(tool=rag_batch_tool_name).time():
+                result = await state.mcp.call_tool_text(
+                    name=rag_batch_tool_name, arguments={"queries": queries}, request_id=state.request_id
+                )
+            logger.info(f"MCP tool '{rag_batch_tool_name}' response: {result[:25]!r}")
+            return result
+        except Exception as e:
+            logger.exception(f"MCP tool '{rag_batch_tool_name}' failed for queries {queries!r}: {e}")
+            raise
+
+    tools = [request_to_rag]
+    if rag_batch_tool_name:
+        tools.append(request_to_rag_batch)
+
     # Initialize GigaChat LLM
     llm = GigaChat(
         streaming=True,
@@ -64,7 +355,7 @@ def build_agent(
         model=model_name,
         scope=scope,
         credentials=credentials,
-        verify_ssl_certs=False,
+        verify_ssl_certs=verify_ssl,
     )
 
     # Load system prompt from external file for easy editing
@@ -72,40 +363,9 @@ def build_agent(
 
     agent = create_react_agent(
         model=llm,
-        tools=[request_to_rag],
+        tools=tools,
         prompt=system_prompt,
     )
-
-    async def astream_answer(user_text: str):
-        """Stream answer tokens produced by the agent while it reasons and answers.
-
-        Yields incremental text chunks for UI streaming.
-        """
-        logger.info(f"Agent started for user text: {user_text!r}")
-        # We stream events and capture model token stream after tool execution
-        async for event in agent.astream_events(
-            {"messages": [HumanMessage(content=user_text)]},
-            version="v1",
-        ):
-            etype = event.get("event")
-            if etype == "on_chat_model_stream":
-                data = event.get("data", {})
-                chunk = data.get("chunk")
-                # chunk may be an AIMessageChunk or similar; try to extract text
-                if chunk is not None:
-                    content = getattr(chunk, "content", None)
-                    if isinstance(content, str) and content:
-                        yield content
-                    elif isinstance(content, list):
-                        # When content is a list of parts
-                        parts = []
-                        for p in content:
-                            text = getattr(p, "text", None)
-                            if text:
-                                parts.append(text)
-                        if parts:
-                            yield "".join(parts)
-        if not tool_invoked:
-            logger.warning(f"MCP tool '{rag_tool_name}' was NOT invoked for user text: {user_text!r}")
-
-    return agent, astream_answer
\ No newline at end of file
+    return AgentRuntime(
+        agent, retriever=retriever, pipeline=pipeline, show_sources=show_sources, history=history, llm=llm
+    )
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from .metrics import ANSWER_CACHE_REQUESTS_TOTAL, ANSWER_CACHE_SAVED_SECONDS_TOTAL
+
+if TYPE_CHECKING:
+    from .mcp_client import McpClient, McpSessionPool
+
+_TRIM_CHARS = " \t\n.,!?;:…\"'«»()"
+
+
+def normalize_question(text: str) -> str:
+    """Cache key form of a question: case, ё/е, spacing and edge punctuation do not matter."""
+    return " ".join(text.casefold().replace("ё", "е").split()).strip(_TRIM_CHARS)
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    text: str
+    # How long the agent took to produce it: the time every hit saves
+    generation_seconds: float
+    created_at: float
+
+
+class AnswerCache:
+    """Finished answers keyed by the normalized question, the knowledge base version and the context.
+
+    The context is a fingerprint of the conversation the question was asked
+    in, empty for the first question of a chat, so a follow-up only matches an
+    answer given after the same earlier turns.
+
+    Holds at most ``max_entries`` answers, evicting the least recently used,
+    and each for at most ``ttl_sec``. The version comes from the MCP server's
+    ``version_tool_name`` tool and is refreshed in the background every
+    ``version_refresh_sec``, so a lookup normally costs no MCP call; after a
+    knowledge base update old answers simply stop matching. Until a version is
+    known the cache is bypassed.
+    """
+
+    def __init__(self, max_entries: int, ttl_sec: float, version_tool_name: str, version_refresh_sec: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._version_tool_name = version_tool_name
+        self._version_refresh_sec = version_refresh_sec
+        self._entries: OrderedDict[tuple[str, str, str], CachedAnswer] = OrderedDict()
+        self._version: str | None = None
+        self._version_fetched_at = 0.0
+        self._version_task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def kb_version(self, mcp: McpClient | McpSessionPool) -> str | None:
+        """Knowledge base version the answers are valid for, None if it is unknown.
+
+        Only the first call waits for the server; later ones return the last
+        known version and refresh it in the background once it is stale.
+        """
+        stale = time.monotonic() - self._version_fetched_at >= self._version_refresh_sec
+        if stale and (self._version_task is None or self._version_task.done()):
+            self._version_task = asyncio.create_task(self._fetch_version(mcp))
+        if self._version is None and self._version_task is not None:
+            await asyncio.shield(self._version_task)
+        return self._version
+
+    async def _fetch_version(self, mcp: McpClient | McpSessionPool) -> None:
+        try:
+            data = json.loads(await mcp.call_tool_text(name=self._version_tool_name, arguments={}))
+            version = ",".join(f"{kb['id']}:{kb['version']}" for kb in data["knowledge_bases"])
+        except Exception as e:
+            # Keep the last known version; without one the cache stays bypassed
+            logger.warning(f"Could not fetch knowledge base version with '{self._version_tool_name}': {e!r}")
+            return
+        finally:
+            self._version_fetched_at = time.monotonic()
+        if version != self._version:
+            if self._version is not None:
+                logger.info(f"Knowledge base version changed from {self._version!r} to {version!r}")
+            self._version = version
+
+    def get(self, question: str, kb_version: str, context: str = "") -> CachedAnswer | None:
+        key = (normalize_question(question), kb_version, context)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at >= self.ttl_sec:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            ANSWER_CACHE_REQUESTS_TOTAL.labels(outcome="miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        ANSWER_CACHE_REQUESTS_TOTAL.labels(outcome="hit").inc()
+        ANSWER_CACHE_SAVED_SECONDS_TOTAL.inc(entry.generation_seconds)
+        return entry
+
+    def put(self, question: str, kb_version: str, text: str, generation_seconds: float, context: str = "") -> None:
+        key = (normalize_question(question), kb_version, context)
+        if not key[0] or not text.strip():
+            return
+        self._entries[key] = CachedAnswer(text, generation_seconds, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def purge(self) -> int:
+        """Drop every cached answer; returns how many there were."""
+        count = len(self._entries)
+        self._entries.clear()
+        return count
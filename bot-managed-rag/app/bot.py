@@ -2,134 +2,655 @@ from __future__ import annotations
 
 import asyncio
 import time
-from typing import Callable, Awaitable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Awaitable
 from loguru import logger
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import CommandStart
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandStart
 from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest
 
 from .config import Settings
-from .mcp_client import McpClient
-from .agent import build_agent
+from .metrics import (
+    ANSWER_CACHE_ENTRIES,
+    FIRST_TOKEN_SECONDS,
+    MCP_POOL_IDLE,
+    MESSAGES_TOTAL,
+    RUNS_IN_FLIGHT,
+    RUNS_WAITING,
+    STARTUP_SECONDS,
+    new_request_id,
+    set_ready,
+    start_metrics_server,
+)
+from .telegram_edits import EditScheduler
 
+if TYPE_CHECKING:
+    from .agent import AgentRuntime
+    from .answer_cache import AnswerCache
+    from .history import ConversationStore
+    from .mcp_client import McpSessionPool
 
-async def run_bot() -> None:
-    settings = Settings.load()
 
-    bot = Bot(token=settings.telegram_token)#
+@dataclass
+class BotRuntime:
+    """Everything one bot process needs to handle updates, however they arrive."""
+
+    bot: Bot
+    dp: Dispatcher
+    agent: AgentRuntime
+    mcp_pool: McpSessionPool
+    scheduler: _ChatScheduler
+    edit_scheduler: EditScheduler
+    answer_cache: AnswerCache | None = None
+
+
+def _build_history(settings: Settings) -> ConversationStore | None:
+    from .history import ConversationStore
+
+    if settings.history_token_budget <= 0:
+        return None
+    return ConversationStore(
+        token_budget=settings.history_token_budget,
+        max_chats=settings.history_max_chats,
+        max_bytes=int(settings.history_max_mb * 1024 * 1024),
+        full_tool_turns=settings.history_full_tool_turns,
+    )
+
+
+def _build_answer_cache(settings: Settings) -> AnswerCache | None:
+    from .answer_cache import AnswerCache
+
+    if settings.answer_cache_size <= 0:
+        return None
+    return AnswerCache(
+        max_entries=settings.answer_cache_size,
+        ttl_sec=settings.answer_cache_ttl_sec,
+        version_tool_name=settings.mcp_kb_version_tool_name,
+        version_refresh_sec=settings.kb_version_refresh_sec,
+    )
+
+
+def _import_agent_stack() -> None:
+    """Import LangChain, LangGraph, GigaChat and the MCP client, logging how long it took.
+
+    They are the slowest part of startup and only bot workers need them, so
+    they are loaded here rather than at module import: the webhook router
+    skips them, and the metrics and readiness endpoints come up first.
+    """
+    started = time.perf_counter()
+    from . import agent, answer_cache, history, mcp_client  # noqa: F401
+
+    elapsed = time.perf_counter() - started
+    STARTUP_SECONDS.labels(phase="imports").set(elapsed)
+    logger.info(f"Agent stack imported in {elapsed:.2f}s")
+
+
+async def warm_up(runtime: BotRuntime) -> None:
+    """Open the MCP sessions and fetch the GigaChat token before taking messages.
+
+    With the answer cache on, the knowledge base version is fetched as well.
+
+    Failures are logged and left to the first message to retry, so a slow
+    upstream delays readiness by at most the connect timeouts.
+    """
+
+    async def timed(phase: str, step: Awaitable[object]) -> None:
+        started = time.perf_counter()
+        try:
+            await step
+        except Exception as e:
+            logger.warning(f"Warm-up step {phase} failed: {e!r}")
+        finally:
+            elapsed = time.perf_counter() - started
+            STARTUP_SECONDS.labels(phase=phase).set(elapsed)
+            timings[phase] = elapsed
+
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+    await asyncio.gather(
+        timed("mcp_sessions", runtime.mcp_pool.start()),
+        timed("gigachat_token", runtime.agent.warm_up()),
+    )
+    if runtime.answer_cache is not None:
+        # Needs the pool, so it runs once the sessions are open
+        await timed("kb_version", runtime.answer_cache.kb_version(runtime.mcp_pool))
+    elapsed = time.perf_counter() - started
+    STARTUP_SECONDS.labels(phase="warm_up").set(elapsed)
+    logger.info(f"Warm-up finished in {elapsed:.2f}s: " + ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()))
+
+
+def build_bot(settings: Settings) -> BotRuntime:
+    """Create the bot, its handlers and the shared resources without starting polling.
+
+    ``run_bot`` polls with the result; benchmarks feed updates to ``dp`` directly.
+    The MCP session pool must be entered before the first update is handled;
+    ``warm_up`` also fetches the GigaChat token ahead of the first message.
+    """
+    _import_agent_stack()
+    from .agent import build_agent
+    from .mcp_client import McpSessionPool
+
+    session = None
+    if settings.telegram_api_url:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+    bot = Bot(token=settings.telegram_token, session=session)
     dp = Dispatcher()
 
+    # Warm MCP sessions shared by all messages of this process
+    mcp_pool = McpSessionPool(
+        settings.mcp_server_url,
+        transport=settings.mcp_transport,
+        size=settings.mcp_pool_size,
+        health_check_interval=settings.mcp_pool_health_check_interval_sec,
+        acquire_timeout=settings.mcp_pool_acquire_timeout_sec,
+    )
+
+    # Compiled graph and GigaChat client shared by all messages
+    agent = build_agent(
+        rag_tool_name=settings.mcp_rag_tool_name,
+        rag_batch_tool_name=settings.mcp_rag_batch_tool_name,
+        model_name=settings.gigachat_model,
+        temperature=settings.gigachat_temperature,
+        scope=settings.gigachat_scope,
+        credentials=settings.gigachat_credentials,
+        verify_ssl=settings.gigachat_verify_ssl,
+        pipeline=settings.agent_pipeline,
+        documents_tool_name=settings.mcp_rag_documents_tool_name,
+        document_fields=settings.mcp_rag_fields,
+        min_score=settings.mcp_rag_min_score,
+        show_sources=settings.bot_show_sources,
+        history=_build_history(settings),
+    )
+
+    answer_cache = _build_answer_cache(settings)
+    if answer_cache is not None:
+        ANSWER_CACHE_ENTRIES.set_function(lambda: len(answer_cache))
+
     @dp.message(CommandStart())
     async def cmd_start(message: Message) -> None:
+        agent.forget(message.chat.id)
         await message.answer("Привет! Я твой AI-агент, готовый помочь тебе с вопросами по твоей базе знаний Evolution Managed RAG.")
 
+    @dp.message(Command("purge_cache"))
+    async def cmd_purge_cache(message: Message) -> None:
+        user_id = message.from_user.id if message.from_user else None
+        if user_id not in settings.bot_admin_ids:
+            await message.answer("⛔ Команда доступна только администраторам.")
+            return
+        count = answer_cache.purge() if answer_cache is not None else 0
+        logger.info(f"Answer cache purged by admin {user_id}: {count} answers dropped")
+        await message.answer(f"🧹 Кэш ответов очищен, удалено ответов: {count}.")
+
+    scheduler = _ChatScheduler(
+        max_concurrency=settings.bot_max_concurrent_runs,
+        max_waiting=settings.bot_max_queue_depth,
+        cancel_superseded=settings.bot_cancel_superseded,
+    )
+
+    edit_scheduler = EditScheduler(
+        global_rate=settings.telegram_global_edits_per_sec,
+        chat_rate=settings.telegram_chat_edits_per_sec,
+        min_interval=settings.stream_edit_interval_sec,
+    )
+
+    RUNS_IN_FLIGHT.set_function(lambda: scheduler.running)
+    RUNS_WAITING.set_function(lambda: scheduler.waiting)
+    MCP_POOL_IDLE.set_function(lambda: mcp_pool.idle)
+
     @dp.message(F.text)
     async def on_text(message: Message) -> None:
+        received_at = time.monotonic()
         user_text = message.text or ""
         if not user_text.strip():
             return
         user_id = message.from_user.id if message.from_user else None
-        logger.info(f"User {user_id} query: {user_text!r}")
+        request_id = new_request_id()
+        logger.info(f"User {user_id} query: {user_text!r} (request_id={request_id})")
 
-        # Initial placeholder message
-        sent = await message.answer("⏳ Думаю")
+        if scheduler.overloaded:
+            logger.warning(f"Shedding message from {user_id}: {scheduler.waiting} runs already waiting")
+            MESSAGES_TOTAL.labels(outcome="shed").inc()
+            await message.answer("🚦 Сейчас слишком много запросов, попробуйте чуть позже.")
+            return
 
-        try:
-            async with McpClient(settings.mcp_server_url, transport=settings.mcp_transport) as mcp:
-                agent, astream_answer = build_agent(
-                    mcp=mcp,
-                    rag_tool_name=settings.mcp_rag_tool_name,
-                    model_name=settings.gigachat_model,
-                    temperature=settings.gigachat_temperature,
-                    scope=settings.gigachat_scope,
-                    credentials=settings.gigachat_credentials,
-                    verify_ssl=settings.gigachat_verify_ssl,
-                )
-
-                # Stream updates to Telegram by editing the message text
-                aggregator = _TelegramAggregator(
-                    edit_fn=lambda text: sent.edit_text(text),
-                    interval=settings.stream_edit_interval_sec,
-                    min_chars_delta=settings.stream_min_chars_delta,
-                    prefix="",
-                )
-                async for chunk in astream_answer(user_text):
+        chat_id = message.chat.id
+        # Both are resolved in prepare(): nothing is awaited before the run is queued, so
+        # the chat's messages keep the order they arrived in
+        kb_version: str | None = None
+        # The history the answer depends on; known once the chat's earlier messages are answered
+        context = ""
+        aggregator: _TelegramAggregator | None = None
+
+        async def prepare() -> bool:
+            # Runs in chat order without a worker slot: a cached answer needs neither GigaChat nor MCP
+            nonlocal kb_version, context, aggregator
+            if answer_cache is not None:
+                kb_version = await answer_cache.kb_version(mcp_pool)
+            if answer_cache is not None and kb_version is not None:
+                context = agent.history_fingerprint(chat_id)
+                cached = answer_cache.get(user_text, kb_version, context)
+                if cached is not None:
+                    reply = _TelegramAggregator(
+                        message=message,
+                        interval=settings.stream_edit_interval_sec,
+                        min_chars_delta=settings.stream_min_chars_delta,
+                        scheduler=edit_scheduler,
+                        new_message=True,
+                    )
+                    try:
+                        await reply.feed(cached.text)
+                        await reply.flush(final=True)
+                    except Exception as e:
+                        logger.exception(f"Error while sending cached answer to {user_id} (request_id={request_id}): {e}")
+                        MESSAGES_TOTAL.labels(outcome="error").inc()
+                        return False
+                    FIRST_TOKEN_SECONDS.observe(time.monotonic() - received_at)
+                    agent.record_answer(chat_id, user_text, cached.text)
+                    logger.info(f"Cached answer to user {user_id} (request_id={request_id})")
+                    MESSAGES_TOTAL.labels(outcome="cached").inc()
+                    return False
+
+            # Initial placeholder message
+            try:
+                sent = await message.answer("⏳ Думаю")
+            except Exception as e:
+                logger.exception(f"Could not reply to {user_id} (request_id={request_id}): {e}")
+                MESSAGES_TOTAL.labels(outcome="error").inc()
+                return False
+            # Stream updates to Telegram by editing the message text
+            aggregator = _TelegramAggregator(
+                message=sent,
+                interval=settings.stream_edit_interval_sec,
+                min_chars_delta=settings.stream_min_chars_delta,
+                prefix="",
+                scheduler=edit_scheduler,
+            )
+            return True
+
+        def edit_now(text: str) -> asyncio.Future[None]:
+            # Goes through the scheduler so it replaces any pending stream edit
+            assert aggregator is not None
+            target = aggregator.message
+            return edit_scheduler.submit(target.chat.id, target.message_id, text, target.edit_text)
+
+        async def answer() -> None:
+            assert aggregator is not None
+            edit_scheduler.stream_started()
+            first_token = True
+            started = time.monotonic()
+            try:
+                # Retrieval starts here, with a worker slot: queued messages hold no MCP session
+                async for chunk in agent.astream_answer(user_text, mcp=mcp_pool, request_id=request_id, chat_id=chat_id):
+                    if first_token and chunk:
+                        FIRST_TOKEN_SECONDS.observe(time.monotonic() - received_at)
+                        first_token = False
                     await aggregator.feed(chunk)
                 await aggregator.flush(final=True)
                 final_text = aggregator.get_text()
-                logger.info(f"Final answer to user {user_id}: {final_text!r}")
-        except Exception as e:
-            logger.exception(f"Error while processing message from {user_id}: {e}")
-            await sent.edit_text(f"❌ Ошибка: {e}")
+                logger.info(f"Final answer to user {user_id} (request_id={request_id}): {final_text!r}")
+                if answer_cache is not None and kb_version is not None:
+                    answer_cache.put(user_text, kb_version, final_text, time.monotonic() - started, context=context)
+                MESSAGES_TOTAL.labels(outcome="answered").inc()
+            except Exception as e:
+                logger.exception(f"Error while processing message from {user_id} (request_id={request_id}): {e}")
+                MESSAGES_TOTAL.labels(outcome="error").inc()
+                error_text = f"❌ Ошибка: {e}"
+                try:
+                    await edit_now(error_text)
+                except Exception as edit_error:
+                    # The placeholder may be gone or not editable: tell the user in a new message
+                    logger.warning(f"Could not edit the error into the reply to {user_id} (request_id={request_id}): {edit_error!r}")
+                    try:
+                        await message.answer(error_text)
+                    except Exception as send_error:
+                        logger.error(f"Could not report the error to {user_id} (request_id={request_id}): {send_error!r}")
+                return
+            finally:
+                edit_scheduler.stream_finished()
+
+        async def cancelled() -> None:
+            if scheduler.closing:
+                logger.info(f"Answer to user {user_id} interrupted by shutdown (request_id={request_id})")
+                MESSAGES_TOTAL.labels(outcome="interrupted").inc()
+                text = "⏹ Ответ прерван: бот перезапускается, повторите вопрос чуть позже."
+            else:
+                logger.info(f"Answer to user {user_id} superseded by a newer message (request_id={request_id})")
+                MESSAGES_TOTAL.labels(outcome="superseded").inc()
+                text = "⏹ Ответ отменен: получено новое сообщение."
+            if aggregator is None:
+                # Cancelled before the placeholder was sent: nothing to edit
+                return
+            try:
+                await edit_now(text)
+            except Exception:
+                pass
+
+        scheduler.submit(chat_id, answer, on_cancel=cancelled, prepare=prepare)
+
+    return BotRuntime(
+        bot=bot,
+        dp=dp,
+        agent=agent,
+        mcp_pool=mcp_pool,
+        scheduler=scheduler,
+        edit_scheduler=edit_scheduler,
+        answer_cache=answer_cache,
+    )
+
+
+async def drain(runtime: BotRuntime, timeout: float) -> None:
+    """Let in-flight answers finish for up to ``timeout`` seconds, then cancel the rest.
+
+    New messages must no longer reach the dispatcher when this is called.
+    """
+    runtime.scheduler.close()
+    pending = runtime.scheduler.running + runtime.scheduler.waiting
+    if pending:
+        logger.info(f"Draining {pending} in-flight answers (up to {timeout:.0f}s)")
+    try:
+        await asyncio.wait_for(runtime.scheduler.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Drain timed out, interrupting {runtime.scheduler.running + runtime.scheduler.waiting} answers")
+        runtime.scheduler.cancel_all()
+        await runtime.scheduler.join()
+
+
+async def run_bot() -> None:
+    settings = Settings.load()
+    if settings.bot_mode == "webhook":
+        from .webhook import run_webhook
+
+        await run_webhook(settings)
+        return
+    if settings.bot_mode != "polling":
+        raise RuntimeError(f"Unsupported BOT_MODE: {settings.bot_mode!r}. Use polling or webhook")
+
+    metrics_runner = None
+    if settings.metrics_port:
+        # Up before the slow part of startup, so probes see the process as alive but not ready
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
+        logger.info(f"Metrics available at http://{settings.metrics_host}:{settings.metrics_port}/metrics")
+    runtime = build_bot(settings)
+    try:
+        await warm_up(runtime)
+        async with runtime.mcp_pool:
+            set_ready(True)
+            # The session stays open so drained answers can still edit their messages
+            await runtime.dp.start_polling(runtime.bot, close_bot_session=False)
+            set_ready(False)
+            await drain(runtime, settings.bot_drain_timeout_sec)
+    finally:
+        await runtime.bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+class _ChatScheduler:
+    """Schedules agent runs with bounded concurrency and per-chat ordering.
+
+    At most ``max_concurrency`` runs execute at once across all chats, and each
+    chat has at most one run in flight with later messages queued behind it.
+    ``overloaded`` tells the caller to shed load once ``max_waiting`` runs are
+    queued. With ``cancel_superseded`` a newer message from a chat cancels that
+    chat's running and queued runs. A run's ``prepare`` step keeps the chat
+    order but not a worker slot, and can finish the run on its own.
+    """
+
+    def __init__(self, max_concurrency: int, max_waiting: int, cancel_superseded: bool = False) -> None:
+        self._workers = asyncio.Semaphore(max(1, max_concurrency))
+        self._max_waiting = max_waiting
+        self._cancel_superseded = cancel_superseded
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_tasks: dict[int, set[asyncio.Task[None]]] = {}
+        self._started: set[asyncio.Task[None]] = set()
+        self._waiting = 0
+        self._closing = False
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        return len(self._started)
+
+    @property
+    def overloaded(self) -> bool:
+        return self._waiting >= self._max_waiting
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        """Mark the scheduler as shutting down; cancellations are reported as interruptions."""
+        self._closing = True
+
+    def cancel_all(self) -> None:
+        for tasks in self._chat_tasks.values():
+            for task in tasks:
+                task.cancel()
+
+    async def join(self, chat_id: int | None = None) -> None:
+        """Wait until the runs of ``chat_id`` (or of all chats) have finished."""
+        while True:
+            if chat_id is None:
+                tasks = {t for chat_tasks in self._chat_tasks.values() for t in chat_tasks}
+            else:
+                tasks = set(self._chat_tasks.get(chat_id, ()))
+            if not tasks:
+                return
+            await asyncio.wait(tasks)
+
+    def submit(
+        self,
+        chat_id: int,
+        job: Callable[[], Awaitable[None]],
+        on_cancel: Callable[[], Awaitable[None]] | None = None,
+        prepare: Callable[[], Awaitable[bool]] | None = None,
+    ) -> asyncio.Task[None]:
+        """Queue ``job`` behind the chat's earlier runs and a free worker slot.
+
+        ``prepare`` runs once the chat's turn comes, before a worker slot is
+        taken; if it returns False the run is over and ``job`` is skipped.
+        """
+        if self._cancel_superseded:
+            for task in self._chat_tasks.get(chat_id, ()):
+                task.cancel()
+        # Counted as waiting right away so a burst is shed before its tasks start
+        self._waiting += 1
+        task = asyncio.create_task(self._run(chat_id, job, on_cancel, prepare))
+        self._chat_tasks.setdefault(chat_id, set()).add(task)
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+        return task
+
+    def _forget(self, chat_id: int, task: asyncio.Task[None]) -> None:
+        if task in self._started:
+            self._started.discard(task)
+        else:
+            self._waiting -= 1
+        tasks = self._chat_tasks.get(chat_id)
+        if tasks is None:
             return
+        tasks.discard(task)
+        if not tasks:
+            # No task of this chat can hold or wait for the lock any more
+            del self._chat_tasks[chat_id]
+            self._chat_locks.pop(chat_id, None)
 
-    await dp.start_polling(bot)
+    async def _run(
+        self,
+        chat_id: int,
+        job: Callable[[], Awaitable[None]],
+        on_cancel: Callable[[], Awaitable[None]] | None,
+        prepare: Callable[[], Awaitable[bool]] | None = None,
+    ) -> None:
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                if prepare is not None and not await prepare():
+                    return
+                async with self._workers:
+                    task = asyncio.current_task()
+                    assert task is not None
+                    self._started.add(task)
+                    self._waiting -= 1
+                    await job()
+        except asyncio.CancelledError:
+            if on_cancel is not None:
+                await on_cancel()
+            raise
 
 
 class _TelegramAggregator:
-    """Coalesces multiple small chunks into periodic message edits."""
+    """Coalesces multiple small chunks into periodic message edits.
+
+    Work per edit is bounded by the size of one Telegram message: only the
+    tail message is re-sent, buffered length is tracked incrementally, and once
+    the tail nears the 4096-character limit it is finalized at a paragraph or
+    sentence boundary and the answer continues in a new message.
+    """
 
     def __init__(
         self,
-        edit_fn: Callable[[str], Awaitable[Message]],
+        message: Message,
         interval: float,
         min_chars_delta: int,
         prefix: str = "",
+        scheduler: EditScheduler | None = None,
+        max_message_len: int = 4000,
+        new_message: bool = False,
     ) -> None:
-        self._edit_fn = edit_fn
+        # With new_message the text goes out as a fresh reply instead of editing ``message``
+        self._message: Message | None = None if new_message else message
+        self._chat_message = message
+        self._last_message = message
         self._interval = interval
+        self._scheduler = scheduler
+        self._max_len = max_message_len
         self._min_delta = min_chars_delta
         self._prefix = prefix
         self._buffer: list[str] = []
-        self._accum: list[str] = []
+        self._buffer_len = 0
+        # Текст текущего (последнего) сообщения без префикса
+        self._tail = ""
+        # Тексты уже завершенных сообщений
+        self._done: list[str] = []
+        self._pending_finals: list[asyncio.Future[None]] = []
         self._last_edit = time.monotonic()
         self._last_sent_text: str = ""
         self._changed: bool = False
 
+    @property
+    def message(self) -> Message:
+        """The message currently being streamed into."""
+        return self._message or self._last_message
+
     def get_text(self) -> str:
-        return self._last_sent_text
+        return self._prefix + "".join(self._done) + self._tail
 
     async def feed(self, chunk: str) -> None:
         if not chunk:
             return
         self._buffer.append(chunk)
+        self._buffer_len += len(chunk)
         self._changed = True
         now = time.monotonic()
-        if (now - self._last_edit) >= self._interval or sum(len(c) for c in self._buffer) >= self._min_delta:
+        interval = self._interval
+        if self._scheduler is not None:
+            interval = max(interval, self._scheduler.interval_hint())
+        if (now - self._last_edit) >= interval or self._buffer_len >= self._min_delta:
             await self._emit()
 
     async def flush(self, final: bool = False) -> None:
         # Выполним только если действительно есть изменения
         if self._changed:
             await self._emit(final=final)
+        if final and self._pending_finals:
+            await asyncio.gather(*self._pending_finals)
+            self._pending_finals.clear()
 
     async def _emit(self, final: bool = False) -> None:
         if not self._changed:
             return
-        # Переносим буфер в общий аккумулятор и формируем текст
-        self._accum.extend(self._buffer)
+        # Переносим буфер в хвост текущего сообщения
+        self._tail += "".join(self._buffer)
         self._buffer.clear()
-        text = self._prefix + "".join(self._accum)
+        self._buffer_len = 0
+        self._changed = False
+
+        # Хвост не влезает в одно сообщение: закрываем его и начинаем новое
+        while len(self._tail) > self._max_len:
+            cut = _split_point(self._tail, self._max_len)
+            head, self._tail = self._tail[:cut], self._tail[cut:]
+            await self._finish_message(head)
 
+        text = self._prefix + self._tail if not self._done else self._tail.lstrip()
         # Пропускаем редактирование, если текст не изменился
-        if text == self._last_sent_text:
-            self._changed = False
+        if not text or text == self._last_sent_text:
+            return
+        if self._message is None:
+            # Предыдущее сообщение закрыто: продолжение отправляем новым сообщением
+            self._message = self._last_message = await self._chat_message.answer(text)
+            self._last_sent_text = text
+            self._last_edit = time.monotonic()
             return
-
         self._last_edit = time.monotonic()
+        # Считаем, что состояние синхронизировано
+        self._last_sent_text = text
+        await self._submit(self._message, text, wait=final)
+
+    async def _finish_message(self, head: str) -> None:
+        text = self._prefix + head if not self._done else head.lstrip()
+        if self._message is None:
+            self._last_message = await self._chat_message.answer(text)
+        else:
+            await self._submit(self._message, text, wait=False, final_part=True)
+        self._done.append(head)
+        self._message = None
+        self._last_sent_text = ""
+
+    async def _submit(self, message: Message, text: str, wait: bool, final_part: bool = False) -> None:
+        send = lambda t: self._send(message, t)  # noqa: E731
+        if self._scheduler is None:
+            await send(text)
+            return
+        future = self._scheduler.submit(message.chat.id, message.message_id, text, send)
+        if wait:
+            await future
+        elif final_part:
+            self._pending_finals.append(future)
+        else:
+            future.add_done_callback(_log_failed_edit)
+
+    async def _send(self, message: Message, text: str) -> None:
         try:
-            await self._edit_fn(text)
+            await message.edit_text(text)
         except TelegramBadRequest as e:
             # Игнорируем known-case: "message is not modified"
             if "message is not modified" in str(e).lower():
                 pass
             else:
                 raise
-        finally:
-            # Считаем, что состояние синхронизировано
-            self._last_sent_text = text
-            self._changed = False
\ No newline at end of file
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Where to cut ``text`` to fit ``limit``: paragraph, line, sentence, word, or hard cut."""
+    window = text[:limit]
+    for sep in ("\n\n", "\n", ". ", "! ", "? ", " "):
+        idx = window.rfind(sep)
+        # Не режем слишком близко к началу, иначе получатся крошечные сообщения
+        if idx >= limit // 2:
+            return idx + len(sep)
+    return limit
+
+
+def _log_failed_edit(future: asyncio.Future[None]) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Intermediate message edit failed: {future.exception()!r}")
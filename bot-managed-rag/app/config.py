@@ -18,9 +18,18 @@ def _getenv(name: str, default: str | None = None, required: bool = False) -> st
 @dataclass(frozen=True)
 class Settings:
     telegram_token: str
+    telegram_api_url: str | None
     mcp_server_url: str
     mcp_rag_tool_name: str
+    mcp_rag_batch_tool_name: str | None
+    mcp_rag_documents_tool_name: str | None
+    mcp_rag_fields: list[str] | None
+    mcp_rag_min_score: float | None
+    bot_show_sources: bool
     mcp_transport: str
+    mcp_pool_size: int
+    mcp_pool_health_check_interval_sec: float
+    mcp_pool_acquire_timeout_sec: float
 
     gigachat_credentials: str | None
     gigachat_scope: str
@@ -28,25 +37,70 @@ class Settings:
     gigachat_temperature: float
     gigachat_verify_ssl: bool
 
+    agent_pipeline: str
+
     stream_edit_interval_sec: float
     stream_min_chars_delta: int
+    telegram_global_edits_per_sec: float
+    telegram_chat_edits_per_sec: float
+
+    bot_max_concurrent_runs: int
+    bot_max_queue_depth: int
+    bot_cancel_superseded: bool
+
+    history_token_budget: int
+    history_max_chats: int
+    history_max_mb: float
+    history_full_tool_turns: int
+
+    answer_cache_size: int
+    answer_cache_ttl_sec: float
+    mcp_kb_version_tool_name: str
+    kb_version_refresh_sec: float
+    bot_admin_ids: frozenset[int]
+
+    metrics_host: str
+    metrics_port: int
+
+    bot_mode: str
+    bot_drain_timeout_sec: float
+    webhook_url: str | None
+    webhook_host: str
+    webhook_port: int
+    webhook_path: str
+    webhook_secret: str | None
+    webhook_workers: int
 
     @staticmethod
     def load() -> "Settings":
         # Telegram
         telegram_token = _getenv("TELEGRAM_BOT_TOKEN", required=True)  # type: ignore[arg-type]
+        # Self-hosted Bot API server or a local fake for benchmarks
+        telegram_api_url = _getenv("TELEGRAM_API_URL") or None
 
         # MCP
         mcp_server_url = _getenv("MCP_SERVER_URL", required=True)  # type: ignore[arg-type]
         mcp_rag_tool_name = _getenv("MCP_RAG_TOOL_NAME", "rag_query")  # type: ignore[assignment]
-        mcp_transport = (_getenv("MCP_TRANSPORT", "sse") or "sse").lower()  # sse|streamable-http (future)
+        mcp_rag_batch_tool_name = _getenv("MCP_RAG_BATCH_TOOL_NAME", "request_to_rag_batch") or None
+        # Structured retrieval: the server returns document records, the bot renders them
+        mcp_rag_documents_tool_name = _getenv("MCP_RAG_DOCUMENTS_TOOL_NAME") or None
+        mcp_rag_fields = [f.strip() for f in (_getenv("MCP_RAG_FIELDS") or "").split(",") if f.strip()] or None
+        mcp_rag_min_score = float(_getenv("MCP_RAG_MIN_SCORE") or 0) or None
+        bot_show_sources = (_getenv("BOT_SHOW_SOURCES", "false") or "false").lower() in ("1", "true", "yes")
+        mcp_transport = (_getenv("MCP_TRANSPORT", "sse") or "sse").lower()  # sse|streamable-http
+        mcp_pool_size = int(_getenv("MCP_POOL_SIZE", "4") or 4)
+        mcp_pool_health_check_interval_sec = float(_getenv("MCP_POOL_HEALTH_CHECK_INTERVAL_SEC", "30") or 30)
+        mcp_pool_acquire_timeout_sec = float(_getenv("MCP_POOL_ACQUIRE_TIMEOUT_SEC", "30") or 30)
 
         # GigaChat
         gigachat_credentials = _getenv("GIGACHAT_CREDENTIALS")
         gigachat_scope = _getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
         gigachat_model = _getenv("GIGACHAT_MODEL", "GigaChat")
         gigachat_temperature = float(_getenv("GIGACHAT_TEMPERATURE", "0.7"))
-        gigachat_verify_ssl = _getenv("GIGACHAT_VERIFY_SSL", "false")
+        gigachat_verify_ssl = (_getenv("GIGACHAT_VERIFY_SSL", "false") or "false").lower() in ("1", "true", "yes")
+
+        # Agent pipeline: react|retrieve_first
+        agent_pipeline = (_getenv("AGENT_PIPELINE", "react") or "react").lower()
 
         if not gigachat_credentials:
             raise RuntimeError(
@@ -56,17 +110,91 @@ class Settings:
         # Streaming config
         stream_edit_interval_sec = float(_getenv("STREAM_EDIT_INTERVAL_SEC", "0.4") or 0.4)
         stream_min_chars_delta = int(_getenv("STREAM_MIN_CHARS_DELTA", "48") or 48)
+        telegram_global_edits_per_sec = float(_getenv("TELEGRAM_GLOBAL_EDITS_PER_SEC", "25") or 25)
+        telegram_chat_edits_per_sec = float(_getenv("TELEGRAM_CHAT_EDITS_PER_SEC", "1") or 1)
+        for name, rate in (
+            ("TELEGRAM_GLOBAL_EDITS_PER_SEC", telegram_global_edits_per_sec),
+            ("TELEGRAM_CHAT_EDITS_PER_SEC", telegram_chat_edits_per_sec),
+        ):
+            if rate <= 0:
+                raise RuntimeError(f"{name} must be greater than 0, got {rate}")
+
+        # Scheduling
+        bot_max_concurrent_runs = int(_getenv("BOT_MAX_CONCURRENT_RUNS", "8") or 8)
+        bot_max_queue_depth = int(_getenv("BOT_MAX_QUEUE_DEPTH", "100") or 100)
+        bot_cancel_superseded = (_getenv("BOT_CANCEL_SUPERSEDED", "false") or "false").lower() in ("1", "true", "yes")
+
+        # Conversation history (BOT_HISTORY_TOKEN_BUDGET=0 answers every message on its own)
+        history_token_budget = int(_getenv("BOT_HISTORY_TOKEN_BUDGET", "8000") or 0)
+        history_max_chats = int(_getenv("BOT_HISTORY_MAX_CHATS", "10000") or 10000)
+        history_max_mb = float(_getenv("BOT_HISTORY_MAX_MB", "128") or 128)
+        history_full_tool_turns = int(_getenv("BOT_HISTORY_FULL_TOOL_TURNS", "1") or 0)
+
+        # Answer cache (BOT_ANSWER_CACHE_SIZE=0 disables it)
+        answer_cache_size = int(_getenv("BOT_ANSWER_CACHE_SIZE", "0") or 0)
+        answer_cache_ttl_sec = float(_getenv("BOT_ANSWER_CACHE_TTL_SEC", "3600") or 3600)
+        mcp_kb_version_tool_name = _getenv("MCP_KB_VERSION_TOOL_NAME", "knowledge_base_versions") or "knowledge_base_versions"
+        kb_version_refresh_sec = float(_getenv("BOT_KB_VERSION_REFRESH_SEC", "60") or 60)
+        bot_admin_ids = frozenset(int(i) for i in (_getenv("BOT_ADMIN_IDS") or "").replace(" ", "").split(",") if i)
+
+        # Observability (METRICS_PORT=0 disables the /metrics endpoint)
+        metrics_host = _getenv("METRICS_HOST", "0.0.0.0") or "0.0.0.0"
+        metrics_port = int(_getenv("METRICS_PORT", "9100") or 0)
+
+        # Update delivery: polling|webhook
+        bot_mode = (_getenv("BOT_MODE", "polling") or "polling").lower()
+        bot_drain_timeout_sec = float(_getenv("BOT_DRAIN_TIMEOUT_SEC", "30") or 30)
+        webhook_url = _getenv("BOT_WEBHOOK_URL") or None
+        webhook_host = _getenv("BOT_WEBHOOK_HOST", "0.0.0.0") or "0.0.0.0"
+        webhook_port = int(_getenv("BOT_WEBHOOK_PORT", "8080") or 8080)
+        webhook_path = _getenv("BOT_WEBHOOK_PATH", "/telegram/webhook") or "/telegram/webhook"
+        webhook_secret = _getenv("BOT_WEBHOOK_SECRET") or None
+        webhook_workers = max(1, int(_getenv("BOT_WEBHOOK_WORKERS", "1") or 1))
 
         return Settings(
             telegram_token=telegram_token,
+            telegram_api_url=telegram_api_url,
             mcp_server_url=mcp_server_url,
             mcp_rag_tool_name=mcp_rag_tool_name,
+            mcp_rag_batch_tool_name=mcp_rag_batch_tool_name,
+            mcp_rag_documents_tool_name=mcp_rag_documents_tool_name,
+            mcp_rag_fields=mcp_rag_fields,
+            mcp_rag_min_score=mcp_rag_min_score,
+            bot_show_sources=bot_show_sources,
             mcp_transport=mcp_transport,
+            mcp_pool_size=mcp_pool_size,
+            mcp_pool_health_check_interval_sec=mcp_pool_health_check_interval_sec,
+            mcp_pool_acquire_timeout_sec=mcp_pool_acquire_timeout_sec,
             gigachat_credentials=gigachat_credentials,
             gigachat_scope=gigachat_scope,
             gigachat_model=gigachat_model,
             gigachat_temperature=gigachat_temperature,
             gigachat_verify_ssl=gigachat_verify_ssl,
+            agent_pipeline=agent_pipeline,
             stream_edit_interval_sec=stream_edit_interval_sec,
             stream_min_chars_delta=stream_min_chars_delta,
+            telegram_global_edits_per_sec=telegram_global_edits_per_sec,
+            telegram_chat_edits_per_sec=telegram_chat_edits_per_sec,
+            bot_max_concurrent_runs=bot_max_concurrent_runs,
+            bot_max_queue_depth=bot_max_queue_depth,
+            bot_cancel_superseded=bot_cancel_superseded,
+            history_token_budget=history_token_budget,
+            history_max_chats=history_max_chats,
+            history_max_mb=history_max_mb,
+            history_full_tool_turns=history_full_tool_turns,
+            answer_cache_size=answer_cache_size,
+            answer_cache_ttl_sec=answer_cache_ttl_sec,
+            mcp_kb_version_tool_name=mcp_kb_version_tool_name,
+            kb_version_refresh_sec=kb_version_refresh_sec,
+            bot_admin_ids=bot_admin_ids,
+            metrics_host=metrics_host,
+            metrics_port=metrics_port,
+            bot_mode=bot_mode,
+            bot_drain_timeout_sec=bot_drain_timeout_sec,
+            webhook_url=webhook_url,
+            webhook_host=webhook_host,
+            webhook_port=webhook_port,
+            webhook_path=webhook_path,
+            webhook_secret=webhook_secret,
+            webhook_workers=webhook_workers,
         )
\ No newline at end of file
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import hashlib
+import sys
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+from .metrics import HISTORY_BYTES, HISTORY_CHATS, HISTORY_EVICTIONS_TOTAL, HISTORY_FOLDS_TOTAL
+
+# GigaChat does not expose its tokenizer offline; Russian text averages about
+# three characters per token, which keeps the estimate on the safe side
+_CHARS_PER_TOKEN = 3
+# Rough size of a message object apart from its text
+_MESSAGE_OVERHEAD_BYTES = 600
+_SUMMARY_QUESTION_CHARS = 200
+_SUMMARY_ANSWER_CHARS = 300
+_SUMMARY_HEADER = "Краткое содержание предыдущего разговора:"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[: cut if cut > limit // 2 else limit] + "…"
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else str(part.get("text", "")) for part in content)
+
+
+def _message_tokens(message: BaseMessage) -> int:
+    tokens = estimate_tokens(_message_text(message))
+    for call in getattr(message, "tool_calls", None) or ():
+        tokens += estimate_tokens(str(call.get("args", "")))
+    return tokens
+
+
+def _message_bytes(message: BaseMessage) -> int:
+    return _MESSAGE_OVERHEAD_BYTES + sys.getsizeof(_message_text(message))
+
+
+@dataclass
+class _Turn:
+    """One question with everything the agent produced while answering it."""
+
+    question: str
+    answer: str
+    messages: list[BaseMessage]
+    sources: list[str]
+    tool_results_compacted: bool = False
+    tokens: int = 0
+    size: int = 0
+
+    def measure(self) -> None:
+        self.tokens = sum(_message_tokens(m) for m in self.messages)
+        self.size = sum(_message_bytes(m) for m in self.messages)
+
+    def compact_tool_results(self) -> None:
+        """Replace retrieved documents with a short note of what was looked up."""
+        if self.tool_results_compacted:
+            return
+        queries = {
+            call.get("id"): call.get("args") or {}
+            for m in self.messages
+            if isinstance(m, AIMessage)
+            for call in m.tool_calls
+        }
+        compacted: list[BaseMessage] = []
+        for m in self.messages:
+            if isinstance(m, ToolMessage):
+                args = queries.get(m.tool_call_id) or {}
+                query = args.get("query") or args.get("queries") or ""
+                note = f"[Результат {m.name or 'инструмента'} по запросу {query!r} ({len(_message_text(m))} симв.) опущен"
+                if self.sources:
+                    note += f"; источники: {', '.join(self.sources)}"
+                note += ". Вызови инструмент снова, если нужен полный текст.]"
+                m = ToolMessage(content=note, name=m.name, tool_call_id=m.tool_call_id)
+            compacted.append(m)
+        self.messages = compacted
+        self.tool_results_compacted = True
+        self.measure()
+
+
+@dataclass
+class _ChatHistory:
+    turns: deque[_Turn] = field(default_factory=deque)
+    # Folded turns, oldest first, one line each
+    summary: deque[str] = field(default_factory=deque)
+    summary_tokens: int = 0
+    size: int = 0
+
+    @property
+    def tokens(self) -> int:
+        return self.summary_tokens + sum(t.tokens for t in self.turns)
+
+
+class ConversationStore:
+    """Bounded in-memory conversation history of every chat in the process.
+
+    Each chat keeps its recent turns within ``token_budget`` estimated tokens.
+    Retrieved documents are kept verbatim only for the last
+    ``full_tool_turns`` turns, so a follow-up can reuse them without another
+    lookup; older tool results shrink to a note naming the query and sources.
+    When the budget is exceeded the oldest turns are folded into a short
+    question/answer summary, itself capped at a quarter of the budget.
+    Across chats the least recently active ones are evicted once there are
+    more than ``max_chats`` or the history takes more than ``max_bytes``.
+
+    Webhook workers each hold their own store; updates of a chat always go to
+    the same worker, so its history is never split.
+    """
+
+    def __init__(self, token_budget: int, max_chats: int, max_bytes: int, full_tool_turns: int = 1) -> None:
+        self.token_budget = token_budget
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.full_tool_turns = full_tool_turns
+        self._chats: OrderedDict[int, _ChatHistory] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._chats
+
+    @property
+    def size(self) -> int:
+        """Approximate memory taken by the stored messages, in bytes."""
+        return self._size
+
+    def fingerprint(self, chat_id: int) -> str:
+        """Digest of the history the next question of ``chat_id`` would be sent with; empty without history."""
+        history = self._chats.get(chat_id)
+        if history is None:
+            return ""
+        digest = hashlib.sha1()
+        for part in (*history.summary, *(text for turn in history.turns for text in (turn.question, turn.answer))):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def messages(self, chat_id: int, user_text: str) -> list[BaseMessage]:
+        """History of ``chat_id`` followed by the new question, ready for the agent.
+
+        The summary of folded turns is prepended to the oldest human message
+        rather than sent as a separate system message.
+        """
+        history = self._chats.get(chat_id)
+        question = HumanMessage(content=user_text)
+        if history is None:
+            return [question]
+        self._chats.move_to_end(chat_id)
+        messages = [m for turn in history.turns for m in turn.messages] + [question]
+        if history.summary:
+            summary = "\n".join((_SUMMARY_HEADER, *history.summary))
+            messages[0] = HumanMessage(content=f"{summary}\n\n{_message_text(messages[0])}")
+        return messages
+
+    def append(
+        self,
+        chat_id: int,
+        question: str,
+        answer: str,
+        messages: list[BaseMessage],
+        sources: list[str] | None = None,
+    ) -> None:
+        """Record a finished turn; ``messages`` start with the question itself."""
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = self._chats[chat_id] = _ChatHistory()
+        self._chats.move_to_end(chat_id)
+
+        turn = _Turn(question=question, answer=answer, messages=list(messages), sources=list(sources or []))
+        turn.measure()
+        history.turns.append(turn)
+        for old in list(history.turns)[: -self.full_tool_turns or None]:
+            old.compact_tool_results()
+        self._fit(history)
+        self._resize(history)
+        self._evict()
+
+    def clear(self, chat_id: int) -> None:
+        history = self._chats.pop(chat_id, None)
+        if history is not None:
+            self._size -= history.size
+            self._publish()
+
+    def _fit(self, history: _ChatHistory) -> None:
+        summary_budget = self.token_budget // 4
+        while True:
+            # Capped on every pass: a summary line of a short turn can outweigh the turn itself
+            while history.summary_tokens > summary_budget and history.summary:
+                history.summary_tokens -= estimate_tokens(history.summary.popleft())
+            if history.tokens <= self.token_budget or not history.turns:
+                return
+            last = history.turns[-1]
+            if len(history.turns) == 1 and not last.tool_results_compacted:
+                # The latest turn alone is too big: drop its documents before the turn itself
+                last.compact_tool_results()
+                continue
+            self._fold(history, history.turns.popleft())
+
+    def _fold(self, history: _ChatHistory, turn: _Turn) -> None:
+        line = f"- Вопрос: {_shorten(turn.question, _SUMMARY_QUESTION_CHARS)} Ответ: {_shorten(turn.answer, _SUMMARY_ANSWER_CHARS)}"
+        history.summary.append(line)
+        history.summary_tokens += estimate_tokens(line)
+        HISTORY_FOLDS_TOTAL.inc()
+
+    def _resize(self, history: _ChatHistory) -> None:
+        size = sum(t.size for t in history.turns) + sum(sys.getsizeof(line) for line in history.summary)
+        self._size += size - history.size
+        history.size = size
+
+    def _evict(self) -> None:
+        # The most recently active chat stays even if it alone is over the cap
+        while len(self._chats) > 1 and (len(self._chats) > self.max_chats or self._size > self.max_bytes):
+            _, history = self._chats.popitem(last=False)
+            self._size -= history.size
+            HISTORY_EVICTIONS_TOTAL.inc()
+        self._publish()
+
+    def _publish(self) -> None:
+        HISTORY_CHATS.set(len(self._chats))
+        HISTORY_BYTES.set(self._size)
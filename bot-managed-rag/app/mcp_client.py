@@ -1,17 +1,109 @@
 from __future__ import annotations
 
 import asyncio
-from contextlib import AsyncExitStack
-from typing import Any, Iterable
+import json
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterable
 
+import anyio
+import httpx
+from loguru import logger
 from mcp import ClientSession
 from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+from .metrics import MCP_ROUNDTRIP_SECONDS
+
+
+_SUPPORTED_TRANSPORTS = ("sse", "streamable-http")
+
+# Metadata keys that name where a document comes from, most specific first
+_SOURCE_KEYS = ("url", "source", "file_name", "document_name", "title")
+
+
+class McpToolError(RuntimeError):
+    """The MCP tool ran but reported a failure (``isError``); the message is the tool's own text."""
+
+    def __init__(self, tool: str, message: str) -> None:
+        super().__init__(f"MCP tool '{tool}' failed: {message or 'no details'}")
+        self.tool = tool
+        self.tool_message = message
+
+
+@dataclass(frozen=True)
+class RetrievedDocument:
+    """One document record of the server's ``retrieve_documents`` tool."""
+
+    id: str | None
+    score: float | None
+    content: str
+    metadata: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def source(self) -> str | None:
+        """Best available reference to the original document, if the metadata has one."""
+        for key in _SOURCE_KEYS:
+            value = self.metadata.get(key)
+            if value:
+                return str(value)
+        return None
+
+
+@dataclass(frozen=True)
+class DocumentSet:
+    """Typed result of ``retrieve_documents``: records plus knowledge bases that did not answer."""
+
+    documents: list[RetrievedDocument]
+    unavailable_knowledge_bases: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, text: str) -> "DocumentSet":
+        return cls.from_dict(json.loads(text) if text else {})
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "DocumentSet":
+        documents = [
+            RetrievedDocument(
+                id=d.get("id"),
+                score=d.get("score"),
+                content=d.get("content", ""),
+                metadata=d.get("metadata") or {},
+            )
+            for d in data.get("documents", [])
+        ]
+        return cls(documents, list(data.get("unavailable_knowledge_bases", [])))
+
+    def sources(self) -> list[str]:
+        """Distinct document sources in rank order."""
+        return list(dict.fromkeys(d.source for d in self.documents if d.source))
+
+    def to_context(self) -> str:
+        """Render the documents for the LLM in the layout of the server's text tools."""
+        parts = []
+        if self.unavailable_knowledge_bases:
+            parts.append(
+                f"Note: knowledge bases {', '.join(self.unavailable_knowledge_bases)} did not respond, "
+                "the context may be incomplete.\n\n"
+            )
+        parts.append("Context:\n\n")
+        for i, d in enumerate(self.documents, start=1):
+            metadata = "; ".join(f"{key}: {value}" for key, value in d.metadata.items())
+            parts.append(f"Document {i}:\nContent: {d.content}\n")
+            parts.append(f"Metadata: {metadata}\n\n" if metadata else "\n")
+        return "".join(parts)
 
 
 class McpClient:
-    """Async MCP client for SSE transport.
+    """Async MCP client for SSE and streamable-HTTP transports.
 
     Connects to a remote MCP server by URL and provides tool calling helpers.
+    With streamable HTTP every call is a plain POST over the session's
+    keep-alive connection, which works with stateless servers behind a load
+    balancer.
     """
 
     def __init__(self, url: str, transport: str = "sse") -> None:
@@ -21,13 +113,19 @@ class McpClient:
         self._session: ClientSession | None = None
 
     async def __aenter__(self) -> "McpClient":
-        if self._transport != "sse":
+        if self._transport not in _SUPPORTED_TRANSPORTS:
             raise NotImplementedError(
-                f"Transport '{self._transport}' is not implemented in this client yet. Use 'sse'."
+                f"Transport '{self._transport}' is not implemented in this client. "
+                f"Use one of: {', '.join(_SUPPORTED_TRANSPORTS)}."
             )
         stack = AsyncExitStack()
-        # Open SSE streams within the same exit stack
-        read_stream, write_stream = await stack.enter_async_context(sse_client(url=self._url))
+        # Open transport streams within the same exit stack
+        if self._transport == "sse":
+            read_stream, write_stream = await stack.enter_async_context(sse_client(url=self._url))
+        else:
+            read_stream, write_stream, _ = await stack.enter_async_context(
+                streamablehttp_client(url=self._url)
+            )
         # Open MCP session tied to the same stack
         session = await stack.enter_async_context(ClientSession(read_stream, write_stream))
         await session.initialize()
@@ -55,17 +153,48 @@ class McpClient:
         assert self._session is not None, "MCP session is not initialized"
         return self._session
 
+    async def ping(self) -> None:
+        await self.session.send_ping()
+
     async def list_tools(self) -> list[str]:
         resp = await self.session.list_tools()
         return [t.name for t in resp.tools]
 
-    async def call_tool_text(self, name: str, arguments: dict[str, Any]) -> str:
+    async def call_tool_text(
+        self, name: str, arguments: dict[str, Any], request_id: str | None = None
+    ) -> str:
         """Call a tool and return concatenated text content.
 
         This assumes the server returns a list of content blocks where text blocks
         are of type 'text' with field 'text'. Non-text results are ignored.
+        ``request_id`` is forwarded as a tool argument so server logs can be
+        joined with the bot's. Raises ``McpToolError`` with the tool's text if
+        the tool reports a failure.
+        """
+        text, _ = await self._call_tool(name, arguments, request_id)
+        return text
+
+    async def call_tool_documents(
+        self, name: str, arguments: dict[str, Any], request_id: str | None = None
+    ) -> DocumentSet:
+        """Call a tool that returns document records (``retrieve_documents``).
+
+        Reads the tool's ``structuredContent``; servers that predate it send
+        the same object as JSON text, which is parsed instead.
         """
-        result = await self.session.call_tool(name=name, arguments=arguments)
+        text, structured = await self._call_tool(name, arguments, request_id)
+        if isinstance(structured, dict):
+            return DocumentSet.from_dict(structured)
+        return DocumentSet.from_json(text)
+
+    async def _call_tool(
+        self, name: str, arguments: dict[str, Any], request_id: str | None
+    ) -> tuple[str, Any]:
+        """Text content and ``structuredContent`` of a tool call; raises ``McpToolError`` on failure."""
+        if request_id:
+            arguments = {**arguments, "request_id": request_id}
+        with MCP_ROUNDTRIP_SECONDS.labels(tool=name).time():
+            result = await self.session.call_tool(name=name, arguments=arguments)
         # result.content could be a list of content blocks
         blocks: Iterable[Any] = getattr(result, "content", [])
         texts: list[str] = []
@@ -73,4 +202,222 @@ class McpClient:
             text = getattr(b, "text", None)
             if text:
                 texts.append(text)
-        return "\n".join(texts).strip()
\ No newline at end of file
+        text = "\n".join(texts).strip()
+        if getattr(result, "isError", False):
+            raise McpToolError(name, text)
+        return text, getattr(result, "structuredContent", None)
+
+
+def _is_connection_error(exc: BaseException) -> bool:
+    """Whether the error means the underlying MCP stream is gone."""
+    if isinstance(exc, McpError):
+        return exc.error.code == CONNECTION_CLOSED
+    return isinstance(
+        exc,
+        (
+            anyio.ClosedResourceError,
+            anyio.BrokenResourceError,
+            anyio.EndOfStream,
+            httpx.TransportError,
+            ConnectionError,
+        ),
+    )
+
+
+class _PooledSession:
+    """One warm MCP session owned by a dedicated background task.
+
+    The transport opens anyio cancel scopes which must be entered and exited in
+    the same task, so the session is opened and closed inside ``_run`` and only
+    borrowed by the tasks that call tools.
+    """
+
+    def __init__(self, url: str, transport: str, index: int) -> None:
+        self._url = url
+        self._transport = transport
+        self._index = index
+        self._client: McpClient | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error: BaseException | None = None
+        self.last_used = 0.0
+        self.broken = False
+
+    @property
+    def alive(self) -> bool:
+        return (
+            not self.broken
+            and self._client is not None
+            and self._task is not None
+            and not self._task.done()
+        )
+
+    @property
+    def client(self) -> McpClient:
+        assert self._client is not None, "Pooled MCP session is not connected"
+        return self._client
+
+    async def open(self, timeout: float) -> None:
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error = None
+        self.broken = False
+        self._task = asyncio.create_task(self._run(), name=f"mcp-pool-session-{self._index}")
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise ConnectionError(f"Timed out connecting to MCP server at {self._url}") from None
+        if self._client is None:
+            raise ConnectionError(f"Failed to connect to MCP server at {self._url}: {self._error}") from self._error
+        self.last_used = time.monotonic()
+
+    async def _run(self) -> None:
+        try:
+            async with McpClient(self._url, transport=self._transport) as client:
+                self._client = client
+                self._ready.set()
+                await self._stop.wait()
+        except Exception as e:
+            self._error = e
+            logger.warning(f"MCP pooled session #{self._index} terminated: {e!r}")
+        finally:
+            self._client = None
+            self._ready.set()
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if task is None:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=5.0)
+        except asyncio.TimeoutError:
+            task.cancel()
+        except Exception:
+            pass
+
+
+class McpSessionPool:
+    """Process-wide pool of warm MCP sessions.
+
+    Sessions are opened once and reused across messages instead of paying for a
+    new transport connection and ``initialize()`` handshake per request. Idle
+    sessions are health-checked with a ping before reuse, dead ones are
+    reconnected transparently, and waiters are served in FIFO order.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        transport: str = "sse",
+        size: int = 4,
+        health_check_interval: float = 30.0,
+        acquire_timeout: float = 30.0,
+        connect_timeout: float = 15.0,
+    ) -> None:
+        self._url = url
+        self._transport = (transport or "sse").lower()
+        self._size = max(1, size)
+        self._health_check_interval = health_check_interval
+        self._acquire_timeout = acquire_timeout
+        self._connect_timeout = connect_timeout
+        self._slots = [_PooledSession(self._url, self._transport, i) for i in range(self._size)]
+        self._idle: asyncio.Queue[_PooledSession] = asyncio.Queue()
+        self._started = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+    async def start(self) -> None:
+        """Put all slots into the pool and warm them up concurrently.
+
+        A session that fails to connect at startup is not fatal: it is retried
+        on checkout.
+        """
+        if self._started:
+            return
+        self._started = True
+        results = await asyncio.gather(
+            *(slot.open(self._connect_timeout) for slot in self._slots),
+            return_exceptions=True,
+        )
+        for slot, res in zip(self._slots, results):
+            if isinstance(res, BaseException):
+                logger.warning(f"MCP pool warm-up failed for one session: {res!r}")
+            self._idle.put_nowait(slot)
+        warm = sum(1 for slot in self._slots if slot.alive)
+        logger.info(f"MCP session pool started: {warm}/{self._size} sessions connected to {self._url}")
+
+    async def close(self) -> None:
+        if not self._started:
+            return
+        self._started = False
+        await asyncio.gather(*(slot.close() for slot in self._slots), return_exceptions=True)
+
+    async def __aenter__(self) -> "McpSessionPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def _ensure_healthy(self, slot: _PooledSession) -> None:
+        if slot.alive and time.monotonic() - slot.last_used >= self._health_check_interval:
+            try:
+                await asyncio.wait_for(slot.client.ping(), timeout=self._connect_timeout)
+            except Exception as e:
+                logger.warning(f"MCP pooled session failed health check: {e!r}")
+                slot.broken = True
+        if not slot.alive:
+            await slot.close()
+            await slot.open(self._connect_timeout)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[McpClient]:
+        """Check out a healthy session for exclusive use by the caller."""
+        if not self._started:
+            await self.start()
+        slot = await asyncio.wait_for(self._idle.get(), timeout=self._acquire_timeout)
+        try:
+            await self._ensure_healthy(slot)
+            try:
+                yield slot.client
+            except BaseException as e:
+                if _is_connection_error(e):
+                    slot.broken = True
+                raise
+            finally:
+                slot.last_used = time.monotonic()
+        finally:
+            self._idle.put_nowait(slot)
+
+    async def list_tools(self) -> list[str]:
+        async with self.acquire() as client:
+            return await client.list_tools()
+
+    async def call_tool_text(
+        self, name: str, arguments: dict[str, Any], request_id: str | None = None
+    ) -> str:
+        """Call a tool on a pooled session, retrying once on a dropped stream."""
+        try:
+            async with self.acquire() as client:
+                return await client.call_tool_text(name=name, arguments=arguments, request_id=request_id)
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            logger.warning(f"MCP session dropped during '{name}' call, reconnecting: {e!r}")
+        async with self.acquire() as client:
+            return await client.call_tool_text(name=name, arguments=arguments, request_id=request_id)
+
+    async def call_tool_documents(
+        self, name: str, arguments: dict[str, Any], request_id: str | None = None
+    ) -> DocumentSet:
+        """``McpClient.call_tool_documents`` on a pooled session."""
+        return DocumentSet.from_json(await self.call_tool_text(name=name, arguments=arguments, request_id=request_id))
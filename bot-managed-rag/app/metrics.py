@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import uuid
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Buckets from fast cache hits up to slow LLM generations
+_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+MESSAGES_TOTAL = Counter("bot_messages_total", "Text messages received", ["outcome"])
+FIRST_TOKEN_SECONDS = Histogram(
+    "bot_first_token_seconds",
+    "Time from message received to the first answer token",
+    buckets=_LATENCY_BUCKETS,
+)
+AGENT_RUN_SECONDS = Histogram(
+    "bot_agent_run_seconds", "Full agent run duration", buckets=_LATENCY_BUCKETS
+)
+TOOL_CALL_SECONDS = Histogram(
+    "bot_tool_call_seconds",
+    "Agent tool call duration including MCP session checkout",
+    ["tool"],
+    buckets=_LATENCY_BUCKETS,
+)
+MCP_ROUNDTRIP_SECONDS = Histogram(
+    "bot_mcp_roundtrip_seconds", "MCP tools/call round trip", ["tool"], buckets=_LATENCY_BUCKETS
+)
+TELEGRAM_EDIT_SECONDS = Histogram(
+    "bot_telegram_edit_seconds", "Telegram editMessageText latency", buckets=_LATENCY_BUCKETS
+)
+TELEGRAM_RETRY_AFTER_TOTAL = Counter(
+    "bot_telegram_retry_after_total", "Telegram flood-control (429) responses"
+)
+RUNS_IN_FLIGHT = Gauge("bot_runs_in_flight", "Agent runs currently executing")
+RUNS_WAITING = Gauge("bot_runs_waiting", "Agent runs queued behind the worker limit")
+MCP_POOL_IDLE = Gauge("bot_mcp_pool_idle_sessions", "Idle sessions in the MCP session pool")
+ANSWER_CACHE_REQUESTS_TOTAL = Counter("bot_answer_cache_requests_total", "Answer cache lookups", ["outcome"])
+ANSWER_CACHE_SAVED_SECONDS_TOTAL = Counter(
+    "bot_answer_cache_saved_seconds_total", "Agent run time saved by answering from the answer cache"
+)
+ANSWER_CACHE_ENTRIES = Gauge("bot_answer_cache_entries", "Answers in the answer cache")
+STARTUP_SECONDS = Gauge("bot_startup_seconds", "Duration of startup phases of this process", ["phase"])
+HISTORY_CHATS = Gauge("bot_history_chats", "Chats with conversation history kept in memory")
+HISTORY_BYTES = Gauge("bot_history_bytes", "Approximate memory taken by conversation history")
+HISTORY_FOLDS_TOTAL = Counter(
+    "bot_history_folds_total", "Conversation turns folded into the summary to fit the token budget"
+)
+HISTORY_EVICTIONS_TOTAL = Counter(
+    "bot_history_evictions_total", "Chats whose history was dropped to fit the memory limits"
+)
+
+
+_ready = False
+
+
+def set_ready(ready: bool) -> None:
+    """Flip the ``/readyz`` probe: ready after the warm-up, not ready while draining."""
+    global _ready
+    _ready = ready
+
+
+def new_request_id() -> str:
+    """Short random ID that ties bot and MCP server log lines of one message together."""
+    return uuid.uuid4().hex[:16]
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def _readyz_handler(request: web.Request) -> web.Response:
+    return web.json_response({"ready": _ready}, status=200 if _ready else 503)
+
+
+def add_metrics_route(app: web.Application) -> None:
+    app.router.add_get("/metrics", _metrics_handler)
+    app.router.add_get("/readyz", _readyz_handler)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve ``/metrics`` and ``/readyz`` on a small aiohttp server; stop it with ``runner.cleanup()``."""
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram.exceptions import TelegramRetryAfter
+from loguru import logger
+
+from .metrics import TELEGRAM_EDIT_SECONDS, TELEGRAM_RETRY_AFTER_TOTAL
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, up to ``burst`` stored."""
+
+    def __init__(self, rate: float, burst: float = 1.0) -> None:
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        self._rate = rate
+        self._burst = max(1.0, burst)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float) -> None:
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        # Tokens earned so far accrue at the old rate
+        self._refill(time.monotonic())
+        self._rate = rate
+
+    @property
+    def full(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self._burst and now >= self._blocked_until
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available; otherwise return how long to wait."""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self._rate
+
+    async def acquire(self) -> None:
+        while (delay := self.try_acquire()) > 0:
+            await asyncio.sleep(delay)
+
+    def block(self, seconds: float) -> None:
+        """Hand out no tokens for ``seconds`` (used for Telegram's retry_after)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+@dataclass
+class _PendingEdit:
+    text: str
+    edit_fn: Callable[[str], Awaitable[Any]]
+    future: asyncio.Future[None] = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class EditScheduler:
+    """Process-wide scheduler for streamed message edits.
+
+    Edits pass through a per-chat and a global token bucket, so the bot stays
+    within Telegram's flood limits no matter how many answers stream at once.
+    Pending edits of the same message are merged and only the newest text is
+    sent. ``TelegramRetryAfter`` pauses the affected chat and the edit is
+    retried afterwards instead of failing the answer; it also halves the
+    global rate, which then creeps back to ``global_rate`` with every edit
+    that goes through.
+    """
+
+    # Share of the configured global rate regained per successful edit
+    _RECOVERY_STEP = 0.02
+    # The global rate is never lowered below this share of the configured one
+    _MIN_RATE_SHARE = 0.1
+
+    def __init__(
+        self,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 1.0,
+        min_interval: float = 0.4,
+    ) -> None:
+        self._global = TokenBucket(global_rate, burst=global_rate)
+        self._global_rate = global_rate
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._min_interval = min_interval
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._pending: dict[tuple[int, int], _PendingEdit] = {}
+        self._chat_queues: dict[int, deque[tuple[int, int]]] = {}
+        self._workers: dict[int, asyncio.Task[None]] = {}
+        self._active_streams = 0
+        self.sent = 0
+        self.merged = 0
+        self.retry_after = 0
+
+    def stream_started(self) -> None:
+        self._active_streams += 1
+
+    def stream_finished(self) -> None:
+        self._active_streams = max(0, self._active_streams - 1)
+
+    def interval_hint(self) -> float:
+        """Edit interval a stream should use under the current load.
+
+        Each active stream gets an equal share of the global edit budget, and
+        never more than its chat allows.
+        """
+        fair_share = max(1, self._active_streams) / self._global.rate
+        return max(self._min_interval, 1.0 / self._chat_rate, fair_share)
+
+    def submit(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        edit_fn: Callable[[str], Awaitable[Any]],
+    ) -> asyncio.Future[None]:
+        """Schedule ``edit_fn(text)``; replaces a not-yet-sent edit of the same message.
+
+        The returned future resolves once this (or a newer) text was sent.
+        """
+        key = (chat_id, message_id)
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.text = text
+            pending.edit_fn = edit_fn
+            self.merged += 1
+            return pending.future
+        pending = _PendingEdit(text=text, edit_fn=edit_fn)
+        self._pending[key] = pending
+        self._chat_queues.setdefault(chat_id, deque()).append(key)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return pending.future
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, burst=self._chat_burst)
+        return bucket
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._chat_queues[chat_id]
+        bucket = self._chat_bucket(chat_id)
+        try:
+            while queue:
+                await bucket.acquire()
+                await self._global.acquire()
+                key = queue.popleft()
+                pending = self._pending.pop(key)
+                try:
+                    with TELEGRAM_EDIT_SECONDS.time():
+                        await pending.edit_fn(pending.text)
+                except TelegramRetryAfter as e:
+                    self.retry_after += 1
+                    TELEGRAM_RETRY_AFTER_TOTAL.inc()
+                    logger.warning(f"Telegram flood control in chat {chat_id}, retry in {e.retry_after}s")
+                    bucket.block(e.retry_after)
+                    self._slow_down()
+                    newer = self._pending.get(key)
+                    if newer is None:
+                        # Nothing newer arrived: retry the same text first
+                        self._pending[key] = pending
+                        queue.appendleft(key)
+                    else:
+                        # The newer text supersedes this one; resolve together
+                        newer.future.add_done_callback(lambda f, p=pending: _chain(f, p.future))
+                    continue
+                except Exception as e:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                    continue
+                self.sent += 1
+                self._speed_up()
+                if not pending.future.done():
+                    pending.future.set_result(None)
+        finally:
+            self._workers.pop(chat_id, None)
+            if not queue:
+                self._chat_queues.pop(chat_id, None)
+            if bucket.full:
+                self._chat_buckets.pop(chat_id, None)
+
+    def _slow_down(self) -> None:
+        rate = max(self._global_rate * self._MIN_RATE_SHARE, self._global.rate / 2)
+        if rate < self._global.rate:
+            logger.info(f"Global Telegram edit rate lowered to {rate:.1f}/s after flood control")
+            self._global.rate = rate
+
+    def _speed_up(self) -> None:
+        if self._global.rate < self._global_rate:
+            self._global.rate = min(self._global_rate, self._global.rate + self._global_rate * self._RECOVERY_STEP)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "active_streams": self._active_streams,
+            "pending": len(self._pending),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retry_after": self.retry_after,
+        }
+
+
+def _chain(source: asyncio.Future[None], target: asyncio.Future[None]) -> None:
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())  # type: ignore[arg-type]
+    else:
+        target.set_result(None)
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+from aiohttp import web
+from loguru import logger
+
+from .config import Settings
+from .metrics import set_ready, start_metrics_server
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+_WORKER_UPDATE_PATH = "/update"
+
+
+def route_key(update: dict[str, Any]) -> int:
+    """Chat ID of an update, so every update of one chat goes to the same worker.
+
+    Falls back to the sender and finally to ``update_id`` for updates without a chat.
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+    return int(update.get("update_id", 0))
+
+
+class _Worker:
+    """A bot worker process listening for forwarded updates on a Unix socket."""
+
+    def __init__(self, index: int, socket_path: Path) -> None:
+        self.index = index
+        self.socket_path = socket_path
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.session: aiohttp.ClientSession | None = None
+
+    def spawn(self) -> None:
+        self.socket_path.unlink(missing_ok=True)
+        ctx = multiprocessing.get_context("spawn")
+        self.process = ctx.Process(
+            target=_worker_main, args=(self.index, str(self.socket_path)), name=f"bot-worker-{self.index}"
+        )
+        self.process.start()
+        logger.info(f"Started bot worker {self.index} (pid {self.process.pid})")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def client(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=str(self.socket_path)))
+        return self.session
+
+    async def wait_ready(self, timeout: float) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            if not self.alive:
+                raise RuntimeError(f"Bot worker {self.index} exited during startup")
+            if self.socket_path.exists():
+                try:
+                    async with self.client().get("http://worker/healthz") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f"Bot worker {self.index} did not start in {timeout:.0f}s")
+
+
+class WebhookRouter:
+    """Receives Telegram webhooks on one port and fans them out to worker processes.
+
+    Each update is forwarded to worker ``chat_id % workers``, so different
+    chats are answered on different cores. Forwards of one chat go one at a
+    time: the worker acknowledges an update once its answer is queued, so
+    the chat's messages reach the worker's scheduler in the order they came.
+    Workers that die are restarted. On shutdown the router stops taking
+    updates (Telegram retries them after a non-2xx answer), waits for
+    in-flight forwards, and lets every worker drain its running answers.
+    """
+
+    def __init__(self, settings: Settings, socket_dir: Path) -> None:
+        self._settings = settings
+        self._workers = [
+            _Worker(i, socket_dir / f"worker-{i}.sock") for i in range(settings.webhook_workers)
+        ]
+        self._draining = False
+        self._in_flight = 0
+        # Per-chat forward locks and how many forwards hold or wait for each
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_forwards: dict[int, int] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._supervisor: asyncio.Task[None] | None = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self._settings.webhook_path, self._handle_update)
+        app.router.add_get("/healthz", self._healthz)
+        return app
+
+    async def start(self) -> None:
+        for worker in self._workers:
+            worker.spawn()
+        await asyncio.gather(*(w.wait_ready(timeout=60) for w in self._workers))
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self) -> None:
+        self._draining = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        await self._idle.wait()
+        for worker in self._workers:
+            if worker.alive and worker.process is not None and worker.process.pid is not None:
+                os.kill(worker.process.pid, signal.SIGTERM)
+        # Workers drain on their own; give them the same budget plus a little slack
+        grace = self._settings.bot_drain_timeout_sec + 10
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            await asyncio.to_thread(worker.process.join, grace)
+            if worker.process.is_alive():
+                logger.warning(f"Bot worker {worker.index} did not stop in {grace:.0f}s, killing it")
+                worker.process.kill()
+            if worker.session is not None:
+                await worker.session.close()
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(1)
+            for worker in self._workers:
+                if not worker.alive and not self._draining:
+                    logger.error(f"Bot worker {worker.index} exited, restarting it")
+                    worker.spawn()
+
+    async def _healthz(self, request: web.Request) -> web.Response:
+        alive = sum(w.alive for w in self._workers)
+        status = 200 if alive == len(self._workers) and not self._draining else 503
+        return web.json_response({"workers": len(self._workers), "alive": alive, "draining": self._draining}, status=status)
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        secret = self._settings.webhook_secret
+        if secret and request.headers.get(_SECRET_HEADER) != secret:
+            return web.Response(status=401)
+        if self._draining:
+            return web.Response(status=503)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        key = route_key(update)
+        worker = self._workers[key % len(self._workers)]
+
+        self._in_flight += 1
+        self._idle.clear()
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_forwards[key] = self._chat_forwards.get(key, 0) + 1
+        try:
+            async with lock:
+                async with worker.client().post(
+                    f"http://worker{_WORKER_UPDATE_PATH}", data=body, headers={"Content-Type": "application/json"}
+                ) as response:
+                    return web.Response(status=response.status)
+        except aiohttp.ClientError as e:
+            # Telegram redelivers the update later; by then the worker is restarted
+            logger.warning(f"Bot worker {worker.index} is unavailable: {e!r}")
+            return web.Response(status=503)
+        finally:
+            self._chat_forwards[key] -= 1
+            if not self._chat_forwards[key]:
+                del self._chat_forwards[key]
+                del self._chat_locks[key]
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+
+async def run_webhook(settings: Settings) -> None:
+    """Serve Telegram webhooks on ``BOT_WEBHOOK_PORT`` with ``BOT_WEBHOOK_WORKERS`` processes."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    with tempfile.TemporaryDirectory(prefix="bot-webhook-") as socket_dir:
+        router = WebhookRouter(settings, Path(socket_dir))
+        await router.start()
+        runner = web.AppRunner(router.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, settings.webhook_host, settings.webhook_port).start()
+        logger.info(
+            f"Webhook server listening on {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path} "
+            f"with {settings.webhook_workers} workers"
+        )
+
+        if settings.webhook_url:
+            session = None
+            if settings.telegram_api_url:
+                session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+            async with Bot(token=settings.telegram_token, session=session) as bot:
+                await bot.set_webhook(
+                    settings.webhook_url,
+                    secret_token=settings.webhook_secret,
+                    allowed_updates=["message"],
+                )
+            logger.info(f"Webhook registered at {settings.webhook_url}")
+        else:
+            logger.warning("BOT_WEBHOOK_URL is not set; the webhook must be registered with Telegram separately")
+
+        try:
+            await stop.wait()
+            logger.info("Shutting down: draining webhook workers")
+        finally:
+            await router.stop()
+            await runner.cleanup()
+
+
+def _worker_main(index: int, socket_path: str) -> None:
+    asyncio.run(_serve_worker(index, socket_path))
+
+
+async def _serve_worker(index: int, socket_path: str) -> None:
+    from .bot import build_bot, drain, warm_up
+
+    settings = Settings.load()
+    metrics_runner = None
+    if settings.metrics_port:
+        # Every worker has its own registry: expose it on METRICS_PORT + index
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port + index)
+    runtime = build_bot(settings)
+    draining = False
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if draining:
+            return web.Response(status=503)
+        update = Update.model_validate(await request.json(), context={"bot": runtime.bot})
+        await runtime.dp.feed_update(runtime.bot, update)
+        return web.Response()
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    app = web.Application()
+    app.router.add_post(_WORKER_UPDATE_PATH, handle_update)
+    app.router.add_get("/healthz", healthz)
+    runner = web.AppRunner(app, access_log=None)
+    try:
+        # The router waits for the socket, so updates only arrive after the warm-up
+        await warm_up(runtime)
+        async with runtime.mcp_pool:
+            await runner.setup()
+            await web.UnixSite(runner, socket_path).start()
+            set_ready(True)
+            logger.info(f"Bot worker {index} ready on {socket_path}")
+            await stop.wait()
+            draining = True
+            set_ready(False)
+            await drain(runtime, settings.bot_drain_timeout_sec)
+    finally:
+        await runner.cleanup()
+        await runtime.bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        logger.info(f"Bot worker {index} stopped")
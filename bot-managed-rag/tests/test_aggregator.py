@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from app.bot import _split_point, _TelegramAggregator
+
+
+class FakeMessage:
+    """Sent Telegram message: records its edits and the replies sent after it."""
+
+    def __init__(self, chat, text=""):
+        self.chat = chat
+        self.message_id = len(chat.messages)
+        self.text = text
+        self.edits = 0
+        chat.messages.append(self)
+
+    async def edit_text(self, text):
+        self.text = text
+        self.edits += 1
+
+    async def answer(self, text):
+        return FakeMessage(self.chat, text)
+
+
+def placeholder():
+    return FakeMessage(SimpleNamespace(id=1, messages=[]), "…")
+
+
+def test_split_prefers_paragraph_then_sentence_then_word():
+    assert _split_point("a" * 11 + "\n\n" + "b" * 3 + ". " + "c" * 10, 20) == 13
+    assert _split_point("a" * 12 + ". " + "c" * 10, 20) == 14
+    assert _split_point("a" * 12 + " " + "c" * 10, 20) == 13
+
+
+def test_split_ignores_separators_near_the_start():
+    assert _split_point("ab. " + "c" * 30, 20) == 20
+
+
+async def test_short_answer_is_edited_into_the_placeholder():
+    message = placeholder()
+    aggregator = _TelegramAggregator(message, interval=0, min_chars_delta=1, prefix="> ")
+    await aggregator.feed("Hello")
+    await aggregator.feed(", world")
+    await aggregator.flush(final=True)
+
+    assert message.chat.messages == [message]
+    assert message.text == "> Hello, world"
+    assert aggregator.get_text() == "> Hello, world"
+
+
+async def test_long_answer_rolls_over_into_new_messages():
+    message = placeholder()
+    aggregator = _TelegramAggregator(message, interval=0, min_chars_delta=1, prefix="> ", max_message_len=40)
+    sentences = [f"Sentence number {i} is here. " for i in range(6)]
+    for sentence in sentences:
+        await aggregator.feed(sentence)
+    await aggregator.flush(final=True)
+
+    texts = [m.text for m in message.chat.messages]
+    assert len(texts) > 2
+    assert texts[0].startswith("> Sentence number 0")
+    assert all(len(text) <= 42 for text in texts)
+    # Parts end at sentence boundaries and add up to the whole answer
+    assert all(text.rstrip().endswith(".") for text in texts)
+    assert " ".join(text.removeprefix("> ").strip() for text in texts) == "".join(sentences).strip()
+    assert aggregator.message is message.chat.messages[-1]
+    assert aggregator.get_text() == "> " + "".join(sentences)
+
+
+async def test_new_message_mode_leaves_the_original_untouched():
+    message = placeholder()
+    aggregator = _TelegramAggregator(message, interval=0, min_chars_delta=1, new_message=True)
+    await aggregator.feed("Cached answer")
+    await aggregator.flush(final=True)
+
+    assert message.edits == 0
+    assert [m.text for m in message.chat.messages[1:]] == ["Cached answer"]
+    assert aggregator.message is message.chat.messages[1]
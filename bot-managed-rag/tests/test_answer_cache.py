@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from app.answer_cache import AnswerCache, normalize_question
+from app.history import ConversationStore
+
+
+def make_cache(**kwargs):
+    options = dict(max_entries=10, ttl_sec=60, version_tool_name="knowledge_base_versions", version_refresh_sec=60)
+    options.update(kwargs)
+    return AnswerCache(**options)
+
+
+def test_normalize_question_ignores_case_spacing_and_edge_punctuation():
+    assert normalize_question("  Что такое   ЁЖ?! ") == "что такое еж"
+    assert normalize_question("Как войти?") == normalize_question("как  войти")
+
+
+def test_hit_requires_same_version_and_context():
+    cache = make_cache()
+    cache.put("Как войти?", "kb:1", "Через SSO.", 2.0)
+
+    assert cache.get("как войти", "kb:1").text == "Через SSO."
+    assert cache.get("как войти", "kb:2") is None
+    assert cache.get("как войти", "kb:1", context="abc") is None
+
+
+def test_entries_expire_and_least_recently_used_is_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.answer_cache.time.monotonic", lambda: now[0])
+    cache = make_cache(max_entries=2, ttl_sec=10)
+    cache.put("a", "v", "A", 1.0)
+    cache.put("b", "v", "B", 1.0)
+    cache.get("a", "v")
+    cache.put("c", "v", "C", 1.0)
+
+    assert cache.get("b", "v") is None
+    assert cache.get("a", "v").text == "A"
+    now[0] += 11
+    assert cache.get("a", "v") is None
+    assert len(cache) == 1
+
+
+def test_blank_questions_and_answers_are_not_stored():
+    cache = make_cache()
+    cache.put("?!", "v", "answer", 1.0)
+    cache.put("question", "v", "   ", 1.0)
+
+    assert len(cache) == 0
+
+
+def test_purge_drops_everything():
+    cache = make_cache()
+    cache.put("a", "v", "A", 1.0)
+
+    assert cache.purge() == 1
+    assert cache.get("a", "v") is None
+
+
+class FakeMcp:
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.calls = 0
+
+    async def call_tool_text(self, name, arguments):
+        self.calls += 1
+        payload = self.payloads.pop(0)
+        if isinstance(payload, Exception):
+            raise payload
+        return json.dumps(payload)
+
+
+async def test_kb_version_is_fetched_once_then_refreshed_in_background():
+    mcp = FakeMcp(
+        {"knowledge_bases": [{"id": "kb", "version": "1"}]},
+        {"knowledge_bases": [{"id": "kb", "version": "2"}]},
+    )
+    cache = make_cache(version_refresh_sec=0.01)
+
+    assert await cache.kb_version(mcp) == "kb:1"
+    await asyncio.sleep(0.02)
+    # Stale: the last known version is returned while the refresh runs
+    assert await cache.kb_version(mcp) == "kb:1"
+    await asyncio.sleep(0)
+    assert await cache.kb_version(mcp) == "kb:2"
+    assert mcp.calls == 2
+
+
+async def test_kb_version_failure_keeps_cache_bypassed():
+    cache = make_cache()
+
+    assert await cache.kb_version(FakeMcp(RuntimeError("down"))) is None
+
+
+def test_history_fingerprint_tracks_the_conversation():
+    store = ConversationStore(token_budget=1000, max_chats=10, max_bytes=10**6)
+    assert store.fingerprint(1) == ""
+
+    store.append(1, "вопрос", "ответ", [])
+    store.append(2, "вопрос", "ответ", [])
+    first = store.fingerprint(1)
+    assert first and first == store.fingerprint(2)
+
+    store.append(1, "еще вопрос", "еще ответ", [])
+    assert store.fingerprint(1) not in ("", first)
@@ -0,0 +1,163 @@
+import asyncio
+
+from app.bot import _ChatScheduler
+
+
+async def test_prepare_can_finish_a_run_without_a_worker_slot():
+    scheduler = _ChatScheduler(max_concurrency=1, max_waiting=10)
+    release = asyncio.Event()
+    log = []
+
+    async def slow_job():
+        log.append("slow")
+        await release.wait()
+
+    async def job():
+        log.append("job")
+
+    async def handled():
+        log.append("prepared")
+        return False
+
+    scheduler.submit(1, slow_job)
+    await asyncio.sleep(0)
+    # The only worker is busy with chat 1, yet chat 2's prepared run completes
+    await asyncio.wait_for(scheduler.submit(2, job, prepare=handled), 1)
+
+    assert log == ["slow", "prepared"]
+    release.set()
+    await scheduler.join()
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+async def test_prepare_runs_after_the_chat_earlier_runs():
+    scheduler = _ChatScheduler(max_concurrency=4, max_waiting=10)
+    log = []
+
+    async def job(name):
+        log.append(name)
+        await asyncio.sleep(0.01)
+
+    async def prepare():
+        log.append("prepare")
+        return True
+
+    scheduler.submit(1, lambda: job("first"))
+    scheduler.submit(1, lambda: job("second"), prepare=prepare)
+    await scheduler.join()
+
+    assert log == ["first", "prepare", "second"]
+
+
+async def test_superseded_prepared_run_is_cancelled():
+    scheduler = _ChatScheduler(max_concurrency=1, max_waiting=10, cancel_superseded=True)
+    started = asyncio.Event()
+    cancelled = []
+
+    async def prepare():
+        started.set()
+        await asyncio.sleep(10)
+        return False
+
+    async def on_cancel():
+        cancelled.append(True)
+
+    async def job():
+        pass
+
+    scheduler.submit(1, job, on_cancel=on_cancel, prepare=prepare)
+    await started.wait()
+    scheduler.submit(1, job)
+    await scheduler.join()
+
+    assert cancelled == [True]
+
+
+async def test_runs_of_one_chat_are_ordered():
+    scheduler = _ChatScheduler(max_concurrency=4, max_waiting=10)
+    log = []
+
+    async def job(name, delay):
+        await asyncio.sleep(delay)
+        log.append(name)
+
+    scheduler.submit(1, lambda: job("a", 0.03))
+    scheduler.submit(1, lambda: job("b", 0))
+    scheduler.submit(2, lambda: job("other", 0.01))
+    await scheduler.join()
+
+    assert log == ["other", "a", "b"]
+
+
+async def test_concurrency_is_bounded_across_chats():
+    scheduler = _ChatScheduler(max_concurrency=2, max_waiting=10)
+    release = asyncio.Event()
+    active = peak = 0
+
+    async def job():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await release.wait()
+        active -= 1
+
+    for chat_id in range(5):
+        scheduler.submit(chat_id, job)
+    await asyncio.sleep(0.01)
+    assert (scheduler.running, scheduler.waiting) == (2, 3)
+
+    release.set()
+    await scheduler.join()
+    assert peak == 2
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+async def test_overloaded_once_max_waiting_runs_are_queued():
+    scheduler = _ChatScheduler(max_concurrency=1, max_waiting=2)
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    scheduler.submit(1, job)
+    await asyncio.sleep(0)
+    scheduler.submit(2, job)
+    assert not scheduler.overloaded
+    # Counted before its task gets to run
+    scheduler.submit(3, job)
+    assert scheduler.overloaded
+
+    release.set()
+    await scheduler.join()
+    assert not scheduler.overloaded
+
+
+async def test_new_message_cancels_running_and_queued_runs_of_the_chat():
+    scheduler = _ChatScheduler(max_concurrency=4, max_waiting=10, cancel_superseded=True)
+    started = asyncio.Event()
+    log = []
+
+    async def job(name):
+        started.set()
+        await asyncio.sleep(10)
+        log.append(name)
+
+    async def last():
+        log.append("last")
+
+    def on_cancel(name):
+        async def cancelled():
+            log.append(f"cancelled {name}")
+
+        return cancelled
+
+    scheduler.submit(1, lambda: job("running"), on_cancel=on_cancel("running"))
+    await started.wait()
+    scheduler.submit(1, lambda: job("queued"), on_cancel=on_cancel("queued"))
+    # Let the queued run start waiting for the chat lock
+    await asyncio.sleep(0)
+    scheduler.submit(1, last)
+    await scheduler.join()
+
+    assert sorted(log[:2]) == ["cancelled queued", "cancelled running"]
+    assert log[2:] == ["last"]
@@ -0,0 +1,94 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from app.history import ConversationStore
+
+
+def turn_messages(question, answer, document=""):
+    messages = [HumanMessage(content=question)]
+    if document:
+        messages += [
+            AIMessage(content="", tool_calls=[{"id": "call", "name": "request_to_rag", "args": {"query": question}}]),
+            ToolMessage(content=document, name="request_to_rag", tool_call_id="call"),
+        ]
+    return messages + [AIMessage(content=answer)]
+
+
+def add_turn(store, chat_id, question, answer="answer", document=""):
+    store.append(chat_id, question, answer, turn_messages(question, answer, document), sources=["doc.pdf"])
+
+
+def test_follow_up_gets_the_earlier_turn():
+    store = ConversationStore(token_budget=1000, max_chats=10, max_bytes=10**6)
+    assert [m.content for m in store.messages(1, "first")] == ["first"]
+
+    add_turn(store, 1, "first", "one")
+    assert [m.content for m in store.messages(1, "second")] == ["first", "one", "second"]
+    assert [m.content for m in store.messages(2, "other chat")] == ["other chat"]
+
+
+def test_older_tool_results_are_compacted():
+    store = ConversationStore(token_budget=10_000, max_chats=10, max_bytes=10**6, full_tool_turns=1)
+    add_turn(store, 1, "q1", document="d" * 900)
+    add_turn(store, 1, "q2", document="e" * 900)
+
+    tool_results = [m.content for m in store.messages(1, "q3") if isinstance(m, ToolMessage)]
+    assert "d" * 900 not in tool_results[0]
+    assert "'q1'" in tool_results[0] and "doc.pdf" in tool_results[0]
+    assert tool_results[1] == "e" * 900
+
+
+def test_turns_over_budget_are_folded_into_a_summary():
+    store = ConversationStore(token_budget=200, max_chats=10, max_bytes=10**6)
+    for i in range(7):
+        add_turn(store, 1, f"question {i}", f"answer {i} " * 9)
+
+    messages = store.messages(1, "next")
+    first = messages[0].content
+    assert first.startswith("Краткое содержание предыдущего разговора:\n- Вопрос: question ")
+    kept = [m.content for m in messages if isinstance(m, HumanMessage)][1:-1]
+    assert kept[-1] == "question 6"
+    assert len(kept) < 6
+    assert messages[-1].content == "next"
+
+
+def test_oversized_single_turn_drops_its_documents_first():
+    store = ConversationStore(token_budget=100, max_chats=10, max_bytes=10**6)
+    add_turn(store, 1, "q", "a", document="x" * 3000)
+
+    messages = store.messages(1, "next")
+    assert [m.content for m in messages[:1]] == ["q"]
+    assert "x" * 3000 not in messages[2].content
+
+
+def test_least_recently_active_chats_are_evicted():
+    store = ConversationStore(token_budget=1000, max_chats=2, max_bytes=10**6)
+    add_turn(store, 1, "q")
+    add_turn(store, 2, "q")
+    store.messages(1, "touch")
+    add_turn(store, 3, "q")
+
+    assert 1 in store and 3 in store and 2 not in store
+    assert len(store) == 2
+
+
+def test_byte_cap_evicts_but_keeps_the_active_chat():
+    store = ConversationStore(token_budget=10_000, max_chats=10, max_bytes=1)
+    add_turn(store, 1, "q")
+    add_turn(store, 2, "q")
+
+    assert list(store._chats) == [2]
+    store.clear(2)
+    assert (len(store), store.size) == (0, 0)
+
+
+def test_fingerprint_follows_the_history():
+    store = ConversationStore(token_budget=1000, max_chats=10, max_bytes=10**6)
+    assert store.fingerprint(1) == ""
+
+    add_turn(store, 1, "q", "a")
+    first = store.fingerprint(1)
+    add_turn(store, 2, "q", "a")
+    assert store.fingerprint(2) == first
+
+    add_turn(store, 1, "q2", "a2")
+    assert store.fingerprint(1) not in ("", first)
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+from app.mcp_client import DocumentSet, McpClient, McpToolError
+
+
+class FakeSession:
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    async def call_tool(self, name, arguments):
+        self.calls.append((name, arguments))
+        return self.result
+
+
+def client_with(result):
+    client = McpClient("http://mcp.invalid")
+    client._session = FakeSession(result)
+    return client
+
+
+def text_result(text, is_error=False):
+    return CallToolResult(content=[TextContent(type="text", text=text)], isError=is_error)
+
+
+async def test_text_blocks_are_joined_and_request_id_forwarded():
+    result = CallToolResult(content=[TextContent(type="text", text="a"), TextContent(type="text", text="b")])
+    client = client_with(result)
+
+    assert await client.call_tool_text("tool", {"query": "q"}, request_id="r1") == "a\nb"
+    assert client.session.calls == [("tool", {"query": "q", "request_id": "r1"})]
+
+
+async def test_tool_error_is_raised_with_the_tool_text():
+    client = client_with(text_result("Не удалось получить релевантные документы", is_error=True))
+
+    with pytest.raises(McpToolError, match="Не удалось получить релевантные документы") as info:
+        await client.call_tool_text("request_to_rag", {"query": "q"})
+    assert info.value.tool == "request_to_rag"
+
+
+async def test_documents_tool_error_is_not_a_json_error():
+    client = client_with(text_result("Error executing tool retrieve_documents: upstream down", is_error=True))
+
+    with pytest.raises(McpToolError, match="upstream down"):
+        await client.call_tool_documents("retrieve_documents", {"query": "q"})
+
+
+async def test_documents_are_parsed_into_records():
+    payload = {
+        "documents": [
+            {"id": "1", "score": 0.9, "content": "text", "metadata": {"title": "Doc", "url": "https://x"}},
+            {"id": "2", "score": 0.5, "content": "more", "metadata": {"url": "https://x"}},
+        ],
+        "unavailable_knowledge_bases": ["kb2"],
+    }
+    documents = await client_with(text_result(json.dumps(payload))).call_tool_documents("retrieve_documents", {})
+
+    assert [d.id for d in documents.documents] == ["1", "2"]
+    assert documents.sources() == ["https://x"]
+    assert documents.unavailable_knowledge_bases == ["kb2"]
+    assert "did not respond" in documents.to_context()
+
+
+async def test_structured_content_is_preferred_over_text():
+    payload = {"documents": [{"id": "1", "content": "structured"}]}
+    result = CallToolResult(content=[TextContent(type="text", text="not json")], structuredContent=payload)
+    documents = await client_with(result).call_tool_documents("retrieve_documents", {})
+
+    assert [d.content for d in documents.documents] == ["structured"]
+
+
+def test_empty_document_payload():
+    assert DocumentSet.from_json("").documents == []
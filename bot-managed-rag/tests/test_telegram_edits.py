@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.config import Settings
+from app.telegram_edits import EditScheduler, TokenBucket
+
+
+def test_bucket_hands_out_burst_then_asks_to_wait():
+    bucket = TokenBucket(rate=10, burst=2)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 0.1
+
+
+def test_blocked_bucket_waits_out_the_block():
+    bucket = TokenBucket(rate=100, burst=5)
+    bucket.block(1.0)
+
+    assert 0.9 < bucket.try_acquire() <= 1.0
+    assert not bucket.full
+
+
+def test_bucket_rejects_non_positive_rates():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+    bucket = TokenBucket(rate=1)
+    with pytest.raises(ValueError):
+        bucket.rate = 0
+
+
+@pytest.mark.parametrize("name", ["TELEGRAM_GLOBAL_EDITS_PER_SEC", "TELEGRAM_CHAT_EDITS_PER_SEC"])
+def test_settings_reject_zero_edit_rates(monkeypatch, name):
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "123:token")
+    monkeypatch.setenv("MCP_SERVER_URL", "http://mcp.invalid/sse")
+    monkeypatch.setenv("GIGACHAT_CREDENTIALS", "id:secret")
+    monkeypatch.setenv(name, "0")
+
+    with pytest.raises(RuntimeError, match=name):
+        Settings.load()
+
+
+async def test_pending_edits_of_a_message_are_merged():
+    scheduler = EditScheduler(global_rate=100, chat_rate=100, chat_burst=10)
+    sent = []
+
+    async def edit(text):
+        sent.append(text)
+
+    futures = [scheduler.submit(1, 10, text, edit) for text in ("a", "ab", "abc")]
+    await asyncio.gather(*futures)
+
+    assert sent == ["abc"]
+    assert (scheduler.sent, scheduler.merged) == (1, 2)
+
+
+async def test_retry_after_retries_the_edit_and_slows_the_global_rate():
+    scheduler = EditScheduler(global_rate=20, chat_rate=100, chat_burst=10)
+    attempts = []
+
+    async def edit(text):
+        attempts.append(text)
+        if len(attempts) == 1:
+            raise TelegramRetryAfter(method=object(), message="Too Many Requests", retry_after=0.05)
+
+    await asyncio.wait_for(scheduler.submit(1, 10, "text", edit), 1)
+
+    assert attempts == ["text", "text"]
+    assert scheduler.retry_after == 1
+    # Halved by flood control, then one step back up for the successful retry
+    assert scheduler._global.rate == pytest.approx(10 + 20 * EditScheduler._RECOVERY_STEP)
+    assert scheduler.interval_hint() > 1 / 20
+
+
+async def test_global_rate_recovers_after_flood_control():
+    scheduler = EditScheduler(global_rate=100, chat_rate=1000, chat_burst=1000)
+    scheduler._slow_down()
+    assert scheduler._global.rate == 50
+
+    async def edit(text):
+        pass
+
+    for i in range(60):
+        await scheduler.submit(1, i, "x", edit)
+
+    assert scheduler._global.rate == 100
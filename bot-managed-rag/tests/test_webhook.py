@@ -0,0 +1,78 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from app.webhook import WebhookRouter, route_key
+
+
+@pytest.mark.parametrize(
+    "update",
+    [
+        {"update_id": 1, "message": {"message_id": 5, "chat": {"id": -100}, "from": {"id": 7}, "text": "hi"}},
+        {"update_id": 2, "edited_message": {"message_id": 5, "chat": {"id": -100}, "from": {"id": 7}}},
+        {"update_id": 3, "callback_query": {"id": "q", "from": {"id": 7}, "message": {"chat": {"id": -100}}}},
+        {"update_id": 4, "my_chat_member": {"chat": {"id": -100}, "from": {"id": 8}}},
+    ],
+)
+def test_updates_of_one_chat_share_the_key(update):
+    assert route_key(update) == -100
+
+
+def test_update_without_chat_falls_back_to_the_sender():
+    update = {"update_id": 9, "inline_query": {"id": "q", "from": {"id": 7}, "query": "docs"}}
+    assert route_key(update) == 7
+
+
+def test_update_without_chat_or_sender_falls_back_to_its_id():
+    assert route_key({"update_id": 9, "poll": {"id": "p", "question": "?"}}) == 9
+    assert route_key({}) == 0
+
+
+class FakeWorker:
+    """Worker socket stand-in: acknowledges each update after its delay and records the order."""
+
+    index = 0
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.received = []
+
+    def client(self):
+        return self
+
+    @asynccontextmanager
+    async def post(self, url, data, headers):
+        update = json.loads(data)
+        await asyncio.sleep(self.delays.get(update["update_id"], 0))
+        self.received.append(update["update_id"])
+        yield SimpleNamespace(status=200)
+
+
+def webhook_request(update_id, chat_id):
+    body = json.dumps({"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": "hi"}}).encode()
+
+    async def read():
+        return body
+
+    return SimpleNamespace(headers={}, read=read)
+
+
+async def test_updates_of_one_chat_are_forwarded_in_order():
+    router = WebhookRouter(SimpleNamespace(webhook_workers=1, webhook_secret=None), Path("/nonexistent"))
+    worker = FakeWorker(delays={1: 0.05})
+    router._workers = [worker]
+
+    responses = await asyncio.gather(
+        router._handle_update(webhook_request(1, chat_id=10)),
+        router._handle_update(webhook_request(2, chat_id=10)),
+        router._handle_update(webhook_request(3, chat_id=20)),
+    )
+
+    assert [r.status for r in responses] == [200, 200, 200]
+    # Update 2 waits for the slow update 1 of its chat; chat 20 does not
+    assert worker.received == [3, 1, 2]
+    assert router._chat_locks == {} and router._chat_forwards == {}
@@ -1,25 +1,67 @@
-from typing import Dict, Any
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Literal, TypeVar
+import hashlib
 import httpx
+import json
+import multiprocessing
 import os
 import asyncio
+import random
+import secrets
+import signal
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
 from fastmcp import FastMCP
 from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
 
-# Constants
-AUTH_URL = "https://auth.iam.sbercloud.ru/auth/system/openid/token"
-RETRIEVE_URL_TEMPLATE = "https://{kb_id}.managed-rag.inference.cloud.ru/api/v1/retrieve"
+T = TypeVar("T")
+
+# Constants (адреса переопределяются для стендов и нагрузочных тестов с фейковыми сервисами)
+AUTH_URL = os.getenv("EVOLUTION_AUTH_URL") or "https://auth.iam.sbercloud.ru/auth/system/openid/token"
+RETRIEVE_URL_TEMPLATE = (
+    os.getenv("MANAGED_RAG_RETRIEVE_URL_TEMPLATE") or "https://{kb_id}.managed-rag.inference.cloud.ru/api/v1/retrieve"
+)
+# Срок жизни токена, если IAM не вернул expires_in
+_IAM_DEFAULT_TTL_SEC = 3600.0
 
 mcp = FastMCP("managed-rag")
-mcp.settings.port = 8003
-mcp.settings.host = "0.0.0.0"
+mcp.settings.port = int(os.getenv("MCP_PORT", "8003"))
+mcp.settings.host = os.getenv("MCP_HOST", "0.0.0.0")
+
+# Метрики Prometheus (эндпоинт /metrics)
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+TOOL_SECONDS = Histogram("mcp_tool_seconds", "Длительность вызова MCP-инструмента", ["tool"], buckets=_LATENCY_BUCKETS)
+TOOLS_IN_FLIGHT = Gauge("mcp_tools_in_flight", "Выполняющиеся вызовы инструментов", ["tool"])
+RAG_HTTP_SECONDS = Histogram(
+    "rag_http_seconds", "Длительность HTTP-запроса retrieve к Managed RAG", ["status"], buckets=_LATENCY_BUCKETS
+)
+IAM_REFRESH_SECONDS = Histogram("iam_token_refresh_seconds", "Длительность получения токена в IAM", buckets=_LATENCY_BUCKETS)
+IAM_REFRESH_FAILURES = Counter("iam_token_refresh_failures_total", "Неудачные попытки получить токен в IAM")
+RAG_KB_FAILURES = Counter(
+    "rag_kb_failures_total", "Базы знаний, не ответившие при запросе к нескольким базам", ["kb_id", "reason"]
+)
 
-# Глобальные переменные для хранения access_token
-_access_token: str | None = "no token"
-_access_token_lock = asyncio.Lock()
+# Общий для процесса HTTP-клиент к IAM и Managed RAG (пул keep-alive соединений)
+_http_client: httpx.AsyncClient | None = None
+_pool_stats_task: asyncio.Task | None = None
+_persist_cache = True
+# Состояние для пробы /readyz: прогрев завершен (удачно или нет), идет остановка
+_warmed_up = False
+_draining = False
+_warm_up_task: asyncio.Task | None = None
 
 
 def _require_env_vars(names: list[str]) -> dict[str, str]:
@@ -31,70 +73,1548 @@ def _require_env_vars(names: list[str]) -> dict[str, str]:
     return {n: os.getenv(n, "") for n in names}
 
 
+def _parse_positive_int(value: str | None, default: int) -> int:
+    if value is None:
+        return default
+    try:
+        parsed = int(value)
+        if parsed <= 0:
+            return default
+        return parsed
+    except (TypeError, ValueError):
+        return default
+
+
 def _parse_retrieve_limit(value: str | None, default: int = 6) -> int:
+    return _parse_positive_int(value, default)
+
+
+def _parse_positive_float(value: str | None, default: float) -> float:
     if value is None:
         return default
     try:
-        limit = int(value)
-        if limit <= 0:
+        parsed = float(value)
+        if parsed <= 0:
             return default
-        return limit
+        return parsed
     except (TypeError, ValueError):
         return default
 
 
+def _parse_bool(value: str | None, default: bool = False) -> bool:
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Stateless streamable HTTP: каждый запрос самодостаточен, поэтому реплики
+# сервера можно ставить за балансировщик без привязки сессии к инстансу
+_STATELESS_HTTP = _parse_bool(os.getenv("MCP_STATELESS_HTTP"), default=False)
+_JSON_RESPONSE = _parse_bool(os.getenv("MCP_JSON_RESPONSE"), default=False)
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Создает HTTP-клиент с настройками пула соединений из окружения."""
+    http2 = _parse_bool(os.getenv("RAG_HTTP2"), default=False)
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("RAG_HTTP2 включен, но пакет h2 не установлен (pip install 'httpx[http2]'). Используем HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=_parse_positive_int(os.getenv("RAG_HTTP_MAX_CONNECTIONS"), default=100),
+        max_keepalive_connections=_parse_positive_int(os.getenv("RAG_HTTP_MAX_KEEPALIVE_CONNECTIONS"), default=20),
+        keepalive_expiry=_parse_positive_float(os.getenv("RAG_HTTP_KEEPALIVE_EXPIRY_SEC"), default=60.0),
+    )
+    read_timeout = _parse_positive_float(os.getenv("RAG_HTTP_READ_TIMEOUT_SEC"), default=20.0)
+    timeout = httpx.Timeout(
+        connect=_parse_positive_float(os.getenv("RAG_HTTP_CONNECT_TIMEOUT_SEC"), default=5.0),
+        read=read_timeout,
+        write=read_timeout,
+        pool=_parse_positive_float(os.getenv("RAG_HTTP_POOL_TIMEOUT_SEC"), default=5.0),
+    )
+    logger.info(
+        f"HTTP-клиент: http2={http2}, max_connections={limits.max_connections}, "
+        f"max_keepalive={limits.max_keepalive_connections}, keepalive_expiry={limits.keepalive_expiry}s"
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий HTTP-клиент, создавая его при первом обращении."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+def http_pool_stats() -> dict[str, int]:
+    """Статистика пула соединений httpx (через внутренности httpcore, best-effort)."""
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", None) or [])
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for c in connections if c.is_idle()),
+        "queued_requests": len(getattr(pool, "_requests", None) or []),
+    }
+
+
+async def _log_http_pool_stats(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(
+            f"HTTP pool stats: {http_pool_stats()}; retrieve cache stats: {retrieve_cache.stats()}; "
+            f"single-flight stats: {retrieve_flights.stats()}"
+        )
+
+
+async def warm_up(timeout: float) -> None:
+    """Получает IAM-токен, пока /readyz еще отвечает 503, чтобы запросы после готовности не ждали IAM.
+
+    Неудача не останавливает сервер: /readyz отвечает 503 со статусом
+    ``degraded``, пока фоновое обновление не получит токен.
+    """
+    global _warmed_up
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(token_manager.get_token(), timeout)
+        logger.info(f"Прогрев: IAM-токен получен за {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.warning(f"Прогрев: не удалось получить IAM-токен за {time.perf_counter() - started:.2f}s: {e!r}")
+    finally:
+        _warmed_up = True
+
+
+def readiness() -> str:
+    """Состояние для /readyz: ``warming_up``, ``ready``, ``degraded`` (нет IAM-токена) или ``draining``."""
+    if _draining:
+        return "draining"
+    if not _warmed_up:
+        return "warming_up"
+    return "ready" if token_manager.has_token else "degraded"
+
+
+async def startup(persist_cache: bool = True) -> None:
+    """Открывает ресурсы процесса: общий HTTP-клиент, общее хранилище воркеров и логирование статистики пула.
+
+    ``persist_cache=False`` отключает загрузку и сохранение кэша на диск; при
+    нескольких воркерах этим занимается только первый. Прогрев IAM-токена
+    идет в фоне, уже после начала приема соединений, и /readyz до его
+    окончания отвечает 503.
+    """
+    global _pool_stats_task, shared_store, _persist_cache, _warmed_up, _draining, _warm_up_task
+    _persist_cache = persist_cache
+    if not os.getenv("EVOLUTION_SERVICE_ACCOUNT_KEY_SECRET"):
+        # Раньше вместо секрета отправлялся KEY_ID: старые развертывания задавали только его
+        logger.warning(
+            "EVOLUTION_SERVICE_ACCOUNT_KEY_SECRET не задан: IAM не выдаст токен. "
+            "Задайте EVOLUTION_SERVICE_ACCOUNT_KEY_ID и EVOLUTION_SERVICE_ACCOUNT_KEY_SECRET"
+        )
+    get_http_client()
+    shared_store = _build_shared_store()
+    token_manager.start()
+    cache_path = os.getenv("RAG_CACHE_PERSIST_PATH")
+    if retrieve_cache.enabled and cache_path and persist_cache:
+        retrieve_cache.load(cache_path)
+    interval = _parse_positive_float(os.getenv("RAG_HTTP_POOL_STATS_INTERVAL_SEC"), default=60.0)
+    _pool_stats_task = asyncio.create_task(_log_http_pool_stats(interval))
+    _warmed_up = _draining = False
+    _warm_up_task = asyncio.create_task(
+        warm_up(_parse_positive_float(os.getenv("MCP_WARMUP_TIMEOUT_SEC"), default=10.0))
+    )
+
+
+async def shutdown() -> None:
+    """Закрывает ресурсы процесса."""
+    global _http_client, _pool_stats_task, shared_store, _draining, _warm_up_task
+    _draining = True
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+        _warm_up_task = None
+    if _pool_stats_task is not None:
+        _pool_stats_task.cancel()
+        _pool_stats_task = None
+    await token_manager.stop()
+    if shared_store is not None:
+        await shared_store.close()
+        shared_store = None
+    cache_path = os.getenv("RAG_CACHE_PERSIST_PATH")
+    if retrieve_cache.enabled and cache_path and _persist_cache:
+        try:
+            retrieve_cache.dump(cache_path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш retrieve в {cache_path}: {e}")
+    if _http_client is not None:
+        logger.info(f"HTTP pool stats before shutdown: {http_pool_stats()}")
+        await _http_client.aclose()
+        _http_client = None
+
+
+@dataclass
+class PackStats:
+    """Сколько упаковщик контекста отбросил и обрезал.
+
+    Бюджет и ``chars_cut`` считаются в символах: для кириллицы они ближе к
+    токенам LLM, чем байты UTF-8. ``bytes_cut`` — то же срезанное в байтах.
+    """
+
+    chunks_in: int = 0
+    chunks_out: int = 0
+    duplicates_dropped: int = 0
+    over_budget_dropped: int = 0
+    chunks_trimmed: int = 0
+    chars_cut: int = 0
+    bytes_cut: int = 0
+
+    def cut(self, content: str, kept: str = "") -> None:
+        self.chars_cut += len(content) - len(kept)
+        self.bytes_cut += len(content.encode("utf-8")) - len(kept.encode("utf-8"))
+
+
+def _shingles(text: str, size: int = 3) -> set[str]:
+    words = text.casefold().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _trim(text: str, limit: int) -> str:
+    """Обрезает текст до ``limit`` символов по границе слова."""
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit - 1)
+    if cut < limit // 2:
+        cut = limit - 1
+    return text[:cut].rstrip() + "…"
+
+
+def _project_metadata(metadata: Any, fields: list[str] | None) -> str:
+    if not isinstance(metadata, dict) or not metadata:
+        return ""
+    items = metadata.items() if fields is None else ((f, metadata[f]) for f in fields if metadata.get(f))
+    return "; ".join(f"{key}: {value}" for key, value in items)
+
+
+def _select_chunks(
+    results: list[Dict[str, Any]],
+    max_chars: int,
+    max_chunk_chars: int,
+    overhead: Callable[[Dict[str, Any], int], int],
+    dedup_threshold: float = 0.9,
+) -> tuple[list[tuple[Dict[str, Any], str]], PackStats]:
+    """Отбирает фрагменты в пределах бюджета символов за один проход.
+
+    Почти одинаковые фрагменты (по Jaccard-сходству словесных шинглов)
+    отбрасываются, каждый фрагмент обрезается до ``max_chunk_chars`` и до
+    остатка бюджета. ``overhead(doc, номер)`` — сколько символов бюджета
+    занимает оформление фрагмента. Возвращает документы с обрезанным содержимым.
+    """
+    stats = PackStats(chunks_in=len(results))
+    selected: list[tuple[Dict[str, Any], str]] = []
+    used = 0
+    seen: list[set[str]] = []
+    for el in results:
+        content = " ".join(str(el.get("content", "")).split())
+        shingles = _shingles(content)
+        if any(len(shingles & other) / len(shingles | other) >= dedup_threshold for other in seen):
+            stats.duplicates_dropped += 1
+            stats.cut(content)
+            continue
+
+        extra = overhead(el, stats.chunks_out + 1)
+        room = min(max_chunk_chars, max_chars - used - extra)
+        # Меньше пары предложений в фрагменте смысла нет
+        if room < min(200, max_chunk_chars):
+            stats.over_budget_dropped += 1
+            stats.cut(content)
+            continue
+        trimmed = _trim(content, room)
+        if len(trimmed) < len(content):
+            stats.chunks_trimmed += 1
+            stats.cut(content, trimmed)
+
+        seen.append(shingles)
+        selected.append((el, trimmed))
+        used += extra + len(trimmed)
+        stats.chunks_out += 1
+    return selected, stats
+
+
+def pack_context(
+    results: list[Dict[str, Any]],
+    max_chars: int,
+    max_chunk_chars: int,
+    metadata_fields: list[str] | None,
+    dedup_threshold: float = 0.9,
+) -> tuple[str, PackStats]:
+    """Собирает текстовый контекст для LLM в пределах бюджета символов.
+
+    Фрагменты отбираются :func:`_select_chunks`, из метаданных остаются только
+    ``metadata_fields`` (``None`` — все поля).
+    """
+    prefix = "Context:\n\n"
+
+    def header(index: int) -> str:
+        return f"Document {index}:\nContent: "
+
+    def footer(el: Dict[str, Any]) -> str:
+        metadata = _project_metadata(el.get("metadata"), metadata_fields)
+        return f"\nMetadata: {metadata}\n\n" if metadata else "\n\n"
+
+    selected, stats = _select_chunks(
+        results,
+        max_chars - len(prefix),
+        max_chunk_chars,
+        overhead=lambda el, index: len(header(index)) + len(footer(el)),
+        dedup_threshold=dedup_threshold,
+    )
+    parts = [prefix]
+    for index, (el, trimmed) in enumerate(selected, start=1):
+        parts.extend((header(index), trimmed, footer(el)))
+    return "".join(parts), stats
+
+
+def _context_metadata_fields() -> list[str] | None:
+    raw = os.getenv("RAG_CONTEXT_METADATA_FIELDS", "source,title,url,file_name,document_name")
+    if raw.strip() == "*":
+        return None
+    return [f.strip() for f in raw.split(",") if f.strip()]
+
+
 async def postprocess_retrieve_result(retrieve_result: Dict[str, Any]) -> str:
-    result_str = "Context:\n\n"
     results = retrieve_result.get("results", [])
-    for idx, el in enumerate(results, start=1):
-        content = el.get("content", "")
-        metadata = el.get("metadata", {})
-        result_str += (
-            f"Document {idx}:\n"
-            f"Content: {content}\n"
-            f"Metadata: {metadata}\n\n"
-        )
-    return result_str
-
-async def get_access_token(env) -> str:
-    async with _access_token_lock:
-        global _access_token
+    context, stats = pack_context(
+        results,
+        max_chars=_parse_positive_int(os.getenv("RAG_CONTEXT_MAX_CHARS"), default=12000),
+        max_chunk_chars=_parse_positive_int(os.getenv("RAG_CONTEXT_MAX_CHUNK_CHARS"), default=3000),
+        metadata_fields=_context_metadata_fields(),
+    )
+    if stats.chunks_out < stats.chunks_in or stats.chunks_trimmed:
+        logger.info(f"Контекст упакован: {stats}")
+    unavailable = retrieve_result.get("unavailable_knowledge_bases")
+    if unavailable:
+        # Агент должен знать, что ответ может быть неполным
+        context = (
+            f"Note: knowledge bases {', '.join(unavailable)} did not respond, the context may be incomplete.\n\n"
+            + context
+        )
+    return context
+
+
+async def _fetch_access_token() -> tuple[str, float]:
+    """Получает новый access token в IAM. Возвращает токен и срок его жизни в секундах."""
+    try:
+        token_response = await get_http_client().post(
+            AUTH_URL,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": os.getenv("EVOLUTION_SERVICE_ACCOUNT_KEY_ID"),
+                "client_secret": os.getenv("EVOLUTION_SERVICE_ACCOUNT_KEY_SECRET"),
+            },
+            timeout=10.0,
+        )
+        token_response.raise_for_status()
+        body = token_response.json()
+        access_token = body.get("access_token")
+        if not access_token:
+            raise ValueError("Ответ аутентификации не содержит access_token")
+        expires_in = _parse_positive_float(str(body.get("expires_in", "")), default=_IAM_DEFAULT_TTL_SEC)
+        return access_token, expires_in
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(
+            f"Ошибка при получении access token. Статус: {e.response.status_code}; "
+            f"Сообщение: {e.response.text}"
+        )
+    except httpx.TimeoutException:
+        raise RuntimeError("Таймаут при получении access token.")
+    except httpx.RequestError as e:
+        raise RuntimeError(f"Сетевая ошибка аутентификации: {e}")
+    except Exception as e:
+        raise RuntimeError(f"Неожиданная ошибка аутентификации: {e}")
+
+
+class AccessTokenManager:
+    """Хранит IAM access token и обновляет его заранее, до истечения срока жизни.
+
+    Срок жизни берется из ``expires_in`` ответа IAM. Конкурентные обращения
+    разделяют одно обновление в полете (single-flight), поэтому пачка 401 приводит
+    к одному запросу в IAM. При ошибках IAM фоновое обновление повторяется с
+    экспоненциальной задержкой и джиттером, а запросы продолжают использовать
+    текущий токен, пока он не истек.
+
+    При общем хранилище (несколько воркеров) токен тоже общий: в IAM идет только
+    воркер, захвативший блокировку, остальные берут его токен из хранилища.
+    """
+
+    def __init__(
+        self,
+        refresh_margin: float = 60.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ) -> None:
+        self._refresh_margin = refresh_margin
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._inflight: asyncio.Task[str] | None = None
+        self._loop_task: asyncio.Task[None] | None = None
+        # Токен, получивший 401: не берем его повторно из общего хранилища
+        self._rejected: str | None = None
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    @property
+    def has_token(self) -> bool:
+        """Есть действующий токен: запросы к Managed RAG не будут ждать IAM."""
+        return self._is_valid()
+
+    async def _fetch(self) -> tuple[str, float]:
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                token_response = await client.post(
-                    AUTH_URL,
-                    data={
-                        "grant_type": "client_credentials",
-                        "client_id": env["EVOLUTION_SERVICE_ACCOUNT_KEY_ID"],
-                        "client_secret": env["EVOLUTION_SERVICE_ACCOUNT_KEY_ID"],
-                    },
+            with IAM_REFRESH_SECONDS.time():
+                token, expires_in = await _fetch_access_token()
+        except Exception:
+            IAM_REFRESH_FAILURES.inc()
+            raise
+        logger.info(f"IAM access token обновлен, срок жизни {expires_in:.0f}s")
+        return token, expires_in
+
+    def _adopt(self, token: str, issued_at: float, expires_at: float) -> None:
+        """Принимает токен со сроками в часах реального времени (общих для процессов)."""
+        lifetime = expires_at - issued_at
+        # Не обновляем раньше половины срока жизни даже для очень коротких токенов
+        refresh_at = issued_at + max(lifetime / 2, lifetime - self._refresh_margin)
+        offset = time.monotonic() - time.time()
+        self._token = token
+        self._expires_at = expires_at + offset
+        self._refresh_at = refresh_at + offset
+
+    async def _do_refresh(self) -> str:
+        if shared_store is not None:
+            try:
+                return await self._refresh_shared(shared_store)
+            except RuntimeError:
+                raise
+            except Exception as e:
+                logger.warning(f"Общее хранилище недоступно, токен запрашивается напрямую: {e}")
+        token, expires_in = await self._fetch()
+        now = time.time()
+        self._adopt(token, now, now + expires_in)
+        return token
+
+    async def _refresh_shared(self, store: "SharedStore") -> str:
+        """Берет свежий токен из общего хранилища или получает его в IAM под блокировкой."""
+        while True:
+            raw = await store.get(_IAM_TOKEN_KEY)
+            if raw is not None:
+                shared = json.loads(raw)
+                lifetime = shared["expires_at"] - shared["issued_at"]
+                fresh_until = shared["issued_at"] + max(lifetime / 2, lifetime - self._refresh_margin)
+                if shared["token"] != self._rejected and time.time() < fresh_until:
+                    self._adopt(shared["token"], shared["issued_at"], shared["expires_at"])
+                    return shared["token"]
+            lock = SharedLock(store, _IAM_TOKEN_LOCK_KEY)
+            if await lock.acquire():
+                try:
+                    token, expires_in = await self._fetch()
+                    now = time.time()
+                    value = {"token": token, "issued_at": now, "expires_at": now + expires_in}
+                    await store.set(_IAM_TOKEN_KEY, json.dumps(value), expires_in)
+                except RuntimeError as e:
+                    # Ошибка IAM; сбой самого хранилища ожидающим не публикуем
+                    await lock.fail(e)
+                    raise
+                finally:
+                    await lock.release()
+                self._adopt(token, now, now + expires_in)
+                return token
+            # Токен получает другой воркер: его ошибка — и наша, в IAM не идем
+            error = await lock.wait(poll=5 * _SHARED_POLL_SEC)
+            if error is not None:
+                raise RuntimeError(error)
+
+    def _start_refresh(self) -> asyncio.Task[str]:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._do_refresh())
+            # Исключение забирают ожидающие; гасим предупреждение, если их нет
+            self._inflight.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._inflight
+
+    async def refresh(self, stale_token: str | None = None) -> str:
+        """Обновляет токен, разделяя одно обновление между всеми вызывающими.
+
+        Если передан ``stale_token`` (токен, получивший 401), а текущий токен уже
+        другой, то обновление не запускается и возвращается текущий токен.
+        """
+        if stale_token is not None:
+            if self._token != stale_token and self._is_valid():
+                return self._token  # type: ignore[return-value]
+            if self._token == stale_token:
+                self._expires_at = 0.0
+            self._rejected = stale_token
+        # shield: отмена одного вызывающего не должна отменять общее обновление
+        return await asyncio.shield(self._start_refresh())
+
+    async def get_token(self) -> str:
+        """Возвращает действующий токен; ждет IAM только если токена нет или он истек."""
+        if self._is_valid():
+            if time.monotonic() >= self._refresh_at:
+                self._start_refresh()
+            return self._token  # type: ignore[return-value]
+        return await self.refresh()
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            if failures:
+                backoff = min(self._backoff_max, self._backoff_base * 2 ** (failures - 1))
+                delay = random.uniform(backoff / 2, backoff)
+            else:
+                delay = max(0.0, self._refresh_at - time.monotonic())
+            await asyncio.sleep(delay)
+            if failures == 0 and self._token is not None and time.monotonic() < self._refresh_at:
+                continue
+            try:
+                await self.refresh()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Фоновое обновление IAM access token не удалось (попытка {failures}): {e}")
+
+    def start(self) -> None:
+        """Запускает фоновое обновление; первый токен запрашивается сразу."""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._loop_task, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
+        self._loop_task = None
+        self._inflight = None
+
+
+token_manager = AccessTokenManager(
+    refresh_margin=_parse_positive_float(os.getenv("IAM_TOKEN_REFRESH_MARGIN_SEC"), default=60.0),
+    backoff_max=_parse_positive_float(os.getenv("IAM_TOKEN_BACKOFF_MAX_SEC"), default=60.0),
+)
+
+
+def normalize_query(query: str) -> str:
+    """Нормализует запрос для ключей кэша: регистр и пробелы не важны."""
+    return " ".join(query.casefold().split())
+
+
+def retrieve_cache_key(query: str, kb_id: str, kb_version: str, retrieve_limit: int) -> str:
+    return json.dumps([normalize_query(query), kb_id, kb_version, retrieve_limit], ensure_ascii=False)
+
+
+class RetrieveCache:
+    """In-process кэш ответов retrieve с TTL и LRU-вытеснением.
+
+    Размер ограничен и по числу записей, и по суммарному объему в байтах.
+    В ключ входят версия базы знаний и лимит, поэтому смена
+    ``KNOWLEDGE_BASE_VERSION_ID`` фактически инвалидирует кэш. Содержимое можно
+    сохранить в файл при остановке и прочитать при запуске.
+
+    Просроченная запись хранится еще ``stale_ttl`` секунд: ее отдает
+    ``get_stale``, когда Managed RAG недоступен.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        enabled: bool = True,
+        stale_ttl: float = 0.0,
+    ) -> None:
+        self.enabled = enabled
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        # key -> (expires_at (wall clock), size_bytes, value)
+        self._entries: OrderedDict[str, tuple[float, int, Dict[str, Any]]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Промахи локального кэша, найденные в общем хранилище воркеров
+        self.shared_hits = 0
+        # Просроченные записи, отданные вместо ответа недоступного Managed RAG
+        self.stale_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        if entry[0] <= now:
+            if entry[0] + self.stale_ttl <= now:
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def get_stale(self, key: str) -> Dict[str, Any] | None:
+        """Запись, даже просроченная, если она еще в пределах ``stale_ttl``."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] + self.stale_ttl <= time.time():
+            return None
+        self.stale_hits += 1
+        return entry[2]
+
+    def put(self, key: str, value: Dict[str, Any], expires_at: float | None = None) -> None:
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self._max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at or time.time() + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "shared_hits": self.shared_hits,
+            "stale_hits": self.stale_hits,
+        }
+
+    def dump(self, path: str) -> None:
+        """Сохраняет непросроченные записи в JSON-файл (атомарно через временный файл)."""
+        now = time.time()
+        data = [[key, exp, value] for key, (exp, _, value) in self._entries.items() if exp > now]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info(f"Кэш retrieve сохранен в {path}: {len(data)} записей")
+
+    def load(self, path: str) -> None:
+        """Загружает записи из файла, пропуская просроченные. Ошибки чтения не фатальны."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать файл кэша retrieve {path}: {e}")
+            return
+        if not isinstance(data, list):
+            logger.warning(f"Файл кэша retrieve {path} имеет неверный формат, пропускаем")
+            return
+        now = time.time()
+        skipped = 0
+        for entry in data:
+            try:
+                key, exp, value = entry
+                if not isinstance(key, str) or not isinstance(value, dict):
+                    raise TypeError(f"неверные типы записи: {type(key).__name__}, {type(value).__name__}")
+                exp = float(exp)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            if exp > now:
+                self.put(key, value, expires_at=exp)
+        if skipped:
+            logger.warning(f"В файле кэша retrieve {path} пропущено поврежденных записей: {skipped}")
+        logger.info(f"Кэш retrieve загружен из {path}: {len(self._entries)} записей")
+
+
+retrieve_cache = RetrieveCache(
+    ttl=_parse_positive_float(os.getenv("RAG_CACHE_TTL_SEC"), default=300.0),
+    max_entries=_parse_positive_int(os.getenv("RAG_CACHE_MAX_ENTRIES"), default=1024),
+    max_bytes=_parse_positive_int(os.getenv("RAG_CACHE_MAX_BYTES"), default=32 * 1024 * 1024),
+    enabled=_parse_bool(os.getenv("RAG_CACHE_ENABLED"), default=True),
+    stale_ttl=(
+        _parse_positive_float(os.getenv("RAG_CACHE_STALE_SEC"), default=3600.0)
+        if _parse_bool(os.getenv("RAG_SERVE_STALE"), default=True)
+        else 0.0
+    ),
+)
+
+
+class SingleFlight:
+    """Склеивает одновременные вызовы с одинаковым ключом в один.
+
+    Первый вызов (лидер) запускает работу отдельной задачей, остальные ждут ее
+    результата; результат или исключение получают все. Отмена одного ожидающего
+    не отменяет общую работу, пока ее ждет кто-то еще.
+    """
+
+    def __init__(self) -> None:
+        # key -> [задача, число ожидающих]
+        self._flights: dict[str, list[Any]] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        # Сколько раз ждали результат, который получал другой воркер
+        self.shared_waits = 0
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        flight = self._flights.get(key)
+        if flight is not None and flight[0] is task:
+            del self._flights[key]
+
+    async def do(self, key: str, fn: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.create_task(fn())
+            task.add_done_callback(lambda t: self._forget(key, t))
+            flight = self._flights[key] = [task, 0]
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Последний ожидающий ушел: результат больше никому не нужен. Ключ
+            # освобождаем сразу, чтобы новый вызов не присоединился к отменяемой задаче
+            if flight[1] == 1 and not task.done():
+                self._forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "shared_waits": self.shared_waits,
+        }
+
+
+retrieve_flights = SingleFlight()
+
+# Время, на которое воркер захватывает обновление токена или запрос retrieve. Пока
+# запрос идет, захват продлевается, так что это лишь срок освобождения ключа
+# упавшего воркера
+_SHARED_LOCK_TTL_SEC = 30.0
+# Как часто ожидающий воркер проверяет результат, который получает другой воркер
+_SHARED_POLL_SEC = 0.02
+_IAM_TOKEN_KEY = "iam:token"
+_IAM_TOKEN_LOCK_KEY = "iam:token:lock"
+
+
+class SharedStore(ABC):
+    """Ключ-значение с TTL, общее для процессов-воркеров сервера.
+
+    Через него воркеры делят IAM-токен, результаты retrieve и захват запросов в
+    полете. Значения — строки; ``add`` записывает ключ, только если его нет, и
+    служит межпроцессной блокировкой, а ``renew`` и ``delete_if`` продлевают и
+    снимают ее, только если значение не сменилось (см. ``SharedLock``).
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        """Значение ключа или ``None``, если его нет или срок истек."""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        """Записывает значение на ``ttl`` секунд."""
+
+    @abstractmethod
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        """Записывает значение, только если ключа нет; ``True``, если записано."""
+
+    @abstractmethod
+    async def renew(self, key: str, value: str, ttl: float) -> bool:
+        """Продлевает ключ на ``ttl``, только если его значение все еще ``value``."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Удаляет ключ."""
+
+    @abstractmethod
+    async def delete_if(self, key: str, value: str) -> bool:
+        """Удаляет ключ, только если его значение все еще ``value``."""
+
+    async def close(self) -> None:
+        pass
+
+
+class SqliteStore(SharedStore):
+    """Общее хранилище в файле SQLite (WAL) для воркеров на одном хосте.
+
+    По умолчанию файл лежит в /dev/shm, то есть фактически в общей памяти.
+    Запросы к SQLite выполняются в пуле потоков, чтобы не блокировать event loop.
+    """
+
+    # Просроченные строки удаляются раз в столько записей
+    _PRUNE_EVERY = 256
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._writes = 0
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def _set(self, key: str, value: str, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, time.time() + ttl)
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def _add(self, key: str, value: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, now))
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, now + ttl)
                 )
-                token_response.raise_for_status()
-                access_token = token_response.json().get("access_token")
-                if not access_token:
-                    raise ValueError("Ответ аутентификации не содержит access_token")
-                _access_token = access_token
-                return access_token
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def _renew(self, key: str, value: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE kv SET expires_at = ? WHERE key = ? AND value = ? AND expires_at > ?",
+                (now + ttl, key, value, now),
+            )
+        return cursor.rowcount == 1
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _delete_if(self, key: str, value: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kv WHERE key = ? AND value = ? AND expires_at > ?", (key, value, time.time())
+            )
+        return cursor.rowcount == 1
+
+    async def get(self, key: str) -> str | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._add, key, value, ttl)
+
+    async def renew(self, key: str, value: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._renew, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        return await asyncio.to_thread(self._delete_if, key, value)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisStore(SharedStore):
+    """Общее хранилище в Redis или совместимом сервере (нужен extra ``redis``).
+
+    Используются только GET, SET (PX, NX), DEL и транзакции WATCH/MULTI/EXEC
+    (без Lua), поэтому подходит и Valkey/KeyDB, и локальная заглушка; воркеры
+    могут жить на разных хостах.
+    """
+
+    def __init__(self, url: str, prefix: str = "managed-rag:") -> None:
+        try:
+            import redis.asyncio as redis
+            from redis.exceptions import WatchError
+        except ImportError:
+            raise RuntimeError("MCP_SHARED_STORE=redis требует пакет redis: pip install 'mcp-managed-rag[redis]'")
+        # RESP2: его понимают и серверы без HELLO/RESP3
+        self._redis = redis.from_url(url, decode_responses=True, protocol=2)
+        self._prefix = prefix
+        self._watch_error = WatchError
+
+    async def _update_if(self, key: str, value: str, ttl: float | None) -> bool:
+        """Продлевает (``ttl``) или удаляет (``None``) ключ, если в нем все еще ``value``."""
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self._prefix + key)
+                if await pipe.get(self._prefix + key) != value:
+                    return False
+                pipe.multi()
+                if ttl is None:
+                    pipe.delete(self._prefix + key)
+                else:
+                    pipe.set(self._prefix + key, value, px=max(1, int(ttl * 1000)))
+                await pipe.execute()
+                return True
+            except self._watch_error:
+                # Ключ изменился между GET и EXEC: он уже не наш
+                return False
+
+    async def get(self, key: str) -> str | None:
+        value = await self._redis.get(self._prefix + key)
+        # При decode_responses клиент уже отдает str; bytes — только для типов
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._redis.set(self._prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self._redis.set(self._prefix + key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    async def renew(self, key: str, value: str, ttl: float) -> bool:
+        return await self._update_if(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self._prefix + key)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        return await self._update_if(key, value, None)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class SharedLock:
+    """Межпроцессная блокировка в общем хранилище: работу делает один воркер.
+
+    В ключе лежит случайный токен владельца, и продлить или снять блокировку
+    может только он. Пока владелец работает, блокировка продлевается каждую
+    треть ``ttl``. Ошибку владелец публикует под своим токеном: ожидающие
+    воркеры получают ее из ``wait`` и не повторяют запрос сами.
+    """
+
+    def __init__(self, store: SharedStore, key: str, ttl: float = _SHARED_LOCK_TTL_SEC) -> None:
+        self._store = store
+        self._key = key
+        self._ttl = ttl
+        self._token = secrets.token_hex(16)
+        self._renew_task: asyncio.Task[None] | None = None
+
+    def _error_key(self, owner: str) -> str:
+        return f"{self._key}:error:{owner}"
+
+    async def acquire(self) -> bool:
+        if not await self._store.add(self._key, self._token, self._ttl):
+            return False
+        self._renew_task = asyncio.create_task(self._renew())
+        return True
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(self._ttl / 3)
+            try:
+                if not await self._store.renew(self._key, self._token, self._ttl):
+                    logger.warning(f"Блокировка {self._key} потеряна до завершения запроса")
+                    return
+            except Exception as e:
+                logger.warning(f"Не удалось продлить блокировку {self._key}: {e}")
+
+    async def fail(self, error: Exception) -> None:
+        """Публикует ошибку владельца для ожидающих воркеров."""
+        try:
+            await self._store.set(self._error_key(self._token), str(error), self._ttl)
+        except Exception as e:
+            logger.warning(f"Общее хранилище недоступно при публикации ошибки: {e}")
+
+    async def release(self) -> None:
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+        try:
+            await self._store.delete_if(self._key, self._token)
+        except Exception:
+            # Ключ освободится сам по истечении ttl
+            pass
+
+    async def wait(self, poll: float = _SHARED_POLL_SEC) -> str | None:
+        """Ждет, пока текущий владелец отпустит блокировку; возвращает его ошибку или None."""
+        owner = await self._store.get(self._key)
+        if owner is None:
+            return None
+        while await self._store.get(self._key) == owner:
+            await asyncio.sleep(poll)
+        return await self._store.get(self._error_key(owner))
+
+
+def _build_shared_store() -> SharedStore | None:
+    """Создает общее хранилище по MCP_SHARED_STORE (none|sqlite|redis).
+
+    По умолчанию: sqlite при нескольких воркерах, иначе без общего хранилища.
+    """
+    workers = _parse_positive_int(os.getenv("MCP_WORKERS"), default=1)
+    kind = (os.getenv("MCP_SHARED_STORE") or ("sqlite" if workers > 1 else "none")).strip().lower()
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        default_path = os.path.join(shm_dir, f"mcp-managed-rag-{mcp.settings.port}.sqlite")
+        path = os.getenv("MCP_SHARED_STORE_PATH") or default_path
+        logger.info(f"Общее хранилище воркеров: SQLite {path}")
+        return SqliteStore(path)
+    if kind == "redis":
+        url = os.getenv("MCP_SHARED_STORE_URL") or "redis://localhost:6379/0"
+        logger.info(f"Общее хранилище воркеров: Redis {url}")
+        return RedisStore(url)
+    raise ValueError(f"Неподдерживаемый MCP_SHARED_STORE: {kind!r}. Используйте none, sqlite или redis")
+
+
+def _shared_key(kind: str, key: str) -> str:
+    return f"{kind}:" + hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+async def _shared_cache_get(key: str) -> tuple[Dict[str, Any], float] | None:
+    """Ответ retrieve из общего хранилища и его срок годности (часы реального времени)."""
+    if shared_store is None:
+        return None
+    try:
+        raw = await shared_store.get(_shared_key("retrieve", key))
+    except Exception as e:
+        logger.warning(f"Общее хранилище недоступно при чтении кэша: {e}")
+        return None
+    if raw is None:
+        return None
+    entry = json.loads(raw)
+    return entry["value"], entry["expires_at"]
+
+
+async def _shared_cache_put(key: str, value: Dict[str, Any]) -> None:
+    if shared_store is None:
+        return
+    # Без кэша результат хранится ровно столько, чтобы его забрали ожидающие воркеры
+    ttl = retrieve_cache.ttl if retrieve_cache.enabled else _SHARED_LOCK_TTL_SEC
+    entry = {"value": value, "expires_at": time.time() + ttl}
+    try:
+        await shared_store.set(_shared_key("retrieve", key), json.dumps(entry, ensure_ascii=False), ttl)
+    except Exception as e:
+        logger.warning(f"Общее хранилище недоступно при записи кэша: {e}")
+
+
+async def shared_flight(key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Межпроцессный single-flight для retrieve поверх общего хранилища.
+
+    Воркер, захвативший ключ, делает запрос и кладет результат в общее хранилище;
+    остальные ждут этот результат, а при ошибке владельца получают ту же ошибку.
+    Если владелец упал, не отпустив ключ, запрос через ``_SHARED_LOCK_TTL_SEC``
+    делает следующий воркер.
+    """
+    if shared_store is None:
+        return await fn()
+    lock = SharedLock(shared_store, _shared_key("flight", key))
+    while True:
+        try:
+            acquired = await lock.acquire()
+        except Exception as e:
+            logger.warning(f"Общее хранилище недоступно, запрос без межпроцессного single-flight: {e}")
+            return await fn()
+        if acquired:
+            try:
+                result = await fn()
+                await _shared_cache_put(key, result)
+                return result
+            except Exception as e:
+                await lock.fail(e)
+                raise
+            finally:
+                await lock.release()
+        retrieve_flights.shared_waits += 1
+        # Запрос уже делает другой воркер: ждем, пока он отпустит ключ
+        error = await lock.wait()
+        if error is not None:
+            raise RuntimeError(error)
+        cached = await _shared_cache_get(key)
+        if cached is not None:
+            return cached[0]
+
+
+# Общее для воркеров хранилище; создается в startup()
+shared_store: SharedStore | None = None
+
+
+class LatencyWindow:
+    """Скользящее окно длительностей запросов к upstream для адаптивных таймаутов и хеджирования."""
+
+    def __init__(self, size: int = 256, min_samples: int = 20) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+        self._min_samples = min_samples
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        """``q``-й перцентиль окна или ``None``, пока измерений слишком мало."""
+        if len(self._samples) < self._min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class CircuitBreaker:
+    """Circuit breaker: после ``failure_threshold`` неудач подряд запросы не идут в upstream.
+
+    Через ``open_sec`` пропускается один пробный запрос (half-open): успех
+    закрывает breaker, неудача снова открывает его.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_sec: float = 30.0) -> None:
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._open_sec = open_sec
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        # Начало пробного запроса в half-open; пробу, которая не вернулась, повторяем
+        self._probe_started: float | None = None
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN and now >= self._opened_at + self._open_sec:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and (
+            self._probe_started is None or now >= self._probe_started + self._open_sec
+        ):
+            self._probe_started = now
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        """Пробный запрос завершился без результата: следующий ``allow()`` пустит новую пробу."""
+        self._probe_started = None
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probe_started = None
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_started = None
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self._failure_threshold):
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def _set_state(self, state: str) -> None:
+        log = logger.warning if state == self.OPEN else logger.info
+        log(f"Circuit breaker Managed RAG {self.name}: {self.state} -> {state}")
+        self.state = state
+
+
+class CircuitOpenError(RuntimeError):
+    """Upstream помечен недоступным, запрос не отправлялся."""
+
+
+class UpstreamHealth:
+    """Слой устойчивости одной базы знаний: задержки, таймауты, хеджирование и breaker.
+
+    Таймаут попытки — p99 окна, умноженный на ``RAG_TIMEOUT_P99_MULTIPLIER``, в
+    пределах от ``RAG_TIMEOUT_MIN_SEC`` до ``RAG_HTTP_READ_TIMEOUT_SEC``. Хедж —
+    второй такой же запрос, если первый не ответил за p95.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.latency = LatencyWindow()
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=_parse_positive_int(os.getenv("RAG_BREAKER_FAILURE_THRESHOLD"), default=5),
+            open_sec=_parse_positive_float(os.getenv("RAG_BREAKER_OPEN_SEC"), default=30.0),
+        )
+        self._max_timeout = _parse_positive_float(os.getenv("RAG_HTTP_READ_TIMEOUT_SEC"), default=20.0)
+        self._min_timeout = min(
+            self._max_timeout, _parse_positive_float(os.getenv("RAG_TIMEOUT_MIN_SEC"), default=1.0)
+        )
+        self._multiplier = _parse_positive_float(os.getenv("RAG_TIMEOUT_P99_MULTIPLIER"), default=3.0)
+        self._hedge = _parse_bool(os.getenv("RAG_HEDGE_ENABLED"), default=False)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+
+    def timeout(self) -> float:
+        p99 = self.latency.percentile(99)
+        if p99 is None:
+            return self._max_timeout
+        return min(self._max_timeout, max(self._min_timeout, p99 * self._multiplier))
+
+    def hedge_delay(self) -> float | None:
+        return self.latency.percentile(95) if self._hedge else None
+
+
+_upstream_health: dict[str, UpstreamHealth] = {}
+
+
+def upstream_health(kb_id: str) -> UpstreamHealth:
+    health = _upstream_health.get(kb_id)
+    if health is None:
+        health = _upstream_health[kb_id] = UpstreamHealth(kb_id)
+    return health
+
+
+def _retry_delay(attempt: int) -> float:
+    """Задержка перед повтором: экспоненциальная с полным джиттером."""
+    base = _parse_positive_float(os.getenv("RAG_RETRY_BACKOFF_BASE_SEC"), default=0.2)
+    cap = _parse_positive_float(os.getenv("RAG_RETRY_BACKOFF_MAX_SEC"), default=2.0)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def retrieve(
+    query: str,
+    project_id: str,
+    kb_id: str,
+    kb_version: str,
+    retrieve_limit: int,
+) -> Dict[str, Any]:
+    """Запрос к Managed RAG без кэша. Возвращает сырой JSON ответа retrieve.
+
+    Попытки ограничены адаптивным таймаутом; 5xx, таймауты и сетевые ошибки
+    повторяются до ``RAG_RETRY_ATTEMPTS`` раз с джиттером. Пока breaker базы
+    открыт, запрос сразу завершается ``CircuitOpenError``.
+    """
+    health = upstream_health(kb_id)
+    if not health.breaker.allow():
+        raise CircuitOpenError(
+            f"Не удалось получить релевантные документы. Managed RAG {kb_id} временно недоступен"
+        )
+    # Проба half-open, не давшая ни успеха, ни неудачи (отмена, ошибка токена),
+    # не должна задерживать следующую пробу на open_sec
+    probe = health.breaker.state == CircuitBreaker.HALF_OPEN
+    try:
+        payload = {
+            "project_id": project_id,
+            "query": query,
+            "retrieve_limit": retrieve_limit,
+            "rag_version": kb_version,
+        }
+
+        async def do_rag_request(access_token: str, timeout: float) -> httpx.Response:
+            started = time.monotonic()
+            status = "error"
+            try:
+                response = await asyncio.wait_for(
+                    get_http_client().post(
+                        RETRIEVE_URL_TEMPLATE.format(kb_id=kb_id),
+                        json=payload,
+                        headers={"Authorization": f"Bearer {access_token}"},
+                    ),
+                    timeout,
+                )
+                status = str(response.status_code)
+                return response
+            except asyncio.TimeoutError:
+                status = "timeout"
+                raise
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise
+            finally:
+                elapsed = time.monotonic() - started
+                RAG_HTTP_SECONDS.labels(status=status).observe(elapsed)
+                # Таймаут учитываем как нижнюю оценку задержки, чтобы окно догоняло замедление upstream
+                if status == "timeout" or (status.isdigit() and int(status) < 500):
+                    health.latency.observe(elapsed)
+
+        async def send(access_token: str) -> httpx.Response:
+            timeout = health.timeout()
+            hedge_after = health.hedge_delay()
+            if hedge_after is None or hedge_after >= timeout:
+                return await do_rag_request(access_token, timeout)
+            primary = asyncio.create_task(do_rag_request(access_token, timeout))
+            hedge: asyncio.Task[httpx.Response] | None = None
+            try:
+                done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+                if done:
+                    return primary.result()
+                # Первый запрос дольше p95: дублируем его и берем ответ, который придет раньше
+                health.hedges += 1
+                hedge = asyncio.create_task(do_rag_request(access_token, timeout))
+                pending: set[asyncio.Task[httpx.Response]] = {primary, hedge}
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    ok = [t for t in done if t.exception() is None and t.result().status_code < 500]
+                    if ok:
+                        if ok[0] is hedge:
+                            health.hedge_wins += 1
+                        return ok[0].result()
+                return primary.result()
+            finally:
+                for task in (primary, hedge):
+                    if task is not None and not task.done():
+                        task.cancel()
+
+        attempts = _parse_positive_int(os.getenv("RAG_RETRY_ATTEMPTS"), default=3)
+        # 1. Взять текущий токен (фоновое обновление держит его актуальным)
+        access_token = await token_manager.get_token()
+
+        try:
+            for attempt in range(1, attempts + 1):
+                try:
+                    response = await send(access_token)
+                    if response.status_code == 401:
+                        # Токен отозван или неверен: одно общее обновление на всех и повтор
+                        access_token = await token_manager.refresh(stale_token=access_token)
+                        response = await send(access_token)
+                        if response.status_code == 401:
+                            # Второй 401 подряд = реальные проблемы.
+                            raise RuntimeError(
+                                "Аутентификация не удалась: повторный 401 при запросе к базе знаний."
+                            )
+                    if response.status_code < 500 or attempt == attempts:
+                        break
+                    reason = str(response.status_code)
+                except (asyncio.TimeoutError, httpx.TransportError) as e:
+                    if attempt == attempts:
+                        raise
+                    reason = "network" if isinstance(e, httpx.NetworkError) else "timeout"
+                health.retries += 1
+                logger.info(f"Повтор запроса к Managed RAG {kb_id} ({reason}), попытка {attempt + 1} из {attempts}")
+                await asyncio.sleep(_retry_delay(attempt))
+
+            if response.status_code >= 500:
+                health.breaker.record_failure()
+            else:
+                health.breaker.record_success()
+            response.raise_for_status()
+            return response.json()
         except httpx.HTTPStatusError as e:
+            status = e.response.status_code if e.response is not None else "unknown"
+            message = e.response.text if e.response is not None else "no message"
             raise RuntimeError(
-                f"Ошибка при получении access token. Статус: {e.response.status_code}; "
-                f"Сообщение: {e.response.text}"
+                f"Не удалось получить релевантные документы. Статус: {status}; Сообщение: {message}"
+            )
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            health.breaker.record_failure()
+            raise RuntimeError(
+                "Не удалось получить релевантные документы. Таймаут запроса к Managed RAG"
             )
-        except httpx.TimeoutException:
-            raise RuntimeError("Таймаут при получении access token.")
         except httpx.RequestError as e:
-            raise RuntimeError(f"Сетевая ошибка аутентификации: {e}")
+            health.breaker.record_failure()
+            raise RuntimeError(
+                f"Не удалось получить релевантные документы. Сетевая ошибка при запросе к Managed RAG: {e}"
+            )
         except Exception as e:
-            raise RuntimeError(f"Неожиданная ошибка аутентификации: {e}")
+            # Непредвиденная ошибка
+            raise RuntimeError(
+                f"Не удалось получить релевантные документы. Неожиданная ошибка при запросе к Managed RAG: {e}"
+            )
+    finally:
+        if probe and health.breaker.state == CircuitBreaker.HALF_OPEN:
+            health.breaker.release_probe()
+
+
+async def cached_retrieve(
+    query: str,
+    project_id: str,
+    kb_id: str,
+    kb_version: str,
+    retrieve_limit: int,
+) -> Dict[str, Any]:
+    """Retrieve через кэш результатов: при попадании запрос в Managed RAG не делается.
+
+    Одновременные промахи с одинаковым ключом разделяют один запрос к Managed RAG,
+    а при общем хранилище — и между воркерами. Если Managed RAG недоступен,
+    отдается просроченная запись кэша, пока она не старше ``RAG_CACHE_STALE_SEC``.
+    """
+    key = retrieve_cache_key(query, kb_id, kb_version, retrieve_limit)
+    if retrieve_cache.enabled:
+        cached = retrieve_cache.get(key)
+        if cached is not None:
+            return cached
+        shared = await _shared_cache_get(key)
+        if shared is not None:
+            # Локальная копия живет не дольше записи в общем хранилище
+            cached, expires_at = shared
+            retrieve_cache.shared_hits += 1
+            retrieve_cache.put(key, cached, expires_at=expires_at)
+            return cached
+
+    async def fetch_and_store() -> Dict[str, Any]:
+        result = await shared_flight(
+            key, lambda: retrieve(query, project_id, kb_id, kb_version, retrieve_limit)
+        )
+        if retrieve_cache.enabled:
+            retrieve_cache.put(key, result)
+        return result
+
+    try:
+        return await retrieve_flights.do(key, fetch_and_store)
+    except RuntimeError as e:
+        # Managed RAG недоступен: устаревший ответ лучше, чем никакого
+        stale = retrieve_cache.get_stale(key) if retrieve_cache.enabled else None
+        if stale is None:
+            raise
+        logger.warning(f"Managed RAG {kb_id} недоступен, отдаем устаревшую запись кэша: {e}")
+        return stale
+
+
+def _content_key(doc: Dict[str, Any]) -> str:
+    """Хэш нормализованного содержимого документа."""
+    content = " ".join(str(doc.get("content", "")).split())
+    return "sha1:" + hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def _document_key(doc: Dict[str, Any]) -> str:
+    """Ключ документа для дедупликации: id, если есть, иначе хэш нормализованного содержимого."""
+    doc_id = doc.get("id") or (doc.get("metadata") or {}).get("id")
+    if doc_id:
+        return f"id:{doc_id}"
+    return _content_key(doc)
+
+
+def fuse_ranked_results(
+    result_sets: list[list[Dict[str, Any]]],
+    k: int = 60,
+    key: Callable[[Dict[str, Any]], str] = _document_key,
+) -> list[Dict[str, Any]]:
+    """Объединяет ранжированные списки документов reciprocal-rank fusion с дедупликацией.
+
+    Документ, найденный несколькими запросами, получает сумму 1 / (k + rank) и
+    поднимается выше; в выдаче остается одна его копия. Одинаковыми считаются
+    документы с одинаковым ``key``.
+    """
+    scores: dict[str, float] = {}
+    docs: dict[str, Dict[str, Any]] = {}
+    for results in result_sets:
+        for rank, doc in enumerate(results, start=1):
+            key_ = key(doc)
+            scores[key_] = scores.get(key_, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key_, doc)
+    return [docs[key_] for key_ in sorted(scores, key=scores.__getitem__, reverse=True)]
+
+
+@dataclass(frozen=True)
+class KnowledgeBase:
+    kb_id: str
+    version: str
+
+
+def _knowledge_bases() -> list[KnowledgeBase]:
+    """Базы знаний сервера: ``KNOWLEDGE_BASES`` или пара KNOWLEDGE_BASE_ID / KNOWLEDGE_BASE_VERSION_ID."""
+    raw = os.getenv("KNOWLEDGE_BASES", "").strip()
+    if not raw:
+        env = _require_env_vars(["KNOWLEDGE_BASE_ID", "KNOWLEDGE_BASE_VERSION_ID"])
+        return [KnowledgeBase(env["KNOWLEDGE_BASE_ID"], env["KNOWLEDGE_BASE_VERSION_ID"])]
+    kbs: list[KnowledgeBase] = []
+    for item in raw.replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        kb_id, sep, version = item.partition(":")
+        if not sep or not kb_id.strip() or not version.strip():
+            raise ValueError(f"KNOWLEDGE_BASES: ожидается kb_id:version_id, получено {item!r}")
+        kb = KnowledgeBase(kb_id.strip(), version.strip())
+        if kb not in kbs:
+            kbs.append(kb)
+    return kbs
+
+
+async def retrieve_from_knowledge_bases(
+    query: str,
+    project_id: str,
+    knowledge_bases: list[KnowledgeBase],
+    retrieve_limit: int,
+) -> Dict[str, Any]:
+    """Retrieve из нескольких баз знаний параллельно с отдельным таймаутом на каждую.
+
+    Выдачи объединяются reciprocal-rank fusion, дубли между базами отбрасываются
+    по хэшу содержимого. Если часть баз не ответила, возвращаются результаты
+    остальных, а недоступные базы перечисляются в ``unavailable_knowledge_bases``;
+    ошибка — только когда не ответила ни одна.
+    """
+    if len(knowledge_bases) == 1:
+        kb = knowledge_bases[0]
+        return await cached_retrieve(query, project_id, kb.kb_id, kb.version, retrieve_limit)
+
+    timeout = _parse_positive_float(os.getenv("RAG_KB_TIMEOUT_SEC"), default=10.0)
+
+    async def one(kb: KnowledgeBase) -> Dict[str, Any]:
+        return await asyncio.wait_for(
+            cached_retrieve(query, project_id, kb.kb_id, kb.version, retrieve_limit), timeout
+        )
+
+    outcomes = await asyncio.gather(*(one(kb) for kb in knowledge_bases), return_exceptions=True)
+    result_sets: list[list[Dict[str, Any]]] = []
+    unavailable: list[str] = []
+    errors: list[BaseException] = []
+    for kb, outcome in zip(knowledge_bases, outcomes):
+        if isinstance(outcome, BaseException):
+            reason = "timeout" if isinstance(outcome, asyncio.TimeoutError) else "error"
+            RAG_KB_FAILURES.labels(kb_id=kb.kb_id, reason=reason).inc()
+            logger.warning(
+                f"База знаний {kb.kb_id} не ответила ({reason}): {str(outcome) or f'дольше {timeout:.1f}s'}"
+            )
+            unavailable.append(kb.kb_id)
+            errors.append(outcome)
+        else:
+            result_sets.append(outcome.get("results", []))
+    if not result_sets:
+        raise RuntimeError(f"Ни одна база знаний не ответила: {str(errors[0]) or 'таймаут'}")
+
+    merged = fuse_ranked_results(result_sets, key=_content_key)
+    max_docs = _parse_positive_int(os.getenv("RAG_MULTI_KB_MAX_DOCUMENTS"), default=2 * retrieve_limit)
+    result: Dict[str, Any] = {"results": merged[:max_docs]}
+    if unavailable:
+        result["unavailable_knowledge_bases"] = unavailable
+    return result
 
 
 @mcp.tool()
-async def request_to_rag(query: str) -> str:
+async def request_to_rag(query: str, request_id: str | None = None) -> str:
     """
     Инструмент обращается к API Базы Знаний и получает релевантные документы по запросу пользователя.
     На выходе выдает релевантные документы, которые нужно использовать для ответа на вопрос пользователя.
     Args:
         query: str - Запрос пользователя.
+        request_id: str | None - ID запроса клиента для сквозной трассировки логов.
     Returns:
         Отформатированная строка с релевантными документами из базы знаний.
     Raises:
@@ -102,79 +1622,464 @@ async def request_to_rag(query: str) -> str:
         RuntimeError: Серверная ошибка.
     """
 
-    env = _require_env_vars([
-        "EVOLUTION_PROJECT_ID",
-        "KNOWLEDGE_BASE_ID",
-        "KNOWLEDGE_BASE_VERSION_ID",
-    ])
+    env = _require_env_vars(["EVOLUTION_PROJECT_ID"])
+    knowledge_bases = _knowledge_bases()
+
+    retrieve_limit = _parse_retrieve_limit(os.getenv("RETRIEVE_LIMIT"), default=6)
+
+    started = time.monotonic()
+    with TOOLS_IN_FLIGHT.labels(tool="request_to_rag").track_inprogress():
+        try:
+            retrieve_result = await retrieve_from_knowledge_bases(
+                query,
+                project_id=env["EVOLUTION_PROJECT_ID"],
+                knowledge_bases=knowledge_bases,
+                retrieve_limit=retrieve_limit,
+            )
+            postprocessed_retrieve_result = await postprocess_retrieve_result(retrieve_result)
+        finally:
+            elapsed = time.monotonic() - started
+            TOOL_SECONDS.labels(tool="request_to_rag").observe(elapsed)
+            logger.info(f"request_to_rag request_id={request_id} query={query!r} took {elapsed * 1000:.0f} ms")
+    return postprocessed_retrieve_result
+
+
+@mcp.tool()
+async def request_to_rag_batch(queries: list[str], request_id: str | None = None) -> str:
+    """
+    Инструмент выполняет несколько поисковых запросов к Базе Знаний за один вызов.
+    Используй его, когда для ответа нужно посмотреть вопрос с нескольких сторон:
+    запросы выполняются параллельно, найденные документы объединяются без дублей
+    и ранжируются вместе.
+    Args:
+        queries: list[str] - Список поисковых запросов.
+        request_id: str | None - ID запроса клиента для сквозной трассировки логов.
+    Returns:
+        Отформатированная строка с объединенными релевантными документами из базы знаний.
+    Raises:
+        ValueError: Ошибки связанные с некорректными параметрами.
+        RuntimeError: Серверная ошибка.
+    """
+
+    env = _require_env_vars(["EVOLUTION_PROJECT_ID"])
+    knowledge_bases = _knowledge_bases()
 
-    env["EVOLUTION_SERVICE_ACCOUNT_KEY_ID"] = os.getenv("EVOLUTION_SERVICE_ACCOUNT_KEY_ID")
-    env["EVOLUTION_SERVICE_ACCOUNT_KEY_ID"] = os.getenv("EVOLUTION_SERVICE_ACCOUNT_KEY_ID")
+    # Одинаковые после нормализации запросы выполняем один раз
+    unique_queries = list({normalize_query(q): q for q in queries if q and q.strip()}.values())
+    if not unique_queries:
+        raise ValueError("Список запросов пуст.")
+    max_queries = _parse_positive_int(os.getenv("RAG_BATCH_MAX_QUERIES"), default=8)
+    if len(unique_queries) > max_queries:
+        raise ValueError(f"Слишком много запросов: {len(unique_queries)}, максимум {max_queries}.")
 
     retrieve_limit = _parse_retrieve_limit(os.getenv("RETRIEVE_LIMIT"), default=6)
+    semaphore = asyncio.Semaphore(_parse_positive_int(os.getenv("RAG_BATCH_CONCURRENCY"), default=4))
 
-    global _access_token
-
-    async def do_rag_request(access_token: str):
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            payload = {
-                "project_id": env["EVOLUTION_PROJECT_ID"],
-                "query": query,
-                "retrieve_limit": retrieve_limit,
-                "rag_version": env["KNOWLEDGE_BASE_VERSION_ID"],
-            }
-            return await client.post(
-                RETRIEVE_URL_TEMPLATE.format(kb_id=env["KNOWLEDGE_BASE_ID"]),
-                json=payload,
-                headers={"Authorization": f"Bearer {access_token}"},
+    async def one(query: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await retrieve_from_knowledge_bases(
+                query,
+                project_id=env["EVOLUTION_PROJECT_ID"],
+                knowledge_bases=knowledge_bases,
+                retrieve_limit=retrieve_limit,
             )
 
-    # 1. Попробовать с текущим токеном или получить новый если токена нет
-    if _access_token is None:
-        await get_access_token(env)
+    started = time.monotonic()
+    with TOOLS_IN_FLIGHT.labels(tool="request_to_rag_batch").track_inprogress():
+        outcomes = await asyncio.gather(*(one(q) for q in unique_queries), return_exceptions=True)
+    elapsed = time.monotonic() - started
+    TOOL_SECONDS.labels(tool="request_to_rag_batch").observe(elapsed)
+    logger.info(
+        f"request_to_rag_batch request_id={request_id} queries={len(unique_queries)} took {elapsed * 1000:.0f} ms"
+    )
+    result_sets: list[list[Dict[str, Any]]] = []
+    errors: list[BaseException] = []
+    unavailable: list[str] = []
+    for query, outcome in zip(unique_queries, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.warning(f"Запрос {query!r} из пакета завершился ошибкой: {outcome}")
+            errors.append(outcome)
+        else:
+            result_sets.append(outcome.get("results", []))
+            unavailable.extend(kb for kb in outcome.get("unavailable_knowledge_bases", ()) if kb not in unavailable)
+    if not result_sets:
+        raise errors[0]
 
-    try:
-        response = await do_rag_request(_access_token)
-        if response.status_code == 401:
-            # Токен истёк или неверен, пробуем обновить токен и повторить попытку
-            await get_access_token(env)  # обновит _access_token
-            response = await do_rag_request(_access_token)
-            if response.status_code == 401:
-                # Второй 401 подряд = реальные проблемы.
-                raise RuntimeError(
-                    "Аутентификация не удалась: повторный 401 при запросе к базе знаний."
-                )
-        response.raise_for_status()
-        retrieve_result = response.json()
-    except httpx.HTTPStatusError as e:
-        status = e.response.status_code if e.response is not None else "unknown"
-        message = e.response.text if e.response is not None else "no message"
-        raise RuntimeError(
-            f"Не удалось получить релевантные документы. Статус: {status}; Сообщение: {message}"
+    # Выдачи разных баз уже без общих id: дубли ищем по содержимому
+    merged = fuse_ranked_results(result_sets, key=_content_key if len(knowledge_bases) > 1 else _document_key)
+    # Общий контекст не должен разрастаться пропорционально числу запросов
+    max_docs = _parse_positive_int(os.getenv("RAG_BATCH_MAX_DOCUMENTS"), default=2 * retrieve_limit)
+    result: Dict[str, Any] = {"results": merged[:max_docs]}
+    if unavailable:
+        result["unavailable_knowledge_bases"] = unavailable
+    return await postprocess_retrieve_result(result)
+
+
+# Поля записи документа; остальные имена в ``fields`` — ключи метаданных
+_DOCUMENT_FIELDS = ("id", "score", "content")
+
+# Схема structuredContent инструмента retrieve_documents
+_DOCUMENTS_OUTPUT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "documents": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "score": {"type": "number"},
+                    "content": {"type": "string"},
+                    "metadata": {"type": "object"},
+                },
+            },
+        },
+        "unavailable_knowledge_bases": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["documents"],
+}
+
+
+def _document_id(doc: Dict[str, Any]) -> str:
+    """ID документа из ответа retrieve, а если его нет — короткий хэш содержимого."""
+    doc_id = doc.get("id") or (doc.get("metadata") or {}).get("id")
+    if doc_id:
+        return str(doc_id)
+    return _content_key(doc).removeprefix("sha1:")[:16]
+
+
+def document_records(
+    results: list[Dict[str, Any]],
+    fields: list[str] | None,
+    max_chars: int,
+    max_chunk_chars: int,
+) -> tuple[list[Dict[str, Any]], PackStats]:
+    """Записи документов для структурированного ответа: только запрошенные поля.
+
+    ``fields=None`` — id, score, content и метаданные из RAG_CONTEXT_METADATA_FIELDS.
+    Содержимое отбирается и обрезается так же, как для текстового контекста.
+    """
+    if fields is None:
+        record_fields = list(_DOCUMENT_FIELDS)
+        metadata_fields = _context_metadata_fields()
+    else:
+        record_fields = [f for f in _DOCUMENT_FIELDS if f in fields]
+        metadata_fields = [f for f in fields if f not in _DOCUMENT_FIELDS]
+    if "content" in record_fields:
+        selected, stats = _select_chunks(results, max_chars, max_chunk_chars, overhead=lambda el, index: 0)
+    else:
+        selected, stats = [(el, "") for el in results], PackStats(chunks_in=len(results), chunks_out=len(results))
+
+    records: list[Dict[str, Any]] = []
+    for el, content in selected:
+        record: Dict[str, Any] = {}
+        if "id" in record_fields:
+            record["id"] = _document_id(el)
+        if "score" in record_fields and el.get("score") is not None:
+            record["score"] = el["score"]
+        if "content" in record_fields:
+            record["content"] = content
+        metadata = el.get("metadata")
+        if isinstance(metadata, dict) and (metadata_fields is None or metadata_fields):
+            projected = (
+                dict(metadata) if metadata_fields is None else {f: metadata[f] for f in metadata_fields if metadata.get(f)}
+            )
+            if projected:
+                record["metadata"] = projected
+        records.append(record)
+    return records, stats
+
+
+@mcp.tool(output_schema=_DOCUMENTS_OUTPUT_SCHEMA)
+async def retrieve_documents(
+    query: str,
+    fields: list[str] | None = None,
+    min_score: float | None = None,
+    limit: int | None = None,
+    request_id: str | None = None,
+) -> Dict[str, Any]:
+    """
+    Инструмент ищет в Базе Знаний документы по запросу и возвращает их структурированно,
+    для программной обработки клиентом (цитирование, список источников, своя верстка контекста).
+    Args:
+        query: str - Поисковый запрос.
+        fields: list[str] | None - Какие поля вернуть: id, score, content и любые ключи метаданных
+            (например source, title, url). По умолчанию id, score, content и основные метаданные.
+        min_score: float | None - Отбросить документы с меньшей релевантностью.
+        limit: int | None - Максимум документов, не больше RETRIEVE_LIMIT: из базы запрашивается
+            RETRIEVE_LIMIT документов, и большее значение урезается до него (по умолчанию RETRIEVE_LIMIT).
+        request_id: str | None - ID запроса клиента для сквозной трассировки логов.
+    Returns:
+        structuredContent по схеме _DOCUMENTS_OUTPUT_SCHEMA:
+        {"documents": [{"id", "score", "content", "metadata"}], "unavailable_knowledge_bases": [...]};
+        тот же объект компактным JSON дублируется в текстовом блоке для клиентов без structuredContent.
+        Отсутствующие или невыбранные поля в записях опускаются.
+    Raises:
+        ValueError: Ошибки связанные с некорректными параметрами.
+        RuntimeError: Серверная ошибка.
+    """
+
+    env = _require_env_vars(["EVOLUTION_PROJECT_ID"])
+    knowledge_bases = _knowledge_bases()
+    retrieve_limit = _parse_retrieve_limit(os.getenv("RETRIEVE_LIMIT"), default=6)
+    if limit is not None and limit <= 0:
+        raise ValueError("limit должен быть положительным.")
+    if limit is not None and limit > retrieve_limit:
+        logger.info(f"retrieve_documents request_id={request_id}: limit={limit} урезан до RETRIEVE_LIMIT={retrieve_limit}")
+        limit = retrieve_limit
+
+    started = time.monotonic()
+    with TOOLS_IN_FLIGHT.labels(tool="retrieve_documents").track_inprogress():
+        try:
+            retrieve_result = await retrieve_from_knowledge_bases(
+                query,
+                project_id=env["EVOLUTION_PROJECT_ID"],
+                knowledge_bases=knowledge_bases,
+                retrieve_limit=retrieve_limit,
+            )
+        finally:
+            elapsed = time.monotonic() - started
+            TOOL_SECONDS.labels(tool="retrieve_documents").observe(elapsed)
+            logger.info(f"retrieve_documents request_id={request_id} query={query!r} took {elapsed * 1000:.0f} ms")
+
+    results = retrieve_result.get("results", [])
+    if min_score is not None:
+        results = [doc for doc in results if isinstance(doc.get("score"), (int, float)) and doc["score"] >= min_score]
+    records, stats = document_records(
+        results[: limit or len(results)],
+        fields=fields,
+        max_chars=_parse_positive_int(os.getenv("RAG_CONTEXT_MAX_CHARS"), default=12000),
+        max_chunk_chars=_parse_positive_int(os.getenv("RAG_CONTEXT_MAX_CHUNK_CHARS"), default=3000),
+    )
+    if stats.chunks_out < stats.chunks_in or stats.chunks_trimmed:
+        logger.info(f"Документы упакованы: {stats}")
+    response: Dict[str, Any] = {"documents": records}
+    if retrieve_result.get("unavailable_knowledge_bases"):
+        response["unavailable_knowledge_bases"] = retrieve_result["unavailable_knowledge_bases"]
+    return response
+
+
+@mcp.tool()
+async def knowledge_base_versions() -> str:
+    """
+    Инструмент возвращает базы знаний и их версии, из которых сервер отвечает.
+    Клиенты включают их в ключи своих кэшей, чтобы смена версии базы сбрасывала кэш.
+    Returns:
+        JSON: {"knowledge_bases": [{"id", "version"}]} в порядке опроса баз.
+    Raises:
+        ValueError: Базы знаний не настроены.
+    """
+
+    knowledge_bases = [{"id": kb.kb_id, "version": kb.version} for kb in _knowledge_bases()]
+    return json.dumps({"knowledge_bases": knowledge_bases}, ensure_ascii=False, separators=(",", ":"))
+
+
+class _StatsCollector:
+    """Отдает в /metrics счетчики кэша, single-flight, слоя устойчивости и пула соединений на момент опроса."""
+
+    def collect(self):
+        cache = retrieve_cache.stats()
+        for name in ("hits", "misses", "evictions", "expirations", "shared_hits", "stale_hits"):
+            yield CounterMetricFamily(f"rag_cache_{name}", f"Кэш retrieve: {name}", value=cache[name])
+        yield GaugeMetricFamily("rag_cache_entries", "Записей в кэше retrieve", value=cache["entries"])
+        yield GaugeMetricFamily("rag_cache_bytes", "Объем кэша retrieve в байтах", value=cache["bytes"])
+        flights = retrieve_flights.stats()
+        yield CounterMetricFamily("rag_singleflight_leaders", "Запросы retrieve, ушедшие в Managed RAG", value=flights["leaders"])
+        yield CounterMetricFamily("rag_singleflight_coalesced", "Запросы retrieve, склеенные с уже идущим", value=flights["coalesced"])
+        yield CounterMetricFamily(
+            "rag_singleflight_shared_waits", "Запросы retrieve, дождавшиеся результата другого воркера", value=flights["shared_waits"]
         )
-    except httpx.TimeoutException:
-        raise RuntimeError(
-            "Не удалось получить релевантные документы. Таймаут запроса к Managed RAG"
+        breaker_state = GaugeMetricFamily(
+            "rag_breaker_state", "Circuit breaker базы знаний: 0 closed, 1 half-open, 2 open", labels=["kb_id"]
         )
-    except httpx.RequestError as e:
-        raise RuntimeError(
-            f"Не удалось получить релевантные документы. Сетевая ошибка при запросе к Managed RAG: {e}"
+        timeout = GaugeMetricFamily("rag_adaptive_timeout_seconds", "Текущий таймаут попытки retrieve", labels=["kb_id"])
+        hedges = CounterMetricFamily("rag_hedges", "Отправленные хедж-запросы retrieve", labels=["kb_id"])
+        hedge_wins = CounterMetricFamily("rag_hedge_wins", "Хедж-запросы, ответившие раньше исходных", labels=["kb_id"])
+        hedge_win_ratio = GaugeMetricFamily("rag_hedge_win_ratio", "Доля выигравших хедж-запросов", labels=["kb_id"])
+        retries = CounterMetricFamily("rag_retries", "Повторы запросов retrieve после 5xx и таймаутов", labels=["kb_id"])
+        for kb_id, health in list(_upstream_health.items()):
+            state = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN).index(health.breaker.state)
+            breaker_state.add_metric([kb_id], state)
+            timeout.add_metric([kb_id], health.timeout())
+            hedges.add_metric([kb_id], health.hedges)
+            hedge_wins.add_metric([kb_id], health.hedge_wins)
+            hedge_win_ratio.add_metric([kb_id], health.hedge_wins / health.hedges if health.hedges else 0.0)
+            retries.add_metric([kb_id], health.retries)
+        yield from (breaker_state, timeout, hedges, hedge_wins, hedge_win_ratio, retries)
+        pool = http_pool_stats()
+        yield GaugeMetricFamily("rag_http_pool_connections", "Соединений в HTTP-пуле", value=pool["connections"])
+        yield GaugeMetricFamily("rag_http_pool_idle_connections", "Простаивающих соединений в HTTP-пуле", value=pool["idle"])
+        yield GaugeMetricFamily("rag_http_pool_queued_requests", "Запросов, ждущих соединение", value=pool["queued_requests"])
+
+
+REGISTRY.register(_StatsCollector())
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@mcp.custom_route("/readyz", methods=["GET"])
+async def readyz(request: Request) -> Response:
+    """Проба готовности: 200 после прогрева, 503 во время прогрева, без IAM-токена и при остановке."""
+    status = readiness()
+    return JSONResponse({"ready": status == "ready", "status": status}, status_code=200 if status == "ready" else 503)
+
+
+def _server_transport() -> Literal["sse", "streamable-http"]:
+    transport = os.getenv("MCP_TRANSPORT", "sse").strip().lower()
+    if transport == "sse":
+        return "sse"
+    if transport == "streamable-http":
+        return "streamable-http"
+    raise ValueError(f"Неподдерживаемый MCP_TRANSPORT: {transport!r}. Используйте sse или streamable-http")
+
+
+async def _serve_http(sockets: list[socket.socket] | None = None, **config: Any) -> None:
+    """Обслуживает MCP-приложение в uvicorn до сигнала остановки.
+
+    По первому SIGINT/SIGTERM /readyz сразу переходит в ``draining``, а запросы
+    принимаются еще ``MCP_DRAIN_DELAY_SEC`` секунд, чтобы балансировщик успел
+    увидеть 503; повторный сигнал останавливает сервер без задержки.
+    """
+    import uvicorn
+
+    drain_delay = _parse_positive_float(os.getenv("MCP_DRAIN_DELAY_SEC"), default=0.0)
+
+    class DrainingServer(uvicorn.Server):
+        def handle_exit(self, sig: int, frame: Any) -> None:
+            global _draining
+            if _draining or not drain_delay:
+                _draining = True
+                super().handle_exit(sig, frame)
+                return
+            _draining = True
+            logger.info(f"Остановка: /readyz отвечает 503, прием запросов еще {drain_delay:.1f}s")
+            asyncio.get_running_loop().call_later(drain_delay, super().handle_exit, sig, frame)
+
+    app = mcp.http_app(
+        transport=_server_transport(), stateless_http=_STATELESS_HTTP, json_response=_JSON_RESPONSE
+    )
+    server = DrainingServer(uvicorn.Config(app, lifespan="on", **config))
+    # uvicorn после остановки повторно поднимает пойманный сигнал; без своего
+    # обработчика процесс завершился бы до shutdown() и сохранения кэша
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: setattr(server, "should_exit", True))
+    await server.serve(sockets=sockets)
+
+
+async def main() -> None:
+    await startup()
+    try:
+        # Запуск сервера с выбранным транспортом (SSE по умолчанию)
+        await _serve_http(
+            host=mcp.settings.host,
+            port=mcp.settings.port,
+            timeout_graceful_shutdown=10,
+            log_level=mcp.settings.log_level.lower(),
         )
-    except Exception as e:
-        # Непредвиденная ошибка
-        raise RuntimeError(
-            f"Не удалось получить релевантные документы. Неожиданная ошибка при запросе к Managed RAG: {e}"
+    finally:
+        await shutdown()
+
+
+def _reuse_port_socket(host: str, port: int) -> socket.socket:
+    """Слушающий сокет с SO_REUSEPORT: ядро распределяет соединения между воркерами."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+async def serve_worker(index: int) -> None:
+    """Один воркер: свой event loop и HTTP-клиент, общий порт и общее хранилище."""
+    await startup(persist_cache=index == 0)
+    try:
+        logger.info(f"Воркер {index} (pid {os.getpid()}) запущен")
+        await _serve_http(
+            sockets=[_reuse_port_socket(mcp.settings.host, mcp.settings.port)],
+            timeout_graceful_shutdown=10,
+            log_level="warning",
         )
+    finally:
+        await shutdown()
+        logger.info(f"Воркер {index} остановлен")
 
-    postprocessed_retrieve_result = await postprocess_retrieve_result(retrieve_result)
-    return postprocessed_retrieve_result
+
+def _worker_main(index: int) -> None:
+    asyncio.run(serve_worker(index))
+
+
+def run_workers(count: int) -> None:
+    """Запускает ``count`` процессов-воркеров на одном порту и перезапускает упавшие.
+
+    Соединения распределяет ядро (SO_REUSEPORT), поэтому сессия не привязана к
+    воркеру — нужен stateless streamable HTTP. IAM-токен, кэш retrieve и запросы
+    в полете воркеры делят через общее хранилище (MCP_SHARED_STORE).
+    """
+    if _server_transport() != "streamable-http" or not _STATELESS_HTTP:
+        raise ValueError("MCP_WORKERS > 1 требует MCP_TRANSPORT=streamable-http и MCP_STATELESS_HTTP=true")
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise ValueError("MCP_WORKERS > 1 требует SO_REUSEPORT (Linux, macOS)")
+
+    ctx = multiprocessing.get_context("spawn")
+    processes: list[multiprocessing.process.BaseProcess | None] = [None] * count
+    stopping = False
+
+    def spawn(index: int) -> None:
+        process = ctx.Process(target=_worker_main, args=(index,), name=f"mcp-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(count):
+        spawn(index)
+    logger.info(f"Запущено воркеров: {count}")
+
+    while not stopping:
+        time.sleep(1)
+        for index, process in enumerate(processes):
+            if not stopping and process is not None and not process.is_alive():
+                logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапускаем")
+                spawn(index)
+
+    logger.info("Останавливаем воркеры...")
+    for process in processes:
+        if process is not None and process.is_alive():
+            process.terminate()
+    for index, process in enumerate(processes):
+        if process is None:
+            continue
+        process.join(timeout=20)
+        if process.is_alive():
+            logger.warning(f"Воркер {index} не остановился за 20s, завершаем принудительно")
+            process.kill()
 
 
 if __name__ == "__main__":
+    transport = _server_transport()
     logger.info("🌐 Запуск MCP Evolution Managed RAG Server...")
     logger.info(f"🚀 Сервер будет доступен на http://{mcp.settings.host}:{mcp.settings.port}")
-    logger.info(f"📡 SSE endpoint: http://{mcp.settings.host}:{mcp.settings.port}/sse")
+    if transport == "sse":
+        logger.info(f"📡 SSE endpoint: http://{mcp.settings.host}:{mcp.settings.port}{mcp.settings.sse_path}")
+    else:
+        logger.info(
+            f"📡 Streamable HTTP endpoint: http://{mcp.settings.host}:{mcp.settings.port}{mcp.settings.streamable_http_path}"
+            f" (stateless={_STATELESS_HTTP})"
+        )
     logger.info("✋ Для остановки нажмите Ctrl+C")
-    
-    # Запуск сервера с SSE транспортом
-    mcp.run(transport="sse")
\ No newline at end of file
+
+    workers = _parse_positive_int(os.getenv("MCP_WORKERS"), default=1)
+    if workers > 1:
+        run_workers(workers)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,40 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import AccessTokenManager, RetrieveCache, SqliteStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Manual clock for the server module; the event loop keeps the real one."""
+    fake = SimpleNamespace(now=1000.0)
+    wall_offset = time.time() - fake.now
+    monkeypatch.setattr(
+        server,
+        "time",
+        SimpleNamespace(
+            monotonic=lambda: fake.now, time=lambda: fake.now + wall_offset, perf_counter=time.perf_counter
+        ),
+    )
+    return fake
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    """Shared worker store in a temporary SQLite file, with an empty retrieve cache."""
+    store = SqliteStore(str(tmp_path / "shared.sqlite"))
+    monkeypatch.setattr(server, "shared_store", store)
+    monkeypatch.setattr(server, "retrieve_cache", RetrieveCache(ttl=300))
+    yield store
+
+
+@pytest.fixture
+async def token_manager(monkeypatch):
+    """Fresh IAM token manager in place of the module one, stopped after the test."""
+    manager = AccessTokenManager(refresh_margin=60, backoff_base=0.01, backoff_max=0.04)
+    monkeypatch.setattr(server, "token_manager", manager)
+    yield manager
+    await manager.stop()
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import server
+from server import CircuitBreaker, CircuitOpenError, LatencyWindow, UpstreamHealth
+
+
+def test_latency_window_needs_enough_samples():
+    window = LatencyWindow(size=10, min_samples=5)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        window.observe(seconds)
+    assert window.percentile(50) is None
+
+    window.observe(0.5)
+    assert window.percentile(50) == 0.3
+    assert window.percentile(99) == 0.5
+
+
+def test_latency_window_keeps_only_recent_samples():
+    window = LatencyWindow(size=3, min_samples=1)
+    for seconds in (9.0, 9.0, 9.0, 1.0, 1.0, 1.0):
+        window.observe(seconds)
+    assert window.percentile(99) == 1.0
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("kb", failure_threshold=3, open_sec=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_probe_through_after_open_sec(clock):
+    breaker = CircuitBreaker("kb", failure_threshold=1, open_sec=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_breaker(clock):
+    breaker = CircuitBreaker("kb", failure_threshold=1, open_sec=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_lost_probe_is_retried_after_open_sec(clock):
+    breaker = CircuitBreaker("kb", failure_threshold=1, open_sec=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+@pytest.fixture
+def half_open(clock, monkeypatch):
+    health = UpstreamHealth("kb")
+    health.breaker = CircuitBreaker("kb", failure_threshold=1, open_sec=30)
+    health.breaker.record_failure()
+    clock.now += 30
+    monkeypatch.setitem(server._upstream_health, "kb", health)
+    return health.breaker
+
+
+async def test_cancelled_probe_releases_half_open_breaker(half_open, monkeypatch):
+    started = asyncio.Event()
+
+    async def get_token():
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(server.token_manager, "get_token", get_token)
+    probe = asyncio.create_task(server.retrieve("q", "project", "kb", "latest", 5))
+    await started.wait()
+    with pytest.raises(CircuitOpenError):
+        await server.retrieve("q", "project", "kb", "latest", 5)
+
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    assert half_open.state == CircuitBreaker.HALF_OPEN
+    assert half_open.allow()
+
+
+async def test_probe_without_outcome_releases_half_open_breaker(half_open, monkeypatch):
+    async def get_token():
+        raise RuntimeError("IAM down")
+
+    monkeypatch.setattr(server.token_manager, "get_token", get_token)
+    with pytest.raises(RuntimeError, match="IAM down"):
+        await server.retrieve("q", "project", "kb", "latest", 5)
+    assert half_open.allow()
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import server
+from server import KnowledgeBase, fuse_ranked_results
+
+
+def doc(doc_id, content=None):
+    return {"id": doc_id, "content": content or f"text {doc_id}"}
+
+
+def test_documents_found_by_several_lists_rank_higher():
+    merged = fuse_ranked_results([[doc("a"), doc("b")], [doc("c"), doc("b")]])
+    assert [d["id"] for d in merged] == ["b", "a", "c"]
+
+
+def test_first_list_wins_ties_and_keeps_its_copy():
+    first = {"id": "a", "content": "from first", "score": 0.9}
+    merged = fuse_ranked_results([[first], [{"id": "a", "content": "from second"}]])
+    assert merged == [first]
+
+
+def test_documents_without_id_are_deduplicated_by_content():
+    merged = fuse_ranked_results([[{"content": "Same  text"}], [{"content": "Same text\n"}]])
+    assert len(merged) == 1
+
+
+def test_content_key_merges_copies_from_different_bases():
+    result_sets = [[doc("kb1-7", "shared"), doc("kb1-8")], [doc("kb2-3", "shared")]]
+    assert len(fuse_ranked_results(result_sets)) == 3
+    merged = fuse_ranked_results(result_sets, key=server._content_key)
+    assert [d["id"] for d in merged] == ["kb1-7", "kb1-8"]
+
+
+def test_empty_lists_fuse_to_nothing():
+    assert fuse_ranked_results([[], []]) == []
+
+
+async def test_unavailable_knowledge_base_is_reported_not_raised(monkeypatch):
+    async def cached_retrieve(query, project_id, kb_id, kb_version, retrieve_limit):
+        if kb_id == "down":
+            raise RuntimeError("Managed RAG down недоступен")
+        return {"results": [doc(f"{kb_id}-1")]}
+
+    monkeypatch.setattr(server, "cached_retrieve", cached_retrieve)
+    bases = [KnowledgeBase("up", "v1"), KnowledgeBase("down", "v1")]
+    result = await server.retrieve_from_knowledge_bases("q", "project", bases, retrieve_limit=5)
+    assert [d["id"] for d in result["results"]] == ["up-1"]
+    assert result["unavailable_knowledge_bases"] == ["down"]
+
+
+async def test_all_knowledge_bases_down_is_an_error(monkeypatch):
+    monkeypatch.setenv("RAG_KB_TIMEOUT_SEC", "0.01")
+
+    async def cached_retrieve(query, project_id, kb_id, kb_version, retrieve_limit):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(server, "cached_retrieve", cached_retrieve)
+    bases = [KnowledgeBase("a", "v1"), KnowledgeBase("b", "v1")]
+    with pytest.raises(RuntimeError, match="Ни одна база знаний не ответила"):
+        await server.retrieve_from_knowledge_bases("q", "project", bases, retrieve_limit=5)
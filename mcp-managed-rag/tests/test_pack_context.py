@@ -0,0 +1,65 @@
+from server import _select_chunks, _trim, pack_context
+
+
+def doc(content, **metadata):
+    return {"content": content, "metadata": metadata}
+
+
+def words(n, word="слово"):
+    return " ".join(f"{word}{i}" for i in range(n))
+
+
+def test_trim_cuts_at_a_word_boundary():
+    assert _trim("short", 10) == "short"
+    trimmed = _trim("alpha beta gamma delta", 12)
+    assert trimmed == "alpha beta…"
+    assert len(trimmed) <= 12
+
+
+def test_near_duplicates_are_dropped():
+    text = words(50)
+    results = [doc(text), doc(text + " хвост"), doc(words(50, "другое"))]
+
+    selected, stats = _select_chunks(results, max_chars=10_000, max_chunk_chars=5_000, overhead=lambda el, i: 0)
+
+    assert [content for _, content in selected] == [text, words(50, "другое")]
+    assert stats.duplicates_dropped == 1
+    assert stats.chars_cut == len(text + " хвост")
+
+
+def test_budget_trims_and_then_drops_chunks():
+    results = [doc(words(100, "a")), doc(words(100, "b")), doc(words(100, "c"))]
+    budget = len(results[0]["content"]) + 300
+
+    selected, stats = _select_chunks(results, max_chars=budget, max_chunk_chars=10_000, overhead=lambda el, i: 0)
+
+    assert sum(len(content) for _, content in selected) <= budget
+    assert (stats.chunks_out, stats.chunks_trimmed, stats.over_budget_dropped) == (2, 1, 1)
+
+
+def test_cut_is_reported_in_characters_and_utf8_bytes():
+    results = [doc(words(100)), doc(words(100, "другое"))]
+
+    _, stats = _select_chunks(results, max_chars=1_000, max_chunk_chars=1_000, overhead=lambda el, i: 0)
+
+    assert stats.chars_cut > 0
+    # Cyrillic takes two bytes per character
+    assert stats.bytes_cut > stats.chars_cut
+
+
+def test_pack_context_stays_within_budget_and_projects_metadata():
+    results = [doc(words(300, "a"), title="A", secret="x"), doc(words(300, "b"), title="B")]
+
+    context, stats = pack_context(results, max_chars=2_000, max_chunk_chars=800, metadata_fields=["title"])
+
+    assert len(context) <= 2_000
+    assert context.startswith("Context:\n\nDocument 1:\nContent: ")
+    assert "Metadata: title: A" in context
+    assert "secret" not in context
+    assert stats.chunks_trimmed == 2
+
+
+def test_pack_context_keeps_all_metadata_when_not_restricted():
+    context, _ = pack_context([doc(words(60), title="A", page=3)], 5_000, 5_000, metadata_fields=None)
+
+    assert "Metadata: title: A; page: 3" in context
@@ -0,0 +1,47 @@
+import asyncio
+
+import server
+
+
+async def test_probe_reports_warm_up_then_ready(monkeypatch, token_manager):
+    monkeypatch.setattr(server, "_warmed_up", False)
+    monkeypatch.setattr(server, "_draining", False)
+    token = asyncio.Event()
+
+    async def get_token():
+        await token.wait()
+        token_manager._token = "token"
+        token_manager._expires_at = float("inf")
+        return "token"
+
+    monkeypatch.setattr(token_manager, "get_token", get_token)
+    warm_up = asyncio.create_task(server.warm_up(timeout=5))
+    await asyncio.sleep(0)
+    assert server.readiness() == "warming_up"
+
+    token.set()
+    await warm_up
+    assert server.readiness() == "ready"
+
+
+async def test_failed_warm_up_is_degraded_until_a_token_arrives(monkeypatch, token_manager):
+    monkeypatch.setattr(server, "_warmed_up", False)
+    monkeypatch.setattr(server, "_draining", False)
+
+    async def get_token():
+        raise RuntimeError("IAM down")
+
+    monkeypatch.setattr(token_manager, "get_token", get_token)
+    await server.warm_up(timeout=5)
+    assert server.readiness() == "degraded"
+
+    token_manager._token = "token"
+    token_manager._expires_at = float("inf")
+    assert server.readiness() == "ready"
+
+
+def test_draining_overrides_everything(monkeypatch):
+    monkeypatch.setattr(server, "_warmed_up", True)
+    monkeypatch.setattr(server, "_draining", True)
+
+    assert server.readiness() == "draining"
@@ -0,0 +1,117 @@
+import json
+import time
+
+import pytest
+
+import server
+from server import RetrieveCache, retrieve_cache_key
+
+
+def test_get_returns_fresh_entry_and_counts_hits():
+    cache = RetrieveCache(ttl=60)
+    cache.put("k", {"results": [1]})
+
+    assert cache.get("k") == {"results": [1]}
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entry_is_a_miss_but_served_as_stale():
+    cache = RetrieveCache(ttl=60, stale_ttl=60)
+    cache.put("k", {"results": []}, expires_at=time.time() - 1)
+
+    assert cache.get("k") is None
+    assert cache.get_stale("k") == {"results": []}
+    assert cache.stale_hits == 1
+
+
+def test_entry_past_stale_window_is_dropped():
+    cache = RetrieveCache(ttl=60, stale_ttl=1)
+    cache.put("k", {"results": []}, expires_at=time.time() - 5)
+
+    assert cache.get("k") is None
+    assert cache.get_stale("k") is None
+    assert len(cache) == 0
+    assert cache.expirations == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RetrieveCache(max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    cache.get("a")
+    cache.put("c", {"v": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.evictions == 1
+
+
+def test_byte_limit_evicts_and_skips_oversized_values():
+    value = {"text": "x" * 100}
+    size = len(json.dumps(value).encode("utf-8"))
+    cache = RetrieveCache(max_bytes=size * 2)
+    cache.put("a", value)
+    cache.put("b", value)
+    cache.put("c", value)
+    cache.put("huge", {"text": "x" * size * 3})
+
+    assert len(cache) == 2
+    assert cache.get("huge") is None
+    assert cache.stats()["bytes"] <= size * 2
+
+
+def test_cache_key_ignores_case_and_spacing():
+    assert retrieve_cache_key("  Hello   World ", "kb", "v1", 6) == retrieve_cache_key("hello world", "kb", "v1", 6)
+    assert retrieve_cache_key("hello", "kb", "v1", 6) != retrieve_cache_key("hello", "kb", "v2", 6)
+
+
+def test_dump_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = RetrieveCache()
+    cache.put("live", {"v": 1})
+    cache.put("expired", {"v": 2}, expires_at=time.time() - 1)
+    cache.dump(path)
+
+    restored = RetrieveCache()
+    restored.load(path)
+
+    assert restored.get("live") == {"v": 1}
+    assert len(restored) == 1
+
+
+def test_load_skips_malformed_entries(tmp_path):
+    path = tmp_path / "cache.json"
+    future = time.time() + 60
+    path.write_text(
+        json.dumps([["ok", future, {"v": 1}], ["short", future], [1, future, {"v": 2}], ["bad", "soon", {}], "junk"])
+    )
+    cache = RetrieveCache()
+    cache.load(str(path))
+
+    assert cache.get("ok") == {"v": 1}
+    assert len(cache) == 1
+
+
+def test_load_ignores_unreadable_file(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("{not json")
+    cache = RetrieveCache()
+    cache.load(str(path))
+    cache.load(str(tmp_path / "missing.json"))
+
+    assert len(cache) == 0
+
+
+async def test_shared_hit_keeps_remaining_ttl(shared):
+    key = retrieve_cache_key("query", "kb", "v1", 6)
+    remaining = server.retrieve_cache.ttl / 10
+    entry = {"value": {"results": ["doc"]}, "expires_at": time.time() + remaining}
+    await shared.set(server._shared_key("retrieve", key), json.dumps(entry), remaining)
+
+    result = await server.cached_retrieve("query", "project", "kb", "v1", 6)
+
+    assert result == {"results": ["doc"]}
+    assert server.retrieve_cache.shared_hits == 1
+    local_expires_at = server.retrieve_cache._entries[key][0]
+    assert local_expires_at == pytest.approx(entry["expires_at"])
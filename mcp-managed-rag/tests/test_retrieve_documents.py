@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from fastmcp import Client
+
+import server
+
+
+@pytest.fixture
+def retrieved(monkeypatch):
+    """retrieve_documents over a stubbed search of three documents; records the limit sent to the base."""
+    calls: list[int] = []
+
+    async def retrieve_from_knowledge_bases(query, project_id, knowledge_bases, retrieve_limit):
+        calls.append(retrieve_limit)
+        docs = [
+            {"id": f"d{i}", "score": 1 - i / 10, "content": f"текст {i}", "metadata": {"source": f"{i}.pdf"}}
+            for i in range(3)
+        ]
+        return {"results": docs[:retrieve_limit], "unavailable_knowledge_bases": ["kb2"]}
+
+    monkeypatch.setenv("EVOLUTION_PROJECT_ID", "project")
+    monkeypatch.setenv("KNOWLEDGE_BASES", "kb1:v1")
+    monkeypatch.setenv("RETRIEVE_LIMIT", "2")
+    monkeypatch.setattr(server, "retrieve_from_knowledge_bases", retrieve_from_knowledge_bases)
+    return calls
+
+
+async def test_documents_are_returned_as_structured_content(retrieved):
+    async with Client(server.mcp) as client:
+        result = await client.call_tool("retrieve_documents", {"query": "q", "fields": ["id", "source"]})
+
+    expected = {
+        "documents": [{"id": "d0", "metadata": {"source": "0.pdf"}}, {"id": "d1", "metadata": {"source": "1.pdf"}}],
+        "unavailable_knowledge_bases": ["kb2"],
+    }
+    assert result.structured_content == expected
+    # Clients without structuredContent read the same object from the text block
+    assert json.loads(result.content[0].text) == expected
+
+
+async def test_limit_is_capped_at_retrieve_limit(retrieved):
+    response = await server.retrieve_documents.fn("q", fields=["id"], limit=10)
+    assert [d["id"] for d in response["documents"]] == ["d0", "d1"]
+    assert retrieved == [2]
+
+    response = await server.retrieve_documents.fn("q", fields=["id"], limit=1)
+    assert [d["id"] for d in response["documents"]] == ["d0"]
+
+    with pytest.raises(ValueError, match="limit"):
+        await server.retrieve_documents.fn("q", limit=0)
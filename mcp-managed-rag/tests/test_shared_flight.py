@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import server
+from server import SharedLock
+
+
+async def test_store_renews_and_deletes_only_for_the_owner(shared):
+    assert await shared.add("lock", "a", 5)
+    assert not await shared.add("lock", "b", 5)
+
+    assert not await shared.renew("lock", "b", 5)
+    assert not await shared.delete_if("lock", "b")
+    assert await shared.renew("lock", "a", 5)
+    assert await shared.delete_if("lock", "a")
+    assert await shared.get("lock") is None
+
+
+async def test_lock_is_renewed_while_the_owner_works(shared):
+    owner = SharedLock(shared, "lock", ttl=0.06)
+    assert await owner.acquire()
+    await asyncio.sleep(0.15)
+
+    assert not await SharedLock(shared, "lock", ttl=0.06).acquire()
+    await owner.release()
+    assert await SharedLock(shared, "lock", ttl=0.06).acquire()
+
+
+async def test_release_after_expiry_keeps_the_new_owner(shared):
+    stale = SharedLock(shared, "lock")
+    assert await stale.acquire()
+    # The key expired and another worker took it over
+    await shared.delete("lock")
+    current = SharedLock(shared, "lock")
+    assert await current.acquire()
+
+    await stale.release()
+
+    assert not await SharedLock(shared, "lock").acquire()
+    await current.release()
+
+
+async def test_waiters_share_the_leader_result(shared):
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"results": ["doc"]}
+
+    results = await asyncio.gather(*(server.shared_flight("k", fetch) for _ in range(3)))
+
+    assert results == [{"results": ["doc"]}] * 3
+    assert calls == 1
+
+
+async def test_waiters_get_the_leader_error_without_retrying(shared):
+    calls = 0
+
+    async def fail():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(*(server.shared_flight("k", fail) for _ in range(3)), return_exceptions=True)
+
+    assert calls == 1
+    assert [str(r) for r in results] == ["upstream down"] * 3
+    with pytest.raises(RuntimeError):
+        await server.shared_flight("k", fail)
+    assert calls == 2
+
+
+def test_store_without_an_override_cannot_be_built():
+    class Partial(server.SharedStore):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError, match="abstract"):
+        Partial()
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from server import SingleFlight
+
+
+async def test_concurrent_calls_share_one_request():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(5)))
+
+    assert results == [1] * 5
+    assert calls == 1
+    assert (flights.leaders, flights.coalesced) == (1, 4)
+
+
+async def test_leader_error_reaches_every_waiter():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(*(flights.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+async def test_waiter_cancel_keeps_flight_for_others():
+    flights = SingleFlight()
+    started = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    first = asyncio.create_task(flights.do("k", fetch))
+    second = asyncio.create_task(flights.do("k", fetch))
+    await started.wait()
+    first.cancel()
+
+    assert await second == "ok"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+async def test_new_caller_after_last_waiter_cancels_starts_fresh_flight():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await asyncio.sleep(0.02)
+        return calls
+
+    abandoned = asyncio.create_task(flights.do("k", fetch))
+    await started.wait()
+    abandoned.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await abandoned
+
+    # The cancelled task has not finished yet; a new caller must not join it
+    assert await flights.do("k", fetch) == 2
+    assert calls == 2
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+class FakeIam:
+    """Stand-in for the IAM call: counts requests, can hold them or fail."""
+
+    def __init__(self, expires_in=600.0):
+        self.expires_in = expires_in
+        self.calls = 0
+        self.error: Exception | None = None
+        self.gate: asyncio.Event | None = None
+
+    async def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return f"token-{self.calls}", self.expires_in
+
+
+@pytest.fixture
+def iam(monkeypatch):
+    fake = FakeIam()
+    monkeypatch.setattr(server, "_fetch_access_token", fake)
+    return fake
+
+
+async def test_concurrent_callers_share_one_iam_request(token_manager, iam):
+    iam.gate = asyncio.Event()
+    callers = [asyncio.create_task(token_manager.get_token()) for _ in range(10)]
+    await asyncio.sleep(0)
+    iam.gate.set()
+
+    assert await asyncio.gather(*callers) == ["token-1"] * 10
+    assert iam.calls == 1
+
+
+async def test_refresh_starts_within_the_margin_without_blocking(token_manager, iam, clock):
+    assert await token_manager.get_token() == "token-1"
+
+    # expires_in=600, refresh_margin=60: the token is refreshed from second 540
+    clock.now += 539
+    assert await token_manager.get_token() == "token-1"
+    await asyncio.sleep(0)
+    assert iam.calls == 1
+
+    clock.now += 2
+    iam.gate = asyncio.Event()
+    assert await token_manager.get_token() == "token-1"
+    await asyncio.sleep(0)
+    assert iam.calls == 2
+    iam.gate.set()
+    await token_manager._inflight
+    assert await token_manager.get_token() == "token-2"
+
+
+async def test_background_refresh_backs_off_up_to_the_maximum(token_manager, iam, monkeypatch):
+    iam.error = RuntimeError("IAM down")
+    backoffs: list[float] = []
+    enough = asyncio.Event()
+
+    def uniform(low, high):
+        backoffs.append(high)
+        if len(backoffs) == 5:
+            enough.set()
+        return 0.0
+
+    monkeypatch.setattr(server, "random", SimpleNamespace(uniform=uniform))
+    token_manager.start()
+    await asyncio.wait_for(enough.wait(), 1)
+
+    # backoff_base=0.01, backoff_max=0.04
+    assert backoffs == [0.01, 0.02, 0.04, 0.04, 0.04]
+
+
+async def test_token_that_expired_while_iam_fails_is_not_returned(token_manager, iam, clock):
+    assert await token_manager.get_token() == "token-1"
+    iam.error = RuntimeError("IAM down")
+
+    # Within the margin the current token is still served while the refresh fails
+    clock.now += 590
+    assert await token_manager.get_token() == "token-1"
+
+    clock.now += 11
+    assert not token_manager.has_token
+    with pytest.raises(RuntimeError, match="IAM down"):
+        await token_manager.get_token()
+
+
+async def test_rejected_token_is_refreshed_once(token_manager, iam):
+    assert await token_manager.get_token() == "token-1"
+
+    first, second = await asyncio.gather(
+        token_manager.refresh(stale_token="token-1"), token_manager.refresh(stale_token="token-1")
+    )
+    assert first == second == "token-2"
+    assert await token_manager.refresh(stale_token="token-1") == "token-2"
+    assert iam.calls == 2